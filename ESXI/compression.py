@@ -0,0 +1,72 @@
+"""HTTP 响应压缩（gzip，安装了 brotli 时优先使用 br）。
+
+`init_app(app)` 注册 after_request：对未压缩的 JSON / 文本响应按 Accept-Encoding 压缩。
+以下响应保持原样：已有 Content-Encoding（例如 response_cache 预压缩的响应体）、
+流式响应（SSE）、文件直传、非 200 响应以及小于 MIN_BYTES 的响应体。
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_BYTES = 1024
+GZIP_LEVEL = 6
+# 动态响应使用中等级别；静态文件只压缩一次，使用最高级别（见 web_assets.py）
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/')
+
+
+def available_encodings() -> tuple:
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding: str, offered=None):
+    """按服务端偏好（br 优先于 gzip）返回客户端接受的编码，都不接受时返回 None。"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if token:
+            accepted[token.strip().lower()] = q
+    for encoding in offered or available_encodings():
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, quality: int = None) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY if quality is None else quality)
+    return gzip.compress(body, GZIP_LEVEL if quality is None else quality)
+
+
+def is_compressible(mimetype: str) -> bool:
+    return bool(mimetype) and mimetype != 'text/event-stream' and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def init_app(app) -> None:
+    from flask import request
+
+    @app.after_request
+    def _compress_response(response):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers or not is_compressible(response.mimetype)):
+            return response
+        body = response.get_data()
+        if len(body) < MIN_BYTES:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
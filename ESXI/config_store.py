@@ -0,0 +1,246 @@
+"""按 (配置名, 区域) 存储的结构化配置（VM/vm_control.py 与 control.py 共用）。
+
+`vm_config.py` 中的 VM_ID / VM_IP / VM_INFO / VM_INER_DEVICE 等都是 { 区域: 值 } 形式的大字典。
+过去每个 Stage 都会 exec() 整个文件、修改一个区域、再用 repr() 重写全部内容。这里改为在同名的
+SQLite 文件（例如 vm_config.db）中每个 (配置名, 区域) 一行，值仍为 Python 字面量（repr / ast.literal_eval，
+与原来的 .py 文件相同，元组读出后仍是元组，例如 VM_INER_DEVICE 中的四元组）：
+
+- 读取时只解析用到的那一行（`get`），不再加载其它区域；
+- 写入一个区域只改写这一行，并在单个事务中完成（`set`），其它区域不受影响；
+- 非字典的配置项（ESXI_USER 等）以区域 '' 存为一行（`set_all` / `get_all`）。
+
+.py 文件只作为种子（用 ast.literal_eval 解析，不执行文件）：只导入 DB 中还没有的配置项，
+DB 中已有的配置项（例如 Stage_Init_* 写入的结果）不会被 .py 文件覆盖。文件 mtime 未变时跳过解析。
+
+用法:
+    store = config_store.open_store('/path/to/vm_config.py')
+    ips = store.get('VM_IP', 's05', {})
+    store.set('VM_IP', 's05', {'vm1': '10.0.0.1'})
+"""
+import ast
+import json
+import os
+import sqlite3
+import threading
+
+import esxi_db
+
+# 非字典配置项使用的区域名
+SCALAR_REGION = ''
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS config_entry (
+    name TEXT NOT NULL,
+    region TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY(name, region)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS config_meta (
+    name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL       -- 'table': { 区域: 值 }；'scalar': 单个值
+);
+CREATE TABLE IF NOT EXISTS config_seed (
+    path TEXT PRIMARY KEY,
+    mtime REAL
+);
+'''
+
+
+def _dumps(value) -> str:
+    return repr(value)
+
+
+def _loads(text: str):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        # 早期版本以 JSON 存储（true / false / null 不是 Python 字面量）
+        return json.loads(text)
+
+
+def parse_py_literals(path: str) -> dict:
+    """解析 .py 配置文件中 `NAME = <字面量>` 形式的顶层赋值，不执行文件。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                values[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                continue
+    return values
+
+
+class ConfigStore:
+    def __init__(self, db_path: str, seed_path: str = None):
+        self.db_path = db_path
+        self.seed_path = seed_path
+        self._lock = threading.Lock()
+        conn = self._conn()
+        try:
+            try:
+                conn.execute('PRAGMA journal_mode = WAL')
+            except sqlite3.DatabaseError:
+                pass
+            conn.executescript(_SCHEMA)
+            if seed_path:
+                self._sync_seed(conn)
+        finally:
+            conn.close()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=esxi_db.BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                               factory=esxi_db._TimedConnection)
+        esxi_db._apply_pragmas(conn)
+        return conn
+
+    # ----------------- 从 .py 导入 -----------------
+
+    def _sync_seed(self, conn: sqlite3.Connection) -> None:
+        """首次打开或 .py 文件被修改后，导入 DB 中还没有的配置项；已有的配置项保持不变。"""
+        if not os.path.exists(self.seed_path):
+            return
+        mtime = os.path.getmtime(self.seed_path)
+        row = conn.execute('SELECT mtime FROM config_seed WHERE path = ?', (self.seed_path,)).fetchone()
+        if row and row[0] == mtime:
+            return
+        try:
+            values = parse_py_literals(self.seed_path)
+        except (OSError, SyntaxError) as e:
+            print(f"读取 {self.seed_path} 失败: {e}")
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            existing = {r[0] for r in conn.execute('SELECT name FROM config_meta')}
+            for name, value in values.items():
+                if name not in existing:
+                    self._replace(conn, name, value)
+            conn.execute('INSERT OR REPLACE INTO config_seed (path, mtime) VALUES (?, ?)', (self.seed_path, mtime))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    # ----------------- 内部写入 -----------------
+
+    @staticmethod
+    def _kind(conn: sqlite3.Connection, name: str) -> str:
+        row = conn.execute('SELECT kind FROM config_meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _replace(conn: sqlite3.Connection, name: str, value) -> None:
+        """整体替换一个配置项（在调用方的事务中执行）；只改写内容变化的行。"""
+        if isinstance(value, dict):
+            kind = 'table'
+            rows = {str(region): _dumps(v) for region, v in value.items()}
+        else:
+            kind = 'scalar'
+            rows = {SCALAR_REGION: _dumps(value)}
+        conn.execute('INSERT INTO config_meta (name, kind) VALUES (?, ?) '
+                     'ON CONFLICT(name) DO UPDATE SET kind = excluded.kind', (name, kind))
+        existing = {r for (r,) in conn.execute('SELECT region FROM config_entry WHERE name = ?', (name,))}
+        stale = existing - set(rows)
+        if stale:
+            conn.executemany('DELETE FROM config_entry WHERE name = ? AND region = ?', [(name, r) for r in stale])
+        conn.executemany('INSERT INTO config_entry (name, region, value) VALUES (?, ?, ?) '
+                         'ON CONFLICT(name, region) DO UPDATE SET value = excluded.value '
+                         'WHERE config_entry.value IS NOT excluded.value',
+                         [(name, r, v) for r, v in rows.items()])
+
+    # ----------------- 公共接口 -----------------
+
+    def names(self) -> list:
+        conn = self._conn()
+        try:
+            return [r[0] for r in conn.execute('SELECT name FROM config_meta ORDER BY name')]
+        finally:
+            conn.close()
+
+    def regions(self, name: str) -> list:
+        conn = self._conn()
+        try:
+            return [r[0] for r in conn.execute('SELECT region FROM config_entry WHERE name = ? ORDER BY region', (name,))]
+        finally:
+            conn.close()
+
+    def get(self, name: str, region: str = SCALAR_REGION, default=None):
+        """读取一个区域的值（非字典配置项省略 region）；不存在时返回 default。"""
+        conn = self._conn()
+        try:
+            row = conn.execute('SELECT value FROM config_entry WHERE name = ? AND region = ?',
+                               (name, region)).fetchone()
+        finally:
+            conn.close()
+        return _loads(row[0]) if row else default
+
+    def get_all(self, name: str, default=None):
+        """读取整个配置项：字典配置项返回 { 区域: 值 }，其它返回单个值。"""
+        conn = self._conn()
+        try:
+            kind = self._kind(conn, name)
+            if kind is None:
+                return default
+            rows = conn.execute('SELECT region, value FROM config_entry WHERE name = ?', (name,)).fetchall()
+        finally:
+            conn.close()
+        if kind == 'scalar':
+            return _loads(rows[0][1]) if rows else default
+        return {region: _loads(value) for region, value in rows}
+
+    def set(self, name: str, region: str, value) -> None:
+        """原子写入一个区域的值（非字典配置项使用 `set_all`）。"""
+        with self._lock:
+            conn = self._conn()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.execute("INSERT INTO config_meta (name, kind) VALUES (?, 'table') ON CONFLICT(name) DO NOTHING",
+                                 (name,))
+                    conn.execute('INSERT INTO config_entry (name, region, value) VALUES (?, ?, ?) '
+                                 'ON CONFLICT(name, region) DO UPDATE SET value = excluded.value',
+                                 (name, region, _dumps(value)))
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            finally:
+                conn.close()
+
+    def set_all(self, name: str, value) -> None:
+        """原子替换整个配置项（字典按区域差量写入，删除不再存在的区域）。"""
+        with self._lock:
+            conn = self._conn()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    self._replace(conn, name, value)
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+            finally:
+                conn.close()
+
+    def delete(self, name: str, region: str) -> None:
+        conn = self._conn()
+        try:
+            conn.execute('DELETE FROM config_entry WHERE name = ? AND region = ?', (name, region))
+        finally:
+            conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(seed_path: str) -> ConfigStore:
+    """返回与 seed_path（例如 vm_config.py）对应的存储，数据库位于同目录的同名 .db 文件。"""
+    seed_path = os.path.abspath(seed_path)
+    with _stores_lock:
+        store = _stores.get(seed_path)
+        if store is None:
+            store = ConfigStore(os.path.splitext(seed_path)[0] + '.db', seed_path)
+            _stores[seed_path] = store
+        return store
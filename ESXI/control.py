@@ -1,12 +1,19 @@
 import atexit
 import ssl
-import os
 import sqlite3
-import paramiko
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Dict, Any
 from pyVim import connect
-from pyVmomi import vim
+from pyVmomi import vim, vmodl
 from esxi_config import ESXI_IP
+from vcenter_config import VCENTER
+import config_store
+import esxi_db
+import inner_iface
+import metrics
+import ssh_pool
 
 # --- ESXi 连接信息 (请修改为你的实际信息) ---
 ESXI_HOST = "10.112.221.173"
@@ -14,6 +21,9 @@ ESXI_USER = "root"
 ESXI_PASS = "410@Bupt"
 # 用于写入的外层索引，例如 's05'
 ESXI_KEY = "s05"
+# 并发刷新区域时的最大线程数，以及单个区域允许的最长耗时（秒）
+INIT_MAX_WORKERS = 5
+INIT_REGION_TIMEOUT = 300
 
 def get_vm_by_name(content, vm_name):
     """根据名称查找虚拟机对象"""
@@ -28,100 +38,211 @@ def get_vm_by_name(content, vm_name):
     return None
 
 
+# PropertyCollector 一次批量取回的 VM 属性（name / guest.net / 虚拟硬件设备列表）
+VM_PROPERTIES = ('name', 'guest.net', 'config.hardware.device')
+# RetrievePropertiesEx 每页返回的最大对象数
+RETRIEVE_PAGE_SIZE = 500
+
+
+def _container_filter_spec(view, obj_type, path_set):
+    """构造遍历 ContainerView 中所有 obj_type 对象、读取 path_set 属性的 FilterSpec。"""
+    return _container_multi_filter_spec(view, {obj_type: path_set})
+
+
+def _container_multi_filter_spec(view, type_paths: dict):
+    """同 `_container_filter_spec`，但一个 FilterSpec 同时读取多种对象: { obj_type: path_set }。"""
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(
+        name='traverseView', path='view', skip=False, type=vim.view.ContainerView)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+    prop_specs = [vmodl.query.PropertyCollector.PropertySpec(type=obj_type, pathSet=list(path_set), all=False)
+                  for obj_type, path_set in type_paths.items()]
+    return vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=prop_specs)
+
+
+def _retrieve_object_properties(content, obj, path_set) -> dict:
+    """读取单个托管对象的属性，返回结构同 `_retrieve_properties` 的一行。"""
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=obj, skip=False)
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=type(obj), pathSet=list(path_set), all=False)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+    row = {'obj': obj, 'moid': obj._GetMoId()}
+    for obj_content in content.propertyCollector.RetrieveContents([filter_spec]) or []:
+        for prop in obj_content.propSet or []:
+            row[prop.name] = prop.val
+    return row
+
+
+def _retrieve_properties(content, obj_type, path_set, page_size: int = RETRIEVE_PAGE_SIZE) -> list:
+    """通过 PropertyCollector 批量读取某类托管对象的属性。
+
+    使用 ContainerView + RetrievePropertiesEx/ContinueRetrievePropertiesEx 分页读取，
+    所有对象的所有属性在一次（分页）调用中返回，而不是每个属性一次 SOAP 往返。
+
+    返回: [ {'obj': <托管对象>, 'moid': <MoID>, <属性路径>: <值>, ...}, ... ]
+    未设置的属性（例如没有 VMware Tools 时的 guest.net）不会出现在字典中。
+    """
+    return _retrieve_multi_properties(content, {obj_type: path_set}, page_size)
+
+
+def _retrieve_multi_properties(content, type_paths: dict, page_size: int = RETRIEVE_PAGE_SIZE) -> list:
+    """同 `_retrieve_properties`，但在同一次分页读取中返回多种对象（{ obj_type: path_set }）。
+
+    各类对象混在同一个结果列表中，调用方按 row['obj'] 的类型区分。
+    """
+    view = content.viewManager.CreateContainerView(content.rootFolder, list(type_paths), True)
+    try:
+        filter_spec = _container_multi_filter_spec(view, type_paths)
+        options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size)
+
+        pc = content.propertyCollector
+        rows = []
+        result = pc.RetrievePropertiesEx([filter_spec], options)
+        while result:
+            for obj_content in result.objects or []:
+                row = {'obj': obj_content.obj, 'moid': obj_content.obj._GetMoId()}
+                for prop in obj_content.propSet or []:
+                    row[prop.name] = prop.val
+                rows.append(row)
+            if not result.token:
+                break
+            result = pc.ContinueRetrievePropertiesEx(result.token)
+        return rows
+    finally:
+        try:
+            view.Destroy()
+        except Exception:
+            pass
+
+
+def _vm_nic_map(props: dict) -> dict:
+    """根据一台 VM 的属性（见 VM_PROPERTIES）构造 { nic_name: {'mac':..., 'ips':[...], 'device_key':...} }。
+
+    nic_name 取 guest.net 中的 network；为空时回退到硬件设备列表中对应网卡的端口组名称。
+    device_key 为该网卡在 vSphere 虚拟硬件中的设备 key（未知时为 None），用于判断虚拟硬件是否变化。
+    """
+    backing_names = {}
+    mac_keys = {}
+    for dev in props.get('config.hardware.device') or []:
+        if isinstance(dev, vim.vm.device.VirtualEthernetCard):
+            backing_names[dev.key] = getattr(getattr(dev, 'backing', None), 'deviceName', None)
+            if getattr(dev, 'macAddress', None):
+                mac_keys[dev.macAddress.lower()] = dev.key
+
+    nic_dict = {}
+    for nic in props.get('guest.net') or []:
+        mac = getattr(nic, 'macAddress', '') or ''
+        device_key = getattr(nic, 'deviceConfigId', None)
+        if device_key is None or device_key < 0:
+            device_key = mac_keys.get(mac.lower())
+        nic_name = nic.network or backing_names.get(device_key) or 'unknown'
+        nic_dict[nic_name] = {
+            'mac': getattr(nic, 'macAddress', ''),
+            'ips': list(getattr(nic, 'ipAddress', []) or []),
+            'device_key': device_key,
+        }
+    return nic_dict
+
+
+def collect_esxi_region(content, host_key: str) -> tuple:
+    """一次 PropertyCollector 批量读取，同时得到 inventory 与 VM MoID 映射。
+
+    返回: (inventory, vmids)
+      inventory: { host_key: { vm_name: { nic_name: { 'mac':..., 'ips':[...]} } } }
+      vmids:     { host_key: { vm_name: vm_moid } }
+
+    读取失败（包括分页读取中途超时）时抛出异常，不返回部分结果：调用方会把结果整体写入 DB
+    并删除其中没有的 VM，不完整的结果会连带删除这些 VM 的网卡与 inner_nic 记录。
+    """
+    inventory = {host_key: {}}
+    vmids = {host_key: {}}
+    for props in _retrieve_properties(content, vim.VirtualMachine, VM_PROPERTIES):
+        vm_name = props.get('name')
+        if not vm_name:
+            continue
+        # 没有 VMware Tools 或无网络信息时 guest.net 缺失，仍然保留空结构
+        inventory[host_key][vm_name] = _vm_nic_map(props)
+        vmids[host_key][vm_name] = props['moid']
+    return inventory, vmids
+
+
+# vCenter 模式下额外读取的 HostSystem 属性: 名称与 VMkernel 网卡（用于按管理 IP 匹配区域）
+HOST_PROPERTIES = ('name', 'config.network.vnic')
+
+
+def _host_region_map(host_rows: list, regions: Dict[str, str], host_names: Dict[str, str]) -> dict:
+    """把 vCenter 中的 HostSystem 映射到 esxi_key，返回 { host_moid: esxi_key }。
+
+    匹配顺序: host_names 中显式配置的主机名 -> 主机名等于区域 IP -> 某个 vmk 网卡 IP 等于区域 IP。
+    """
+    by_name = {name: key for key, name in (host_names or {}).items() if key in regions}
+    by_ip = {ip: key for key, ip in regions.items()}
+    mapping = {}
+    for row in host_rows:
+        name = row.get('name')
+        key = by_name.get(name) or by_ip.get(name)
+        if key is None:
+            for vnic in row.get('config.network.vnic') or []:
+                ip = getattr(getattr(getattr(vnic, 'spec', None), 'ip', None), 'ipAddress', None)
+                if ip in by_ip:
+                    key = by_ip[ip]
+                    break
+        if key is not None:
+            mapping[row['moid']] = key
+    return mapping
+
+
+def collect_vcenter_regions(content, regions: Dict[str, str], host_names: Dict[str, str] = None) -> tuple:
+    """在一个 vCenter 会话中，用一次分页读取同时收集所有 HostSystem 与 VirtualMachine，
+    再按 VM 所在主机（runtime.host）分到各自的区域。
+
+    regions: { esxi_key: ESXi 管理 IP }（通常为 ESXI_IP）
+    返回: (inventory, vmids)，结构同 `collect_esxi_region`，但包含所有匹配到的区域；
+    vCenter 中找不到对应主机的区域不会出现在结果中。出错时抛出异常，由调用方回退。
+
+    注意: 此模式下 vmids 中的 MoID 是 vCenter 的 MoID（例如 'vm-123'），而不是 ESXi 本机的 vmid。
+    """
+    rows = _retrieve_multi_properties(content, {
+        vim.HostSystem: HOST_PROPERTIES,
+        vim.VirtualMachine: VM_PROPERTIES + ('runtime.host',),
+    })
+    host_rows = [r for r in rows if isinstance(r['obj'], vim.HostSystem)]
+    host_region = _host_region_map(host_rows, regions, host_names)
+
+    inventory = {key: {} for key in set(host_region.values())}
+    vmids = {key: {} for key in inventory}
+    for props in rows:
+        if not isinstance(props['obj'], vim.VirtualMachine):
+            continue
+        vm_name = props.get('name')
+        host = props.get('runtime.host')
+        esxi_key = host_region.get(host._GetMoId()) if host is not None else None
+        if not vm_name or esxi_key is None:
+            continue
+        inventory[esxi_key][vm_name] = _vm_nic_map(props)
+        vmids[esxi_key][vm_name] = props['moid']
+    return inventory, vmids
+
+
 def collect_esxi_inventory(content, host_key: str) -> dict:
     """遍历所有虚拟机，收集外部网卡名称 -> MAC -> IP。
 
     返回结构: { host_key: { vm_name: { nic_name: { 'mac':..., 'ips':[...]} } } }
     如果 VM 没有 VMware Tools 或无网络信息，会在结果中保留空结构。
     """
-    inventory = {host_key: {}}
-    try:
-        vm_container = content.viewManager.CreateContainerView(
-            content.rootFolder, [vim.VirtualMachine], True)
-        for vm in vm_container.view:
-            vm_name = vm.name
-            guest = getattr(vm, 'guest', None)
-            if not guest or not getattr(guest, 'net', None):
-                # 没有 VMware Tools 或无网络信息，仍然添加空结构
-                inventory[host_key].setdefault(vm_name, {})
-                continue
-
-            nic_dict = {}
-            for nic in guest.net:
-                nic_name = nic.network or 'unknown'
-                nic_dict[nic_name] = {
-                    'mac': getattr(nic, 'macAddress', ''),
-                    'ips': list(getattr(nic, 'ipAddress', []) or [])
-                }
-            inventory[host_key][vm_name] = nic_dict
-        return inventory
-    except Exception as e:
-        print(f"收集 inventory 出错: {e}")
-        return inventory
+    inventory, _ = collect_esxi_region(content, host_key)
+    return inventory
 
 
 # ----------------- SQLite persistence helpers -----------------
-DB_FILENAME = os.path.join(os.path.dirname(__file__), 'esxi_data.db')
+DB_FILENAME = esxi_db.DB_FILENAME
 
 
 def _get_db_conn():
-    """返回 sqlite3 连接并确保数据库表已创建。"""
-    conn = sqlite3.connect(DB_FILENAME)
-    conn.row_factory = sqlite3.Row
-    try:
-        # enable foreign key cascade behavior
-        conn.execute('PRAGMA foreign_keys = ON')
-    except Exception:
-        pass
-    _ensure_db(conn)
-    return conn
+    """返回 sqlite3 连接并确保数据库 schema 为最新版本（见 `esxi_db`）。"""
+    return esxi_db.get_conn(DB_FILENAME)
 
 
 def _ensure_db(conn: sqlite3.Connection) -> None:
-    cur = conn.cursor()
-    # vm table stores vm rows; esxi_key is used to group by region
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS vm (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        esxi_key TEXT NOT NULL,
-        name TEXT NOT NULL,
-        vm_vmid TEXT,
-        vm_moid TEXT,
-        UNIQUE(esxi_key, name)
-    )
-    ''')
-    # nic table stores external nic info per vm
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS nic (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        vm_id INTEGER NOT NULL,
-        name TEXT NOT NULL,
-        mac TEXT,
-        source TEXT,
-        FOREIGN KEY(vm_id) REFERENCES vm(id) ON DELETE CASCADE
-    )
-    ''')
-    # nic_ip table stores ip addresses per nic
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS nic_ip (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nic_id INTEGER NOT NULL,
-        ip TEXT NOT NULL,
-        FOREIGN KEY(nic_id) REFERENCES nic(id) ON DELETE CASCADE,
-        UNIQUE(nic_id, ip)
-    )
-    ''')
-    # inner_nic table: store internal interface names discovered inside the VM
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS inner_nic (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        nic_id INTEGER NOT NULL,
-        mac TEXT,
-        inner_name TEXT,
-        FOREIGN KEY(nic_id) REFERENCES nic(id) ON DELETE CASCADE
-    )
-    ''')
-    conn.commit()
+    esxi_db.migrate(conn)
 
 
 # ----------------- 公共查询 API -----------------
@@ -207,39 +328,181 @@ def query_esxi_inventory(esxi_key: str) -> dict:
 # ----------------- end Public API -----------------
 
 
-def save_inventory_to_db(esxi_key: str, inventory_region: Dict[str, Any]) -> None:
-    """将给定区域的 inventory 写入 DB（覆盖）。
+def _nic_key(vm_id: int, nic_name: str, mac: str) -> tuple:
+    """nic 行的稳定标识：(vm_id, mac)；没有 MAC 的网卡退化为按名称识别。"""
+    mac = (mac or '').strip().lower()
+    return (vm_id, 'mac', mac) if mac else (vm_id, 'name', nic_name)
+
+
+def _diff_write_vms(cur: sqlite3.Cursor, esxi_key: str, inventory_region: Dict[str, Any],
+                    prune_vms: bool = True) -> dict:
+    """以 (esxi_key, vm 名称, nic mac) 为键，把 inventory_region 差量写入 vm / nic / nic_ip。
+
+    只插入新增行、更新发生变化的行、删除消失的行；未变化的 nic 保留原有 id，
+    因此挂在其上的 inner_nic 记录（以及基于 nic.id 的缓存）不会被级联删除。
+
+    prune_vms: True 时删除区域内不在 inventory_region 中的 VM（整区域写入）；
+               False 时只处理 inventory_region 中列出的 VM（单 VM 增量写入）。
+    返回各类变更的计数。
+    """
+    stats = dict.fromkeys(('vms_added', 'vms_removed', 'nics_added', 'nics_updated',
+                           'nics_removed', 'ips_added', 'ips_removed'), 0)
+    names = list(inventory_region.keys())
+    if prune_vms:
+        scope_sql, scope_args = "vm.esxi_key = ?", [esxi_key]
+    else:
+        if not names:
+            return stats
+        scope_sql = "vm.esxi_key = ? AND vm.name IN (%s)" % ','.join(['?'] * len(names))
+        scope_args = [esxi_key] + names
+
+    # ---- vm ----
+    cur.execute(f"SELECT id, name FROM vm WHERE {scope_sql}", scope_args)
+    vm_ids = {r['name']: r['id'] for r in cur.fetchall()}
+    new_vms = [(esxi_key, n) for n in names if n not in vm_ids]
+    if new_vms:
+        cur.executemany("INSERT INTO vm (esxi_key, name) VALUES (?, ?)", new_vms)
+        stats['vms_added'] = len(new_vms)
+    if prune_vms:
+        gone = [(vid,) for n, vid in vm_ids.items() if n not in inventory_region]
+        if gone:
+            cur.executemany("DELETE FROM vm WHERE id = ?", gone)
+            stats['vms_removed'] = len(gone)
+    if new_vms or (prune_vms and stats['vms_removed']):
+        cur.execute(f"SELECT id, name FROM vm WHERE {scope_sql}", scope_args)
+        vm_ids = {r['name']: r['id'] for r in cur.fetchall()}
+
+    # ---- nic ----
+    cur.execute(f"SELECT nic.id, nic.vm_id, nic.name, nic.mac, nic.source, nic.device_key FROM nic "
+                f"JOIN vm ON vm.id = nic.vm_id WHERE {scope_sql}", scope_args)
+    existing_nics = {}
+    dup_nics = []
+    for r in cur.fetchall():
+        key = _nic_key(r['vm_id'], r['name'], r['mac'])
+        if key in existing_nics:
+            dup_nics.append((r['id'],))
+        else:
+            existing_nics[key] = r
+
+    desired = {}  # key -> (vm_id, nic_name, mac, ips, device_key)
+    for vm_name, nic_map in inventory_region.items():
+        vm_id = vm_ids[vm_name]
+        if not isinstance(nic_map, dict):
+            continue
+        for nic_name, nic_info in nic_map.items():
+            nic_info = nic_info if isinstance(nic_info, dict) else {}
+            mac = nic_info.get('mac', '') or ''
+            key = _nic_key(vm_id, nic_name, mac)
+            if key in desired:
+                # 同一 VM 出现重复 MAC 时按名称区分
+                key = (vm_id, 'name', nic_name)
+            desired[key] = (vm_id, nic_name, mac, nic_info.get('ips', []) or [], nic_info.get('device_key'))
+
+    nic_inserts, nic_updates = [], []
+    for key, (vm_id, nic_name, mac, _, device_key) in desired.items():
+        row = existing_nics.get(key)
+        if row is None:
+            nic_inserts.append((vm_id, nic_name, mac, 'guest', device_key))
+        elif (row['name'] != nic_name or (row['mac'] or '') != mac or row['source'] != 'guest'
+              or row['device_key'] != device_key):
+            nic_updates.append((nic_name, mac, 'guest', device_key, row['id']))
+    nic_deletes = [(r['id'],) for key, r in existing_nics.items() if key not in desired] + dup_nics
+
+    if nic_deletes:
+        cur.executemany("DELETE FROM nic WHERE id = ?", nic_deletes)
+    if nic_updates:
+        cur.executemany("UPDATE nic SET name = ?, mac = ?, source = ?, device_key = ? WHERE id = ?", nic_updates)
+    if nic_inserts:
+        cur.executemany("INSERT INTO nic (vm_id, name, mac, source, device_key) VALUES (?, ?, ?, ?, ?)", nic_inserts)
+    stats.update(nics_added=len(nic_inserts), nics_updated=len(nic_updates), nics_removed=len(nic_deletes))
+
+    if nic_inserts:
+        # 重新读取以获得新插入 nic 的 id
+        cur.execute(f"SELECT nic.id, nic.vm_id, nic.name, nic.mac FROM nic "
+                    f"JOIN vm ON vm.id = nic.vm_id WHERE {scope_sql}", scope_args)
+        nic_ids = {}
+        for r in cur.fetchall():
+            nic_ids.setdefault(_nic_key(r['vm_id'], r['name'], r['mac']), r['id'])
+            nic_ids.setdefault((r['vm_id'], 'name', r['name']), r['id'])
+    else:
+        nic_ids = {key: r['id'] for key, r in existing_nics.items()}
+        for r in existing_nics.values():
+            nic_ids.setdefault((r['vm_id'], 'name', r['name']), r['id'])
+
+    # ---- nic_ip ----
+    cur.execute(f"SELECT nic_ip.nic_id, nic_ip.ip FROM nic_ip JOIN nic ON nic.id = nic_ip.nic_id "
+                f"JOIN vm ON vm.id = nic.vm_id WHERE {scope_sql}", scope_args)
+    existing_ips = set((r['nic_id'], r['ip']) for r in cur.fetchall())
+    desired_ips = set()
+    for key, (_, _, _, ips, _) in desired.items():
+        nic_id = nic_ids.get(key)
+        if nic_id is None:
+            continue
+        for ip in ips:
+            desired_ips.add((nic_id, ip))
+    ip_inserts = sorted(desired_ips - existing_ips)
+    ip_deletes = sorted(existing_ips - desired_ips)
+    if ip_deletes:
+        cur.executemany("DELETE FROM nic_ip WHERE nic_id = ? AND ip = ?", ip_deletes)
+    if ip_inserts:
+        cur.executemany("INSERT OR IGNORE INTO nic_ip (nic_id, ip) VALUES (?, ?)", ip_inserts)
+    stats.update(ips_added=len(ip_inserts), ips_removed=len(ip_deletes))
+    if any(stats.values()):
+        esxi_db.bump_data_version(cur, esxi_key)
+    return stats
+
+
+def save_inventory_to_db(esxi_key: str, inventory_region: Dict[str, Any]) -> dict:
+    """将给定区域的 inventory 差量写入 DB（结果等同覆盖，但只改动发生变化的行）。
 
     参数 inventory_region: mapping vm_name -> { nic_name: {'mac':..., 'ips':[...]} }
+    返回变更计数（见 `_diff_write_vms`）；出错时返回空字典。
     """
     conn = _get_db_conn()
     cur = conn.cursor()
     try:
-        # Delete existing VMs for this esxi_key (cascade will remove nics and nic_ip)
         cur.execute("BEGIN")
-        cur.execute("DELETE FROM vm WHERE esxi_key = ?", (esxi_key,))
-
-        for vm_name, nic_map in inventory_region.items():
-            cur.execute("INSERT INTO vm (esxi_key, name) VALUES (?, ?)", (esxi_key, vm_name))
-            vm_id = cur.lastrowid
-            if isinstance(nic_map, dict):
-                for nic_name, nic_info in nic_map.items():
-                    mac = nic_info.get('mac', '') if isinstance(nic_info, dict) else ''
-                    cur.execute("INSERT INTO nic (vm_id, name, mac, source) VALUES (?, ?, ?, ?)",
-                                (vm_id, nic_name, mac, 'guest'))
-                    nic_id = cur.lastrowid
-                    ips = []
-                    if isinstance(nic_info, dict):
-                        ips = nic_info.get('ips', []) or []
-                    for ip in ips:
-                        try:
-                            cur.execute("INSERT OR IGNORE INTO nic_ip (nic_id, ip) VALUES (?, ?)", (nic_id, ip))
-                        except Exception:
-                            pass
+        stats = _diff_write_vms(cur, esxi_key, inventory_region, prune_vms=True)
         conn.commit()
+        return stats
     except Exception as e:
         conn.rollback()
         print(f"[DB] 保存 inventory 到 DB 出错: {e}")
+        return {}
+    finally:
+        conn.close()
+
+
+def save_vm_to_db(esxi_key: str, vm_name: str, nic_map: Dict[str, Any], vm_moid: str = None) -> dict:
+    """差量写入单台 VM 的网卡与 IP 信息，供增量同步使用；不影响区域内其它 VM。"""
+    conn = _get_db_conn()
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN")
+        stats = _diff_write_vms(cur, esxi_key, {vm_name: nic_map}, prune_vms=False)
+        if vm_moid:
+            cur.execute("UPDATE vm SET vm_moid = ? WHERE esxi_key = ? AND name = ?", (str(vm_moid), esxi_key, vm_name))
+        conn.commit()
+        return stats
+    except Exception as e:
+        conn.rollback()
+        print(f"[DB] 保存 VM {esxi_key}/{vm_name} 到 DB 出错: {e}")
+        return {}
+    finally:
+        conn.close()
+
+
+def delete_vm_from_db(esxi_key: str, vm_name: str) -> None:
+    """删除单台 VM（级联删除其 nic / nic_ip / inner_nic）。"""
+    conn = _get_db_conn()
+    try:
+        cur = conn.execute("DELETE FROM vm WHERE esxi_key = ? AND name = ?", (esxi_key, vm_name))
+        if cur.rowcount:
+            esxi_db.bump_data_version(cur, esxi_key)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[DB] 删除 VM {esxi_key}/{vm_name} 出错: {e}")
     finally:
         conn.close()
 
@@ -253,14 +516,14 @@ def save_vmids_to_db(esxi_key: str, vmids_map: Dict[str, str]) -> None:
     cur = conn.cursor()
     try:
         cur.execute("BEGIN")
-        for vm_name, vm_moid in vmids_map.items():
-            # try update existing
-            cur.execute("SELECT id FROM vm WHERE esxi_key = ? AND name = ?", (esxi_key, vm_name))
-            r = cur.fetchone()
-            if r:
-                cur.execute("UPDATE vm SET vm_moid = ? WHERE id = ?", (str(vm_moid), r['id']))
-            else:
-                cur.execute("INSERT INTO vm (esxi_key, name, vm_moid) VALUES (?, ?, ?)", (esxi_key, vm_name, str(vm_moid)))
+        # upsert：只有 vm_moid 实际变化的行才会被改写
+        cur.executemany("""
+            INSERT INTO vm (esxi_key, name, vm_moid) VALUES (?, ?, ?)
+            ON CONFLICT(esxi_key, name) DO UPDATE SET vm_moid = excluded.vm_moid
+            WHERE vm.vm_moid IS NOT excluded.vm_moid
+        """, [(esxi_key, vm_name, str(vm_moid)) for vm_name, vm_moid in vmids_map.items()])
+        if cur.rowcount:
+            esxi_db.bump_data_version(cur, esxi_key)
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -286,6 +549,7 @@ def cleanup_db_regions_not_in_esxi_ip() -> None:
             cur.execute('BEGIN')
             for k in to_remove:
                 cur.execute("DELETE FROM vm WHERE esxi_key = ?", (k,))
+            esxi_db.bump_data_version(cur, *to_remove)
             conn.commit()
             print(f"[DB] 移除不在 ESXI_IP 中的 region: {', '.join(to_remove)}")
         conn.close()
@@ -303,57 +567,93 @@ def cleanup_db_regions_not_in_esxi_ip() -> None:
 
 
 def _read_mynewconfig(cfg_path: str) -> dict:
-    """读取 `esxi_config.py` 并返回其中的变量字典（会过滤 __dunder__ 项）。"""
+    """读取 cfg_path（例如 `esxi_config.py`）对应配置存储中的全部变量。
+
+    数据保存在同目录同名的 .db 文件中（见 config_store），首次读取时从 .py 文件导入，不会 exec() 文件。
+    """
     existing = {}
-    if not os.path.exists(cfg_path):
-        return existing
     try:
-        with open(cfg_path, 'r', encoding='utf-8') as f:
-            code = f.read()
-            # execute into a temporary namespace and filter dunder keys
-            temp_ns = {}
-            exec(code, temp_ns)
-            # copy only non-dunder keys to existing
-            for k, v in temp_ns.items():
-                if not (k.startswith('__') and k.endswith('__')):
-                    existing[k] = v
+        store = config_store.open_store(cfg_path)
+        for name in store.names():
+            existing[name] = store.get_all(name)
     except Exception as e:
         print(f"读取 {cfg_path} 失败: {e}")
     return existing
 
 
 def _write_mynewconfig(cfg_path: str, existing: dict) -> None:
-    """将 existing 字典写回 `esxi_config.py`，保留重要变量顺序（尽量原子替换）。"""
+    """把 existing 中的变量写入 cfg_path 对应的配置存储。
+
+    每个变量在单独的事务中按区域差量写入，只有内容变化的区域会被改写；不再重写 .py 文件。
+    """
     try:
-        # write to a temp file then replace to be somewhat atomic
-        tmp_path = cfg_path + '.tmp'
-        with open(tmp_path, 'w', encoding='utf-8') as f:
-            f.write('# Auto-generated by ESXICONTROL.py\n')
-            # prefer ESXI_IP, VM_INFO, ESXI_VMIDS ordering if present
-            ordered = []
-            for key in ('ESXI_IP', 'VM_INFO', 'ESXI_VMIDS'):
-                if key in existing:
-                    ordered.append(key)
-            # then append any other keys
-            for key in existing:
-                if key not in ordered and not (key.startswith('__') and key.endswith('__')):
-                    ordered.append(key)
-            for key in ordered:
-                try:
-                    f.write(key + ' = ' + repr(existing[key]) + '\n\n')
-                except Exception:
-                    pass
-        # replace original file
-        try:
-            os.replace(tmp_path, cfg_path)
-        except Exception:
-            # fallback to rename
-            os.remove(cfg_path) if os.path.exists(cfg_path) else None
-            os.rename(tmp_path, cfg_path)
+        store = config_store.open_store(cfg_path)
+        for key, value in existing.items():
+            if key.startswith('__') and key.endswith('__'):
+                continue
+            store.set_all(key, value)
     except Exception as e:
         print(f"写入 {cfg_path} 失败: {e}")
 
 
+def _connect_esxi(esxi_host: str, esxi_user: str, esxi_pass: str, timeout: float = None):
+    """建立到 ESXi 的会话，失败时抛出 RuntimeError。
+
+    timeout: 单次 HTTP 请求的 socket 超时（秒），None 表示不限制。
+    """
+    ctx = ssl._create_unverified_context()
+    service_instance = connect.SmartConnect(host=esxi_host, user=esxi_user, pwd=esxi_pass, sslContext=ctx,
+                                            httpConnectionTimeout=timeout)
+    if not service_instance:
+        raise RuntimeError(f"无法连接到 ESXi {esxi_host}")
+    # 之后每次 SOAP 调用都按 (esxi_host, 方法) 计时，见 metrics.VSPHERE_CALLS
+    return metrics.instrument_vsphere(service_instance, esxi_host)
+
+
+def _disconnect_esxi(service_instance) -> None:
+    try:
+        if service_instance:
+            connect.Disconnect(service_instance)
+    except Exception:
+        pass
+
+
+def refresh_esxi_region(esxi_host: str, esxi_user: str, esxi_pass: str, esxi_key: str,
+                        timeout: float = None, cancel: threading.Event = None) -> tuple:
+    """一次连接、一次批量读取，刷新指定区域的 inventory 与 VM MoID 并写入 DB。
+
+    返回: (inventory, vmids)，结构同 `collect_esxi_region`；出错时返回空结构，DB 保持不变。
+    cancel 被设置（调用方已放弃等待，例如 initialize_db_from_config 中超时的区域）时不再写入 DB。
+    """
+    service_instance = None
+    try:
+        service_instance = _connect_esxi(esxi_host, esxi_user, esxi_pass, timeout=timeout)
+        content = service_instance.RetrieveContent()
+        inventory, vmids = collect_esxi_region(content, esxi_key)
+
+        # Persist to sqlite only. Do NOT write anything to esxi_config.py.
+        if cancel is not None and cancel.is_set():
+            print(f"[DB] {esxi_key} 已超时取消，不写入 inventory")
+            return {}, {esxi_key: {}}
+        try:
+            save_inventory_to_db(esxi_key, inventory.get(esxi_key, {}))
+        except Exception as e:
+            print(f"[DB] save inventory failed: {e}")
+        if cancel is not None and cancel.is_set():
+            print(f"[DB] {esxi_key} 已超时取消，不写入 VMIDs")
+            return {}, {esxi_key: {}}
+        try:
+            save_vmids_to_db(esxi_key, vmids.get(esxi_key, {}))
+        except Exception as e:
+            print(f"[DB] save vmids failed: {e}")
+        return inventory, vmids
+    except Exception as e:
+        print(f"refresh_esxi_region 出错: {e}")
+        return {}, {esxi_key: {}}
+    finally:
+        _disconnect_esxi(service_instance)
+
+
 def init_esxi_region(esxi_host: str, esxi_user: str, esxi_pass: str, esxi_key: str) -> dict:
     """初始化指定 ESXi 区域的 inventory 并写入 `esxi_config.py` 与 DB。
 
@@ -368,10 +668,7 @@ def init_esxi_region(esxi_host: str, esxi_user: str, esxi_pass: str, esxi_key: s
     """
     service_instance = None
     try:
-        ctx = ssl._create_unverified_context()
-        service_instance = connect.SmartConnect(host=esxi_host, user=esxi_user, pwd=esxi_pass, sslContext=ctx)
-        if not service_instance:
-            raise RuntimeError(f"无法连接到 ESXi {esxi_host}")
+        service_instance = _connect_esxi(esxi_host, esxi_user, esxi_pass)
         content = service_instance.RetrieveContent()
         inventory = collect_esxi_inventory(content, esxi_key)
 
@@ -385,11 +682,7 @@ def init_esxi_region(esxi_host: str, esxi_user: str, esxi_pass: str, esxi_key: s
         print(f"init_esxi_region 出错: {e}")
         return {}
     finally:
-        try:
-            if service_instance:
-                connect.Disconnect(service_instance)
-        except Exception:
-            pass
+        _disconnect_esxi(service_instance)
 
 
 def record_vm_ids(esxi_host: str, esxi_user: str, esxi_pass: str, esxi_key: str) -> dict:
@@ -400,19 +693,11 @@ def record_vm_ids(esxi_host: str, esxi_user: str, esxi_pass: str, esxi_key: str)
     service_instance = None
     vmids_map = {esxi_key: {}}
     try:
-        ctx = ssl._create_unverified_context()
-        service_instance = connect.SmartConnect(host=esxi_host, user=esxi_user, pwd=esxi_pass, sslContext=ctx)
-        if not service_instance:
-            raise RuntimeError(f"无法连接到 ESXi {esxi_host}")
+        service_instance = _connect_esxi(esxi_host, esxi_user, esxi_pass)
         content = service_instance.RetrieveContent()
-        vm_container = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
-        for vm in vm_container.view:
-            try:
-                vm_name = vm.name
-                vm_id = vm._GetMoId()
-                vmids_map[esxi_key][vm_name] = vm_id
-            except Exception:
-                continue
+        for props in _retrieve_properties(content, vim.VirtualMachine, ('name',)):
+            if props.get('name'):
+                vmids_map[esxi_key][props['name']] = props['moid']
 
         # Persist VMIDs to sqlite only. Do NOT write anything to esxi_config.py.
         try:
@@ -424,51 +709,145 @@ def record_vm_ids(esxi_host: str, esxi_user: str, esxi_pass: str, esxi_key: str)
         print(f"record_vm_ids 出错: {e}")
         return vmids_map
     finally:
-        try:
-            if service_instance:
-                connect.Disconnect(service_instance)
-        except Exception:
-            pass
+        _disconnect_esxi(service_instance)
 
 
-def initialize_db_from_config() -> None:
-    """第1部分：根据配置的 ESXi 列表初始化并刷新 SQLite DB。
+def refresh_vcenter_regions(vc_host: str, vc_user: str, vc_pass: str, regions: Dict[str, str],
+                            host_names: Dict[str, str] = None, timeout: float = None) -> dict:
+    """通过一个 vCenter 会话刷新 regions 中所有由该 vCenter 管理的区域并写入 DB。
 
-    遍历 `ESXI_IP` 中的每个区域，调用 `init_esxi_region` 与 `record_vm_ids`。
+    返回 { esxi_key: {'ok':..., 'vms':..., 'vmids':..., 'seconds':...} }，只包含在 vCenter 中
+    找到对应主机的区域；连接或读取失败时抛出异常，由调用方回退到逐台 ESXi 刷新。
     """
-    # Remove any regions present in the DB but no longer configured in ESXI_IP
-    cleanup_db_regions_not_in_esxi_ip()
+    started = time.monotonic()
+    service_instance = _connect_esxi(vc_host, vc_user, vc_pass, timeout=timeout)
+    try:
+        content = service_instance.RetrieveContent()
+        inventory, vmids = collect_vcenter_regions(content, regions, host_names)
+    finally:
+        _disconnect_esxi(service_instance)
 
-    for esxi_key, esxi_host in ESXI_IP.items():
-        print(f"\n>>> 初始化 region {esxi_key} ({esxi_host})")
-        # 先删除该 region 在 DB 中的旧数据，确保后续写入为覆盖行为。
+    results = {}
+    for esxi_key in inventory:
+        ok = True
         try:
-            conn = _get_db_conn()
-            cur = conn.cursor()
-            cur.execute("BEGIN")
-            cur.execute("DELETE FROM vm WHERE esxi_key = ?", (esxi_key,))
-            conn.commit()
-            conn.close()
+            save_inventory_to_db(esxi_key, inventory[esxi_key])
         except Exception as e:
-            try:
-                conn.rollback()
-            except Exception:
-                pass
-            try:
-                conn.close()
-            except Exception:
-                pass
-            print(f"[DB] 在初始化前清除 region {esxi_key} 的旧数据时出错: {e}")
+            ok = False
+            print(f"[DB] save inventory failed: {e}")
         try:
-            inv = init_esxi_region(esxi_host, ESXI_USER, ESXI_PASS, esxi_key)
-            print(f"[init] 收集到 {len(inv.get(esxi_key, {}))} 个 VM 条目")
+            save_vmids_to_db(esxi_key, vmids.get(esxi_key, {}))
         except Exception as e:
-            print(f"[init] 初始化 {esxi_key} 失败: {e}")
+            print(f"[DB] save vmids failed: {e}")
+        results[esxi_key] = {
+            'ok': ok,
+            'vms': len(inventory[esxi_key]),
+            'vmids': len(vmids.get(esxi_key, {})),
+            'seconds': time.monotonic() - started,
+        }
+    return results
+
+
+def _refresh_region_timed(esxi_key: str, esxi_host: str, started: dict, timeout: float,
+                          cancel: threading.Event = None) -> dict:
+    """线程池任务：刷新单个区域并返回耗时统计。started 用于记录任务实际开始时间。"""
+    started[esxi_key] = time.monotonic()
+    inv, vmids = refresh_esxi_region(esxi_host, ESXI_USER, ESXI_PASS, esxi_key, timeout=timeout, cancel=cancel)
+    return {
+        'ok': bool(inv),
+        'vms': len(inv.get(esxi_key, {})),
+        'vmids': len(vmids.get(esxi_key, {})),
+        'seconds': time.monotonic() - started[esxi_key],
+    }
+
+
+def _print_init_summary(summary: dict) -> None:
+    print("\n== 区域刷新耗时 ==")
+    print(f"{'区域':<6} {'状态':<8} {'VM':>5} {'VMIDs':>6} {'耗时(s)':>8}")
+    for esxi_key in ESXI_IP:
+        r = summary.get(esxi_key, {})
+        print(f"{esxi_key:<6} {r.get('status', '-'):<8} {r.get('vms', 0):>5} {r.get('vmids', 0):>6} {r.get('seconds', 0.0):>8.1f}")
+
+
+def initialize_db_from_config(max_workers: int = INIT_MAX_WORKERS, region_timeout: float = INIT_REGION_TIMEOUT,
+                              use_vcenter: bool = None) -> dict:
+    """第1部分：根据配置的 ESXi 列表初始化并刷新 SQLite DB。
+
+    启用 vCenter 模式（`VCENTER['enabled']`，或 use_vcenter=True）时，先通过一个 vCenter 会话、
+    一次分页读取刷新所有由该 vCenter 管理的区域（`refresh_vcenter_regions`）。
+
+    其余区域（未启用 vCenter、vCenter 不可用或其中找不到对应主机）在有界线程池中并发刷新，
+    每个区域一个会话（`refresh_esxi_region`，一次连接、一次批量读取，同时写入 inventory 与 VMIDs）。
+    单个区域超过 region_timeout 秒仍未完成时不再等待，其余区域照常完成；总耗时约等于最慢的区域。
+    超时区域的线程无法强制终止，但会被取消：之后完成读取时不再写入 DB，该区域保留原有数据。
+
+    每个区域的数据在 `save_inventory_to_db` 的单个事务中整体替换，连接失败的区域保留原有数据。
+    返回每个区域的统计: { esxi_key: {'status':..., 'vms':..., 'vmids':..., 'seconds':...} }
+    """
+    # Remove any regions present in the DB but no longer configured in ESXI_IP
+    cleanup_db_regions_not_in_esxi_ip()
+
+    summary = {}
+    if not ESXI_IP:
+        return summary
+
+    if use_vcenter is None:
+        use_vcenter = bool(VCENTER.get('enabled'))
+    if use_vcenter and VCENTER.get('host'):
+        print(f">>> 通过 vCenter {VCENTER['host']} 初始化所有区域")
         try:
-            vmids = record_vm_ids(esxi_host, ESXI_USER, ESXI_PASS, esxi_key)
-            print(f"[init] 记录 VMIDs: {len(vmids.get(esxi_key, {}))} 项")
+            results = refresh_vcenter_regions(VCENTER['host'], VCENTER.get('user'), VCENTER.get('password'),
+                                              ESXI_IP, VCENTER.get('hosts'), timeout=region_timeout)
+            for esxi_key, r in results.items():
+                r['status'] = 'ok' if r['ok'] else 'failed'
+                summary[esxi_key] = r
+                print(f"[init] {esxi_key}: 收集到 {r['vms']} 个 VM 条目，记录 VMIDs {r['vmids']} 项（vCenter）")
         except Exception as e:
-            print(f"[init] 记录 VMIDs 失败: {e}")
+            print(f"[init] vCenter 不可用，回退到逐台 ESXi 初始化: {e}")
+
+    remaining = {k: v for k, v in ESXI_IP.items() if summary.get(k, {}).get('status') != 'ok'}
+    if not remaining:
+        _print_init_summary(summary)
+        return summary
+
+    started = {}
+    cancelled = {esxi_key: threading.Event() for esxi_key in remaining}
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(remaining))), thread_name_prefix='init')
+    futures = {}
+    for esxi_key, esxi_host in remaining.items():
+        print(f">>> 初始化 region {esxi_key} ({esxi_host})")
+        futures[executor.submit(_refresh_region_timed, esxi_key, esxi_host, started, region_timeout,
+                                cancelled[esxi_key])] = esxi_key
+
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+            for fut in done:
+                esxi_key = futures[fut]
+                try:
+                    r = fut.result()
+                    r['status'] = 'ok' if r['ok'] else 'failed'
+                except Exception as e:
+                    print(f"[init] 初始化 {esxi_key} 失败: {e}")
+                    r = {'status': 'failed', 'seconds': time.monotonic() - started.get(esxi_key, time.monotonic())}
+                summary[esxi_key] = r
+                print(f"[init] {esxi_key}: 收集到 {r.get('vms', 0)} 个 VM 条目，记录 VMIDs {r.get('vmids', 0)} 项，"
+                      f"耗时 {r.get('seconds', 0.0):.1f}s")
+            # 超时的区域不再等待；线程无法强制终止，设置取消标志使其完成后不再写入 DB
+            now = time.monotonic()
+            for fut in list(pending):
+                esxi_key = futures[fut]
+                if esxi_key in started and now - started[esxi_key] > region_timeout:
+                    cancelled[esxi_key].set()
+                    pending.discard(fut)
+                    summary[esxi_key] = {'status': 'timeout', 'seconds': now - started[esxi_key]}
+                    print(f"[init] {esxi_key}: 超过 {region_timeout}s 未完成，跳过")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    _print_init_summary(summary)
+    return summary
 
 
 def read_db_and_print() -> None:
@@ -512,22 +891,21 @@ def read_db_and_print() -> None:
     conn.close()
 
 
-def collect_and_store_inner_ifaces_for_region(esxi_key: str, vm_user: str = 'switchpc1', vm_pwd: str = '1234567', timeout: int = 5) -> dict:
-    """For a given region (esxi_key), SSH into each VM IP and discover internal iface name for each external MAC.
+# 内部网卡探测的全局并发 SSH 数，以及单个区域内的并发上限
+INNER_MAX_WORKERS = 32
+INNER_PER_REGION_LIMIT = 8
+# inner_nic_cache 在最近一次确认后多少秒内直接信任（不 SSH 检查 boot_id）；0 表示每次都检查
+INNER_CACHE_VERIFY_INTERVAL = 900
 
-    Behavior:
-      - Query DB for nic entries (mac) and their associated IPs per VM in the region.
-      - Group by VM IP and SSH once per IP using provided credentials.
-      - For each mac on that VM, run the provided ip/awk command and capture the interface name.
-      - Write results into `inner_nic` table, replacing any existing entries for the affected nic_ids.
 
-    Returns a dict summary: { 'region': esxi_key, 'checked': int, 'updated': int, 'failures': [ ... ] }
-    Failures list contains tuples describing the failure: (reason, details...)
+def _load_inner_probe_targets(cur: sqlite3.Cursor, esxi_key: str) -> tuple:
+    """查询区域内带 MAC 的网卡及其 IP，按 VM 分组。
+
+    返回: (rows 数量, { vm_id: {'name': vm_name, 'ips': set(...), 'nics': [(nic_id, mac, device_key), ...]} })
     """
-    conn = _get_db_conn()
-    cur = conn.cursor()
     cur.execute("""
-    SELECT vm.id as vm_id, vm.name as vm_name, nic.id as nic_id, nic.mac as mac, nic.name as nic_name, nic_ip.ip as ip
+    SELECT vm.id as vm_id, vm.name as vm_name, nic.id as nic_id, nic.mac as mac, nic.name as nic_name,
+           nic.device_key as device_key, nic_ip.ip as ip
     FROM vm
     JOIN nic ON nic.vm_id = vm.id
     LEFT JOIN nic_ip ON nic_ip.nic_id = nic.id
@@ -535,174 +913,265 @@ def collect_and_store_inner_ifaces_for_region(esxi_key: str, vm_user: str = 'swi
     ORDER BY vm.id
     """, (esxi_key,))
     rows = cur.fetchall()
-    if not rows:
-        conn.close()
-        return {'region': esxi_key, 'checked': 0, 'updated': 0, 'failures': []}
-
-    # group by VM (one SSH session per VM). Collect available IPs per VM and list of NICs (macs)
-    vms = {}  # vm_id -> {'name': vm_name, 'ips': set(...), 'nics': [(nic_id, mac), ...]}
-    nic_ids_set = set()
+    vms = {}
     for r in rows:
-        nic_id = r['nic_id']
-        mac = r['mac'] or ''
-        ip = r['ip']
-        vm_id = r['vm_id']
-        vm_name = r['vm_name']
-        nic_ids_set.add(nic_id)
-        ent = vms.setdefault(vm_id, {'name': vm_name, 'ips': set(), 'nics': []})
-        if ip:
-            ent['ips'].add(ip)
-        ent['nics'].append((nic_id, mac))
-
-    # We'll collect successful results only. Preload mac->inner_name cache
-    # from DB so we can skip probing MACs we've already discovered in previous runs.
-    results = []  # tuples (nic_id, mac, inner_name)
-    mac_cache = {}  # mac -> inner_name (None if known absent)
-    try:
-        cur.execute("SELECT DISTINCT mac, inner_name FROM inner_nic WHERE mac IS NOT NULL AND TRIM(mac) <> ''")
-        for r in cur.fetchall():
-            mac_cache[r['mac']] = r['inner_name']
-    except Exception:
-        pass
+        ent = vms.setdefault(r['vm_id'], {'name': r['vm_name'], 'ips': set(), 'nics': []})
+        if r['ip']:
+            ent['ips'].add(r['ip'])
+        nic = (r['nic_id'], r['mac'] or '', r['device_key'])
+        if nic not in ent['nics']:
+            ent['nics'].append(nic)
+    return len(rows), vms
+
+
+def _choose_vm_ip(ips: set) -> str:
+    """优先选择 IPv4 地址（不含 ':'），否则任取一个。"""
+    for candidate in sorted(ips):
+        if ':' not in candidate:
+            return candidate
+    return next(iter(ips)) if ips else None
+
+
+def _probe_vm_inner_ifaces(vm_ip: str, macs: list, vm_user: str, vm_pwd: str, timeout: int,
+                           expected_boot_id: str = None) -> tuple:
+    """通过共享 SSH 会话池登录一台 VM，一次 exec 读取 boot_id 并（必要时）取回完整 MAC 表。
+
+    返回 (boot_id, found)：found 为 { mac: inner_name }，未找到的 MAC 不出现在结果中；
+    boot_id 与 expected_boot_id 一致（VM 未重启）时 found 为 None，表示缓存仍然有效。
+    SSH 连接或命令执行失败时抛出异常，由调用方统计为失败。
+    """
+    with ssh_pool.get_pool().client(vm_ip, vm_user, vm_pwd, timeout=timeout) as ssh:
+        boot_id, table = inner_iface.probe_boot_and_table(ssh, expected_boot_id, timeout=timeout)
+    if table is None:
+        return boot_id, None
+    return boot_id, inner_iface.resolve_macs(table, macs)
 
-    # Mark VMs with no IP; we will not record failures for them, just skip
-    # their NICs since we cannot probe internal interfaces.
 
-    # 用于在已建立 SSH 连接上针对某个 mac 执行命令并返回内部网卡名
-    def probe_mac_on_ssh(ssh_client: paramiko.SSHClient, mac: str) -> str:
-        # command returns interface name such as 'eth0' or 'ens33'
-        cmd = f"ip -o link | awk -v mac='{mac}' '$0~mac{{print substr($2,1,length($2)-1)}}'"
-        try:
-            stdin, stdout, stderr = ssh_client.exec_command(cmd, timeout=timeout)
-            out = stdout.read().decode('utf-8', errors='ignore').strip()
-            # choose first non-empty line
-            for line in out.splitlines():
-                line = line.strip()
-                if line:
-                    return line
-        except Exception:
-            pass
-        return None
+def _store_inner_ifaces(conn: sqlite3.Connection, esxi_key: str, discovered: dict) -> int:
+    """把 { mac: inner_name } 写入区域内所有带该 MAC 的 nic 的 inner_nic 记录。
 
-    # 遍历每台 VM，只建立一次 SSH 连接（为提高效率），优先选择 IPv4 地址
-    for vm_id, info in vms.items():
-        # skip VMs that had no IPs (already reported)
-        if not info['ips']:
-            continue
-        # choose an IP: prefer IPv4 (no ':'), else pick any
-        chosen_ip = None
-        for candidate in info['ips']:
-            if ':' not in candidate:
-                chosen_ip = candidate
-                break
-        if not chosen_ip:
-            chosen_ip = next(iter(info['ips']))
+    已有相同 inner_name 的 nic 不会被改写；返回实际写入的行数。
+    """
+    if not discovered:
+        return 0
+    cur = conn.cursor()
+    try:
+        # For each discovered mac, find all nic_ids in this region that have that mac
+        nic_ids_to_update = []
+        for mac, inner_name in discovered.items():
+            cur.execute("""
+                SELECT nic.id, (SELECT GROUP_CONCAT(inner_name) FROM inner_nic WHERE inner_nic.nic_id = nic.id) AS current
+                FROM nic JOIN vm ON nic.vm_id = vm.id WHERE vm.esxi_key = ? AND nic.mac = ?
+            """, (esxi_key, mac))
+            for r in cur.fetchall():
+                if r['current'] != inner_name:
+                    nic_ids_to_update.append((r['id'], mac, inner_name))
+        if not nic_ids_to_update:
+            return 0
+        cur.execute('BEGIN')
+        # Delete existing inner_nic rows for these nic_ids, then insert the new ones
+        cur.executemany("DELETE FROM inner_nic WHERE nic_id = ?", [(nid,) for nid, _, _ in nic_ids_to_update])
+        cur.executemany("INSERT INTO inner_nic (nic_id, mac, inner_name) VALUES (?, ?, ?)", nic_ids_to_update)
+        esxi_db.bump_data_version(cur, esxi_key)
+        conn.commit()
+        return len(nic_ids_to_update)
+    except Exception as e:
+        conn.rollback()
+        print(f"[DB] 写入区域 {esxi_key} 的内部网卡出错: {e}")
+        return 0
 
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        try:
-            ssh.connect(hostname=chosen_ip, username=vm_user, password=vm_pwd, timeout=timeout)
-        except Exception:
-            # SSH failed for this VM; skip probing its NICs (do not record failures per request)
-            try:
-                ssh.close()
-            except Exception:
-                pass
-            continue
 
-        try:
-            for nic_id, mac in info['nics']:
-                inner_name = None
-                if mac:
-                    # if we already discovered this MAC earlier, reuse it
-                    if mac in mac_cache:
-                        inner_name = mac_cache[mac]
-                    else:
-                        inner_name = probe_mac_on_ssh(ssh, mac)
-                        mac_cache[mac] = inner_name
-                # only persist successful discoveries (inner_name not None)
-                if inner_name:
-                    results.append((nic_id, mac, inner_name))
-        finally:
-            try:
-                ssh.close()
-            except Exception:
-                pass
-
-    # 持久化：删除这些 nic_id 对应的旧 inner_nic，然后插入新的记录
+def _load_inner_cache(cur: sqlite3.Cursor, esxi_key: str) -> dict:
+    """读取 inner_nic_cache，返回 { (vm_name, mac): row }。"""
+    cur.execute("SELECT vm_name, mac, device_key, boot_id, inner_name, verified_at "
+                "FROM inner_nic_cache WHERE esxi_key = ?", (esxi_key,))
+    return {(r['vm_name'], r['mac']): r for r in cur.fetchall()}
+
+
+def _save_inner_cache(conn: sqlite3.Connection, esxi_key: str, vm_name: str, nics: list,
+                      boot_id: str, found: dict) -> None:
+    """VM 完整探测后，覆盖写入其所有网卡的缓存（没找到的 MAC 以 NULL 记录）。"""
+    now = time.time()
     try:
-        if results:
-            # Build mapping mac -> inner_name discovered in this run
-            discovered = {}
-            for nic_id, mac, inner_name in results:
-                if mac and inner_name:
-                    discovered[mac] = inner_name
-
-            # For each discovered mac, find all nic_ids in this region that have that mac
-            nic_ids_to_update = []
-            for mac, inner_name in discovered.items():
-                cur.execute("SELECT nic.id FROM nic JOIN vm ON nic.vm_id = vm.id WHERE vm.esxi_key = ? AND nic.mac = ?", (esxi_key, mac))
-                rows2 = cur.fetchall()
-                for r in rows2:
-                    nic_ids_to_update.append((r['id'], mac, inner_name))
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM inner_nic_cache WHERE esxi_key = ? AND vm_name = ?", (esxi_key, vm_name))
+        conn.executemany("""
+            INSERT OR REPLACE INTO inner_nic_cache (esxi_key, vm_name, mac, device_key, boot_id, inner_name, probed_at, verified_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(esxi_key, vm_name, mac, device_key, boot_id, found.get(mac), now, now) for _, mac, device_key in nics])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[DB] 写入 {esxi_key}/{vm_name} 的内部网卡缓存出错: {e}")
 
-            if nic_ids_to_update:
-                cur.execute('BEGIN')
-                qmarks = ','.join(['?'] * len(nic_ids_to_update))
-                # Delete existing inner_nic rows for these nic_ids
-                nic_id_only = [nid for nid, _, _ in nic_ids_to_update]
-                qmarks2 = ','.join(['?'] * len(nic_id_only))
-                cur.execute(f"DELETE FROM inner_nic WHERE nic_id IN ({qmarks2})", tuple(nic_id_only))
-                updated = 0
-                for nic_id, mac, inner_name in nic_ids_to_update:
-                    cur.execute("INSERT INTO inner_nic (nic_id, mac, inner_name) VALUES (?, ?, ?)", (nic_id, mac, inner_name))
-                    updated += 1
-                conn.commit()
-            else:
-                updated = 0
-        else:
-            updated = 0
-    except Exception:
+
+def _touch_inner_cache(conn: sqlite3.Connection, esxi_key: str, vm_name: str) -> None:
+    """boot_id 未变化：只刷新确认时间。"""
+    try:
+        conn.execute("UPDATE inner_nic_cache SET verified_at = ? WHERE esxi_key = ? AND vm_name = ?",
+                     (time.time(), esxi_key, vm_name))
+        conn.commit()
+    except Exception as e:
         conn.rollback()
-        updated = 0
+        print(f"[DB] 更新 {esxi_key}/{vm_name} 的内部网卡缓存出错: {e}")
+
+
+def _cached_vm_state(cache: dict, vm_name: str, nics: list) -> tuple:
+    """判断缓存能否覆盖该 VM 的全部网卡。
+
+    返回 (boot_id, names, verified_at)：所有网卡都有缓存、device_key 未变且 boot_id 一致时，
+    names 为 { mac: inner_name }（只含找到的），否则返回 (None, None, None) 表示需要完整探测。
+    """
+    boot_ids = set()
+    names = {}
+    verified = []
+    for _, mac, device_key in nics:
+        row = cache.get((vm_name, mac))
+        if row is None or row['device_key'] != device_key or not row['boot_id']:
+            return None, None, None
+        boot_ids.add(row['boot_id'])
+        verified.append(row['verified_at'] or 0)
+        if row['inner_name']:
+            names[mac] = row['inner_name']
+    if len(boot_ids) != 1:
+        return None, None, None
+    return boot_ids.pop(), names, min(verified)
+
+
+def collect_inner_ifaces(regions: list, vm_user: str = 'switchpc1', vm_pwd: str = '1234567', timeout: int = 5,
+                         max_workers: int = INNER_MAX_WORKERS, per_region_limit: int = INNER_PER_REGION_LIMIT,
+                         verify_interval: float = INNER_CACHE_VERIFY_INTERVAL) -> dict:
+    """并发探测多个区域中各 VM 的内部网卡名称，并在结果返回时逐台写入 `inner_nic`。
+
+    - 探测结果持久化在 inner_nic_cache 中，并记录 guest 的 boot_id 与网卡的 device_key。
+      device_key 未变化、且最近 verify_interval 秒内确认过的 VM 直接使用缓存，不 SSH；
+      超过该时间的 VM 只执行一条读取 boot_id 的命令，未重启则继续使用缓存；
+      重启过或虚拟硬件变化的 VM 才重新执行 ip link 完整探测。
+    - 每台 VM 只建立一次 SSH 连接，在线程池中执行；全局并发不超过 max_workers，
+      单个区域同时在探测的 VM 不超过 per_region_limit。
+    - 没有 IP 的 VM 无法探测，直接跳过（不计为失败）。
+    - DB 写入只在调用线程中进行，每完成一台 VM 提交一次。
+
+    返回: { region: {'region', 'checked', 'updated', 'cached', 'probed', 'failed', 'avg_seconds', 'max_seconds',
+                     'vm_results': [ {'vm', 'ip', 'ok', 'found', 'rebooted', 'seconds', 'error'}, ... ]} }
+    """
+    conn = _get_db_conn()
+    cur = conn.cursor()
+    now = time.time()
+
+    summaries = {}
+    queues = {}  # region -> [(vm_name, vm_ip, nics, expected_boot_id, cached_names), ...] 待 SSH 探测
+    for region in regions:
+        checked, vms = _load_inner_probe_targets(cur, region)
+        cache = _load_inner_cache(cur, region)
+        summaries[region] = {'region': region, 'checked': checked, 'updated': 0, 'cached': 0, 'probed': 0,
+                             'failed': 0, 'avg_seconds': 0.0, 'max_seconds': 0.0, 'vm_results': []}
+        cached = {}
+        queue = []
+        for info in vms.values():
+            if not info['ips']:
+                continue
+            boot_id, names, verified_at = _cached_vm_state(cache, info['name'], info['nics'])
+            if names is not None and now - verified_at < verify_interval:
+                cached.update(names)
+                summaries[region]['cached'] += 1
+                continue
+            queue.append((info['name'], _choose_vm_ip(info['ips']), info['nics'], boot_id, names))
+        summaries[region]['updated'] += _store_inner_ifaces(conn, region, cached)
+        queues[region] = queue
+
+    in_flight = {}  # future -> (region, vm_name, vm_ip, nics, cached_names, started)
+    region_running = {region: 0 for region in regions}
+
+    def _submit_ready(executor):
+        # 轮询各区域，在全局和区域并发上限内提交任务
+        progressed = True
+        while progressed and len(in_flight) < max_workers:
+            progressed = False
+            for region in regions:
+                if len(in_flight) >= max_workers:
+                    break
+                if queues[region] and region_running[region] < per_region_limit:
+                    vm_name, vm_ip, nics, boot_id, names = queues[region].pop(0)
+                    macs = [mac for _, mac, _ in nics]
+                    fut = executor.submit(_probe_vm_inner_ifaces, vm_ip, macs, vm_user, vm_pwd, timeout, boot_id)
+                    in_flight[fut] = (region, vm_name, vm_ip, nics, names, time.monotonic())
+                    region_running[region] += 1
+                    progressed = True
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='probe') as executor:
+            _submit_ready(executor)
+            while in_flight:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    region, vm_name, vm_ip, nics, cached_names, started = in_flight.pop(fut)
+                    region_running[region] -= 1
+                    elapsed = time.monotonic() - started
+                    summary = summaries[region]
+                    summary['probed'] += 1
+                    rebooted = False
+                    try:
+                        boot_id, found = fut.result()
+                        error = None
+                        if found is None:
+                            # boot_id 未变化，缓存仍然有效
+                            found = cached_names
+                            _touch_inner_cache(conn, region, vm_name)
+                        else:
+                            rebooted = cached_names is not None
+                            _save_inner_cache(conn, region, vm_name, nics, boot_id, found)
+                    except Exception as e:
+                        found, error = {}, str(e)
+                        summary['failed'] += 1
+                    summary['updated'] += _store_inner_ifaces(conn, region, found)
+                    summary['vm_results'].append({'vm': vm_name, 'ip': vm_ip, 'ok': error is None, 'found': len(found),
+                                                  'rebooted': rebooted, 'seconds': elapsed, 'error': error})
+                    status = f"发现 {len(found)} 个" if error is None else f"失败: {error}"
+                    print(f"[内部网卡] {region} | {vm_name} | {vm_ip} | {elapsed:.2f}s | {status}")
+                _submit_ready(executor)
     finally:
         conn.close()
 
-    # Do not return or record failures per user request; return only summary counts
-    return {'region': esxi_key, 'checked': len(rows), 'updated': updated}
+    for summary in summaries.values():
+        seconds = [r['seconds'] for r in summary['vm_results']]
+        if seconds:
+            summary['avg_seconds'] = sum(seconds) / len(seconds)
+            summary['max_seconds'] = max(seconds)
+    return summaries
+
+
+def collect_and_store_inner_ifaces_for_region(esxi_key: str, vm_user: str = 'switchpc1', vm_pwd: str = '1234567', timeout: int = 5) -> dict:
+    """For a given region (esxi_key), SSH into each VM IP and discover internal iface name for each external MAC.
+
+    Behavior:
+      - Query DB for nic entries (mac) and their associated IPs per VM in the region.
+      - SSH once per VM (concurrently, see `collect_inner_ifaces`) unless inner_nic_cache is still valid.
+      - Run `ip -j link` once per VM and resolve every MAC of that VM from the result.
+      - Write results into `inner_nic` table, replacing any existing entries for the affected nic_ids.
+
+    Returns a dict summary: { 'region': esxi_key, 'checked': int, 'updated': int, 'probed': int, 'failed': int, ... }
+    """
+    return collect_inner_ifaces([esxi_key], vm_user=vm_user, vm_pwd=vm_pwd, timeout=timeout)[esxi_key]
+
+
+def _print_inner_summary(res: dict) -> None:
+    print(f"[内部网卡] 区域={res.get('region')} 已更新={res.get('updated')} 检查={res.get('checked')} "
+          f"缓存命中VM={res.get('cached')} 探测VM={res.get('probed')} 失败={res.get('failed')} "
+          f"平均耗时={res.get('avg_seconds', 0.0):.2f}s 最长耗时={res.get('max_seconds', 0.0):.2f}s")
 
 
 def collect_all_regions_inner_ifaces(vm_user: str = 'switchpc1', vm_pwd: str = '1234567', timeout: int = 5) -> dict:
-    """遍历 DB 中所有区域并收集内部网卡名（已保留，可能不常用）。
+    """并发收集 DB 中所有区域的内部网卡名（已保留，可能不常用）。
 
     返回格式: { region: <per-region summary dict> }
     """
     regions = get_regions_from_db()
-    def _summarize_failures(failures: list) -> list:
-        """将重复的 failure 元组进行计数并返回摘要列表。
-
-        返回格式: [ (count, failure_tuple), ... ]，按 count 降序排列。
-        """
-        agg = {}
-        for f in failures:
-            try:
-                key = tuple(f)
-            except Exception:
-                key = (str(f),)
-            agg[key] = agg.get(key, 0) + 1
-        # 转换为 (count, failure) 并排序
-        items = [(c, k) for k, c in agg.items()]
-        items.sort(reverse=True, key=lambda x: x[0])
-        return items
-
-    overall = {}
+    print(f"\n>>> 正在收集区域 {', '.join(regions)} 的内部网卡信息")
+    overall = collect_inner_ifaces(regions, vm_user=vm_user, vm_pwd=vm_pwd, timeout=timeout)
     for region in regions:
-        print(f"\n>>> 正在收集区域 {region} 的内部网卡信息")
-        res = collect_and_store_inner_ifaces_for_region(region, vm_user=vm_user, vm_pwd=vm_pwd, timeout=timeout)
-        overall[region] = res
-        failures = res.get('failures') or []
         # Print concise summary and then print the detailed inventory lines
-        print(f"[内部网卡] 区域={region} 已更新={res.get('updated')} 检查={res.get('checked')}")
+        _print_inner_summary(overall[region])
         print_inventory_with_inner_nic(region)
     return overall
 
@@ -754,30 +1223,24 @@ def main():
     initialize_db_from_config()
     # 2)读取数据库并打印结构化信息
     read_db_and_print()
-    # 3) 显式地迭代各个区域，并对每个区域进行探测，获取内部网卡信息。
+    # 3) 并发探测所有区域，获取内部网卡信息。
     regions = get_regions_from_db()
-    overall_failures = []
-
+    print(f"\n>>> 开始探测区域 {', '.join(regions)} 的内部网卡")
+    overall = collect_inner_ifaces(regions)
+    failed = 0
     for region in regions:
-        print(f"\n>>> 开始探测区域 {region} 的内部网卡")
-        res = collect_and_store_inner_ifaces_for_region(region)
-        # print per-region summary immediately
-        if res.get('failures'):
-            print(f"[内部网卡] 区域={region} 已更新={res.get('updated')} 检查={res.get('checked')} 失败数={len(res.get('failures'))}")
-            for f in res.get('failures'):
-                overall_failures.append((region, f))
-        else:
-            print(f"[内部网卡] 区域={region} 已更新={res.get('updated')} 检查={res.get('checked')} 完成")
-
-    if overall_failures:
-        print('\n== 内部网卡采集失败清单 ==')
-        for region, f in overall_failures:
-            print(f"区域={region} 失败={f}")
+        _print_inner_summary(overall[region])
+        failed += overall[region].get('failed', 0)
+
+    if failed:
+        print(f'\n== 内部网卡采集: {failed} 台 VM 的 SSH 探测失败 ==')
+        for region in regions:
+            for r in overall[region]['vm_results']:
+                if not r['ok']:
+                    print(f"区域={region} VM={r['vm']} IP={r['ip']} 失败={r['error']}")
     else:
         print('\n所有内部网卡探测完成（未发生 SSH 级别失败）。')
 
-    # 
-
 
 
 def get_regions_from_db():
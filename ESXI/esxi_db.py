@@ -0,0 +1,357 @@
+"""SQLite 连接与 schema 迁移。
+
+`control.py`（写入方）与 `web_api.py`（读取方）共用这里的连接工厂，保证两边
+使用相同的 PRAGMA 设置，并在首次连接时把数据库升级到最新 schema。
+
+schema 版本记录在 `PRAGMA user_version` 中；MIGRATIONS[i] 把数据库从版本 i 升级到 i+1。
+新增 schema 变更时只需在列表末尾追加一个迁移函数，不要修改已有的迁移。
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import metrics
+
+DB_FILENAME = os.path.join(os.path.dirname(__file__), 'esxi_data.db')
+
+# 等待其它连接释放写锁的时间（毫秒）
+BUSY_TIMEOUT_MS = 30000
+# 每个连接的页缓存大小，负数表示 KiB
+CACHE_SIZE_KIB = 16384
+
+
+def _migrate_v1(cur: sqlite3.Cursor) -> None:
+    """初始 schema: vm / nic / nic_ip / inner_nic。"""
+    # vm table stores vm rows; esxi_key is used to group by region
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS vm (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        esxi_key TEXT NOT NULL,
+        name TEXT NOT NULL,
+        vm_vmid TEXT,
+        vm_moid TEXT,
+        UNIQUE(esxi_key, name)
+    )
+    ''')
+    # nic table stores external nic info per vm
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS nic (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vm_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        mac TEXT,
+        source TEXT,
+        FOREIGN KEY(vm_id) REFERENCES vm(id) ON DELETE CASCADE
+    )
+    ''')
+    # nic_ip table stores ip addresses per nic
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS nic_ip (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nic_id INTEGER NOT NULL,
+        ip TEXT NOT NULL,
+        FOREIGN KEY(nic_id) REFERENCES nic(id) ON DELETE CASCADE,
+        UNIQUE(nic_id, ip)
+    )
+    ''')
+    # inner_nic table: store internal interface names discovered inside the VM
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS inner_nic (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nic_id INTEGER NOT NULL,
+        mac TEXT,
+        inner_name TEXT,
+        FOREIGN KEY(nic_id) REFERENCES nic(id) ON DELETE CASCADE
+    )
+    ''')
+
+
+def _migrate_v2(cur: sqlite3.Cursor) -> None:
+    """为查询与级联删除用到的外键 / MAC 列补充二级索引。
+
+    vm(esxi_key) 与 nic_ip(nic_id) 已分别被 UNIQUE(esxi_key, name) 与 UNIQUE(nic_id, ip)
+    的自动索引覆盖，无需重复创建。
+    """
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_nic_vm_id ON nic(vm_id)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_nic_mac ON nic(mac)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_inner_nic_nic_id ON inner_nic(nic_id)')
+
+
+def _migrate_v3(cur: sqlite3.Cursor) -> None:
+    """持久化的 MAC -> 内部网卡名 缓存。
+
+    nic.device_key 记录网卡在 vSphere 虚拟硬件中的设备 key；inner_nic_cache 按
+    (区域, VM 名称, MAC) 记录探测结果及探测时 guest 的 boot_id。只有 guest 重启
+    （boot_id 变化）或虚拟硬件变化（device_key 变化）时才需要重新探测。
+    inner_name 为 NULL 表示探测过但 VM 内没有该 MAC。
+    """
+    cur.execute('ALTER TABLE nic ADD COLUMN device_key INTEGER')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS inner_nic_cache (
+        esxi_key TEXT NOT NULL,
+        vm_name TEXT NOT NULL,
+        mac TEXT NOT NULL,
+        device_key INTEGER,
+        boot_id TEXT,
+        inner_name TEXT,
+        probed_at REAL,
+        verified_at REAL,
+        PRIMARY KEY(esxi_key, vm_name, mac)
+    )
+    ''')
+
+
+def _migrate_v4(cur: sqlite3.Cursor) -> None:
+    """PerfManager 性能计数器的时间序列表（见 perf_metrics.py）。
+
+    entity 为 VM 名称，宿主机本身的计数器使用 perf_metrics.HOST_ENTITY；instance 为空串表示
+    聚合值，否则为网卡 / 磁盘等实例名。ts 为采样时间（Unix 秒），value 为 vSphere 返回的原始整数。
+    WITHOUT ROWID 让主键本身就是聚簇索引，按 (区域, VM, 计数器, 时间) 的范围查询只需顺序读取。
+    """
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS perf_sample (
+        esxi_key TEXT NOT NULL,
+        entity TEXT NOT NULL,
+        counter TEXT NOT NULL,
+        instance TEXT NOT NULL DEFAULT '',
+        ts INTEGER NOT NULL,
+        value INTEGER,
+        PRIMARY KEY(esxi_key, entity, counter, instance, ts)
+    ) WITHOUT ROWID
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_perf_sample_ts ON perf_sample(ts)')
+
+
+def _migrate_v5(cur: sqlite3.Cursor) -> None:
+    """每个区域的数据版本号，供 web_api 的响应缓存判断数据是否变化。
+
+    写入 vm / nic / nic_ip / inner_nic 的事务通过 `bump_data_version` 递增对应区域以及
+    全局范围 ALL_SCOPE 的版本号。
+    """
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS data_version (
+        scope TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    ''')
+
+
+def _migrate_v6(cur: sqlite3.Cursor) -> None:
+    """异步任务（见 jobs.py）：job 为任务本身，job_step 为其中按顺序执行的步骤。
+
+    payload / locks / result 为 JSON 文本；时间为 Unix 秒。
+    """
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS job (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        region TEXT,
+        status TEXT NOT NULL,
+        payload TEXT,
+        locks TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        error TEXT
+    )
+    ''')
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS job_step (
+        job_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        status TEXT NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        result TEXT,
+        PRIMARY KEY(job_id, seq),
+        FOREIGN KEY(job_id) REFERENCES job(id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_job_created_at ON job(created_at)')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_job_status ON job(status)')
+
+
+def _migrate_v7(cur: sqlite3.Cursor) -> None:
+    """拓扑协调（见 topology_reconcile.py）：每台 VM 最近一次成功应用的期望状态。
+
+    kind 为 'nics'（网卡端口组）、'sw' 或 'host'（VM 内的配置脚本）；spec 为 JSON，spec_hash 为其哈希。
+    """
+    cur.execute('''
+    CREATE TABLE IF NOT EXISTS applied_vm_state (
+        esxi_key TEXT NOT NULL,
+        vm_name TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        spec_hash TEXT NOT NULL,
+        spec TEXT NOT NULL,
+        job_id TEXT,
+        applied_at REAL NOT NULL,
+        PRIMARY KEY(esxi_key, vm_name, kind)
+    ) WITHOUT ROWID
+    ''')
+
+
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# data_version 中表示“任意区域”的范围，区域列表等跨区域的数据使用它
+ALL_SCOPE = '*'
+
+# 本进程内已确认是最新 schema 的数据库路径，避免每次连接都检查
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def _user_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """把 conn 对应的数据库升级到 SCHEMA_VERSION，返回升级前的版本号。
+
+    每个迁移在独立的 IMMEDIATE 事务中执行并同时更新 user_version；
+    多个进程同时启动时，后拿到写锁的一方会在事务内重新检查版本并跳过已完成的迁移。
+    """
+    start = _user_version(conn)
+    if start >= SCHEMA_VERSION:
+        return start
+    # WAL 让读连接（Flask）不会被区域刷新的写事务阻塞；该设置持久保存在数据库文件中，
+    # 且不能在事务内修改，因此在迁移前单独执行。
+    try:
+        conn.execute('PRAGMA journal_mode = WAL')
+    except sqlite3.DatabaseError:
+        pass
+    for version in range(start, SCHEMA_VERSION):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if _user_version(conn) > version:
+                conn.rollback()
+                continue
+            MIGRATIONS[version](conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return start
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    """每个连接都需要设置的 PRAGMA（这些设置不会持久化到数据库文件）。"""
+    for pragma in ('PRAGMA foreign_keys = ON',
+                   f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}',
+                   # WAL 下 NORMAL 只在断电时可能丢失最近提交，不会损坏数据库
+                   'PRAGMA synchronous = NORMAL',
+                   f'PRAGMA cache_size = -{CACHE_SIZE_KIB}',
+                   'PRAGMA temp_store = MEMORY'):
+        try:
+            conn.execute(pragma)
+        except Exception:
+            pass
+
+
+_SQL_OP = re.compile(r'\s*(\w+)')
+_SQL_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE|TABLE)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?["`\[]?(\w+)', re.I)
+
+
+@functools.lru_cache(maxsize=1024)
+def _statement_labels(sql: str) -> tuple:
+    """SQL 语句 -> (op, table) 指标标签，例如 ('select', 'vm')。"""
+    m = _SQL_OP.match(sql)
+    op = m.group(1).lower() if m else 'other'
+    if op == 'with':
+        op = 'select'
+    m = _SQL_TABLE.search(sql)
+    return op, m.group(1).lower() if m else ''
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """记录 execute / executemany / executescript / fetchall 耗时的游标（见 metrics.SQLITE_LATENCY）。"""
+    _labels = ('other', '')
+
+    def _timed(self, labels, call, *args):
+        start = time.perf_counter()
+        try:
+            return call(self, *args)
+        except Exception:
+            metrics.SQLITE_ERRORS.inc(*labels)
+            raise
+        finally:
+            metrics.SQLITE_LATENCY.observe(time.perf_counter() - start, *labels)
+
+    def execute(self, sql, parameters=()):
+        self._labels = _statement_labels(sql)
+        return self._timed(self._labels, sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._labels = _statement_labels(sql)
+        return self._timed(self._labels, sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._timed(('script', ''), sqlite3.Cursor.executescript, sql_script)
+
+    def fetchall(self):
+        return self._timed(self._labels, sqlite3.Cursor.fetchall)
+
+
+class _TimedConnection(sqlite3.Connection):
+    """cursor() 默认返回 _TimedCursor；commit 单独计时（WAL 下提交时写入日志）。"""
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            metrics.SQLITE_LATENCY.observe(time.perf_counter() - start, 'commit', '')
+
+
+def get_conn(db_path: str = None) -> sqlite3.Connection:
+    """返回设置好 PRAGMA、row_factory 并已升级 schema 的 sqlite3 连接。"""
+    db_path = db_path or DB_FILENAME
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, factory=_TimedConnection)
+    conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn)
+    if db_path not in _migrated:
+        with _migrate_lock:
+            if db_path not in _migrated:
+                migrate(conn)
+                _migrated.add(db_path)
+    return conn
+
+
+def bump_data_version(cur: sqlite3.Cursor, *scopes: str) -> None:
+    """在调用方的写事务中递增 scopes（以及 ALL_SCOPE）的数据版本号。"""
+    keys = set(scopes) | {ALL_SCOPE}
+    cur.executemany('''
+        INSERT INTO data_version (scope, version) VALUES (?, 1)
+        ON CONFLICT(scope) DO UPDATE SET version = version + 1
+    ''', [(k,) for k in sorted(keys)])
+
+
+def get_data_version(conn: sqlite3.Connection, scope: str = ALL_SCOPE) -> int:
+    """返回 scope 当前的数据版本号（从未写入过时为 0）。"""
+    row = conn.execute('SELECT version FROM data_version WHERE scope = ?', (scope,)).fetchone()
+    return row[0] if row else 0
@@ -0,0 +1,15 @@
+"""gunicorn 配置：gunicorn -c gunicorn.conf.py wsgi:app
+
+单个 worker 进程 + gthread 线程池，原因见 wsgi.py。
+"""
+import os
+
+bind = f"{os.environ.get('ESXI_HOST', '0.0.0.0')}:{os.environ.get('ESXI_PORT', '5000')}"
+workers = 1
+worker_class = 'gthread'
+threads = int(os.environ.get('ESXI_THREADS', '32'))
+# gthread 的 timeout 是 worker 心跳超时，不限制单个请求；同步等待的拓扑任务与 SSE 可以长时间保持连接
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
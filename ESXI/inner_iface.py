@@ -0,0 +1,84 @@
+"""根据外部网卡 MAC 查找 VM 内部网卡名称（control.py 与 VM/vm_control.py 共用）。
+
+每台 VM 只执行一次 `ip -j link`，在本地解析出完整的 MAC -> 网卡名 表，
+再用这张表解析该 VM 的所有网卡，而不是每个 MAC 执行一次 `ip -o link | awk`。
+"""
+import json
+
+# 不支持 -j 的旧版 iproute2 回退到 -o 输出
+IP_LINK_CMD = "ip -j link 2>/dev/null || ip -o link"
+# guest 每次启动都会重新生成的随机 ID，用于判断 VM 是否重启过
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def parse_ip_link(output: str) -> dict:
+    """解析 `ip -j link` 或 `ip -o link` 的输出。
+
+    返回 { mac(小写): [ifname, ...] }，同一 MAC 的多个接口（如 OVS 网桥与其端口）
+    按 ip link 的输出顺序排列。
+    """
+    table = {}
+
+    def _add(mac, name):
+        mac = (mac or '').strip().lower()
+        if mac and name and name not in table.get(mac, []):
+            table.setdefault(mac, []).append(name)
+
+    text = (output or '').strip()
+    if text.startswith('['):
+        try:
+            entries = json.loads(text)
+        except ValueError:
+            entries = []
+        for entry in entries:
+            name = entry.get('ifname')
+            _add(entry.get('address'), name)
+            # bond 成员等接口的原始 MAC
+            _add(entry.get('permaddr'), name)
+        return table
+
+    # 例: "2: ens33: <BROADCAST,...> mtu 1500 ... link/ether 00:0c:29:16:f3:34 brd ff:ff:ff:ff:ff:ff"
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        name = parts[1].rstrip(':').split('@')[0]
+        for marker in ('link/ether', 'permaddr'):
+            if marker in parts:
+                idx = parts.index(marker)
+                if idx + 1 < len(parts):
+                    _add(parts[idx + 1], name)
+    return table
+
+
+def probe_mac_table(ssh_client, timeout: float = None) -> dict:
+    """在已建立的 SSH 连接上执行一次 ip link，返回 `parse_ip_link` 的结果。"""
+    stdin, stdout, stderr = ssh_client.exec_command(IP_LINK_CMD, timeout=timeout)
+    return parse_ip_link(stdout.read().decode('utf-8', errors='ignore'))
+
+
+def resolve_macs(table: dict, macs) -> dict:
+    """用 MAC 表解析一组 MAC，返回 { mac: 第一个匹配的接口名 }（键保持调用方传入的写法）。"""
+    found = {}
+    for mac in macs:
+        names = table.get((mac or '').strip().lower())
+        if names:
+            found[mac] = names[0]
+    return found
+
+
+def probe_boot_and_table(ssh_client, expected_boot_id: str = None, timeout: float = None) -> tuple:
+    """在一次 exec 中读取 guest 的 boot_id，并在其与 expected_boot_id 不同时执行 ip link。
+
+    返回 (boot_id, table)；boot_id 与 expected_boot_id 一致时 table 为 None（缓存仍然有效）。
+    """
+    expected = (expected_boot_id or '').replace("'", '')
+    cmd = (f"b=$(cat {BOOT_ID_PATH} 2>/dev/null); echo \"$b\"; "
+           f"[ -n \"$b\" ] && [ \"$b\" = '{expected}' ] || {{ {IP_LINK_CMD}; }}")
+    stdin, stdout, stderr = ssh_client.exec_command(cmd, timeout=timeout)
+    out = stdout.read().decode('utf-8', errors='ignore')
+    first, _, rest = out.partition('\n')
+    boot_id = first.strip() or None
+    if boot_id and expected and boot_id == expected:
+        return boot_id, None
+    return boot_id, parse_ip_link(rest)
@@ -0,0 +1,206 @@
+"""基于 PropertyCollector + WaitForUpdatesEx 的增量 inventory 同步。
+
+与 `control.initialize_db_from_config` 每次删除并重建全部区域不同，本模块为每个
+ESXi 区域维持一个长连接和一个 PropertyCollector filter，只把发生变化的部分
+（VM 增删、guest.net IP 变化、网卡变化）写入 `vm` / `nic` / `nic_ip` 表。
+
+用法:
+    python inventory_sync.py            # 同步 ESXI_IP 中的全部区域
+    python inventory_sync.py s05 s07    # 只同步指定区域
+"""
+import sys
+import threading
+import time
+
+from pyVmomi import vim, vmodl
+
+from esxi_config import ESXI_IP
+import control
+
+# WaitForUpdatesEx 单次最长等待时间（秒）；超时返回 None 后继续下一轮
+WAIT_MAX_SECONDS = 30
+# 连接断开后的重连等待（秒），按指数退避直到上限
+RECONNECT_MIN_DELAY = 5
+RECONNECT_MAX_DELAY = 120
+
+
+class RegionSync:
+    """单个区域的增量同步器。
+
+    维护 moid -> 属性 的本地副本，首次（version 为空）收到完整快照后整体写入 DB，
+    之后只对发生变化的 VM 调用 `control.save_vm_to_db` / `control.delete_vm_from_db`。
+    """
+
+    def __init__(self, esxi_key: str, esxi_host: str, esxi_user: str, esxi_pass: str):
+        self.esxi_key = esxi_key
+        self.esxi_host = esxi_host
+        self.esxi_user = esxi_user
+        self.esxi_pass = esxi_pass
+        self.vms = {}       # moid -> { 属性路径: 值 }
+        self.written = {}   # moid -> (vm_name, nic_map)，最近一次写入 DB 的内容
+        self.version = ''
+
+    # ----------------- 更新处理 -----------------
+
+    def _apply_object_update(self, content, update) -> set:
+        """把一个 ObjectUpdate 合并进本地副本，返回需要重新写入的 moid 集合。"""
+        moid = update.obj._GetMoId()
+        if update.kind == 'leave':
+            self.vms.pop(moid, None)
+            return {moid}
+
+        props = self.vms.setdefault(moid, {'obj': update.obj, 'moid': moid})
+        refetch = False
+        for change in update.changeSet or []:
+            if change.name in control.VM_PROPERTIES:
+                if change.op in ('remove', 'indirectRemove'):
+                    props.pop(change.name, None)
+                else:
+                    props[change.name] = change.val
+            else:
+                # 嵌套路径（例如数组元素级别的变化），直接重新读取该 VM 的属性
+                refetch = True
+        if refetch:
+            try:
+                self.vms[moid] = control._retrieve_object_properties(content, update.obj, control.VM_PROPERTIES)
+            except Exception as e:
+                print(f"[sync] {self.esxi_key} 重新读取 {moid} 失败: {e}")
+        return {moid}
+
+    def _flush_full(self) -> None:
+        """首次快照：整体写入区域 inventory 与 VMIDs（会删除 DB 中已不存在的 VM）。"""
+        inventory_region = {}
+        vmids = {}
+        self.written = {}
+        for moid, props in self.vms.items():
+            vm_name = props.get('name')
+            if not vm_name:
+                continue
+            nic_map = control._vm_nic_map(props)
+            inventory_region[vm_name] = nic_map
+            vmids[vm_name] = moid
+            self.written[moid] = (vm_name, nic_map)
+        control.save_inventory_to_db(self.esxi_key, inventory_region)
+        control.save_vmids_to_db(self.esxi_key, vmids)
+        print(f"[sync] {self.esxi_key} 初始快照写入 {len(inventory_region)} 个 VM")
+
+    def _flush_changed(self, moids: set) -> None:
+        """增量写入：只处理内容实际发生变化的 VM。"""
+        for moid in moids:
+            props = self.vms.get(moid)
+            old = self.written.get(moid)
+            if props is None or not props.get('name'):
+                if old:
+                    control.delete_vm_from_db(self.esxi_key, old[0])
+                    self.written.pop(moid, None)
+                    print(f"[sync] {self.esxi_key} 移除 VM {old[0]}")
+                continue
+
+            vm_name = props['name']
+            nic_map = control._vm_nic_map(props)
+            if old == (vm_name, nic_map):
+                continue
+            if old and old[0] != vm_name:
+                # VM 改名：删除旧名称的记录
+                control.delete_vm_from_db(self.esxi_key, old[0])
+            control.save_vm_to_db(self.esxi_key, vm_name, nic_map, vm_moid=moid)
+            self.written[moid] = (vm_name, nic_map)
+            print(f"[sync] {self.esxi_key} 更新 VM {vm_name} ({len(nic_map)} 个网卡)")
+
+    # ----------------- 主循环 -----------------
+
+    def _run_session(self, stop_event: threading.Event) -> None:
+        service_instance = control._connect_esxi(self.esxi_host, self.esxi_user, self.esxi_pass)
+        collector = None
+        view = None
+        try:
+            content = service_instance.RetrieveContent()
+            # 使用独立的 PropertyCollector，避免与其它调用共享 filter
+            collector = content.propertyCollector.CreatePropertyCollector()
+            view = content.viewManager.CreateContainerView(content.rootFolder, [vim.VirtualMachine], True)
+            filter_spec = control._container_filter_spec(view, vim.VirtualMachine, control.VM_PROPERTIES)
+            collector.CreateFilter(filter_spec, partialUpdates=False)
+
+            # 新会话必须从完整快照开始
+            self.vms = {}
+            self.version = ''
+            initial = True
+            pending = set()
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=WAIT_MAX_SECONDS)
+            while not stop_event.is_set():
+                update_set = collector.WaitForUpdatesEx(self.version, options)
+                if update_set is None:
+                    continue
+                self.version = update_set.version
+                for filter_update in update_set.filterSet or []:
+                    for obj_update in filter_update.objectSet or []:
+                        pending |= self._apply_object_update(content, obj_update)
+                if update_set.truncated:
+                    # 还有未返回的变化，先累积，拿到完整结果后再写 DB
+                    continue
+                if initial:
+                    self._flush_full()
+                    initial = False
+                else:
+                    self._flush_changed(pending)
+                pending = set()
+        finally:
+            try:
+                if view:
+                    view.Destroy()
+            except Exception:
+                pass
+            try:
+                if collector:
+                    collector.DestroyPropertyCollector()
+            except Exception:
+                pass
+            control._disconnect_esxi(service_instance)
+
+    def run(self, stop_event: threading.Event) -> None:
+        """持续同步，连接失败或会话中断后按指数退避重连，直到 stop_event 被设置。"""
+        delay = RECONNECT_MIN_DELAY
+        while not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                print(f"[sync] 连接区域 {self.esxi_key} ({self.esxi_host})")
+                self._run_session(stop_event)
+            except Exception as e:
+                print(f"[sync] 区域 {self.esxi_key} 同步中断: {e}")
+            if stop_event.is_set():
+                break
+            # 会话维持过较长时间则重置退避
+            if time.monotonic() - started > RECONNECT_MAX_DELAY:
+                delay = RECONNECT_MIN_DELAY
+            stop_event.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
+def run_sync(esxi_keys=None, stop_event: threading.Event = None) -> None:
+    """为每个区域启动一个同步线程并阻塞运行，直到 stop_event 被设置或 Ctrl+C。"""
+    stop_event = stop_event or threading.Event()
+    keys = list(esxi_keys) if esxi_keys else list(ESXI_IP.keys())
+    control.cleanup_db_regions_not_in_esxi_ip()
+
+    threads = []
+    for esxi_key in keys:
+        esxi_host = ESXI_IP.get(esxi_key)
+        if not esxi_host:
+            print(f"[sync] 未知区域 {esxi_key}，跳过")
+            continue
+        syncer = RegionSync(esxi_key, esxi_host, control.ESXI_USER, control.ESXI_PASS)
+        t = threading.Thread(target=syncer.run, args=(stop_event,), name=f"sync-{esxi_key}", daemon=True)
+        t.start()
+        threads.append(t)
+
+    try:
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=1)
+    except KeyboardInterrupt:
+        print("\n[sync] 收到中断，正在停止...")
+        stop_event.set()
+
+
+if __name__ == '__main__':
+    run_sync(sys.argv[1:])
@@ -0,0 +1,473 @@
+"""拓扑操作（创建端口、安装网卡、配置 sw / host）的异步任务引擎。
+
+- 任务由若干步骤（Step）组成，在有界线程池（JOB_MAX_WORKERS）中运行；步骤默认顺序执行、遇错停止，
+  JobSpec.parallel > 1 时（各步骤互不依赖，例如每台 VM 一个步骤）最多 parallel 个步骤并发执行，
+  单个步骤失败不影响其它步骤，结果仍按步骤顺序返回。步骤可以分阶段（Step.stage）：
+  各阶段按编号依次执行，阶段内并发，某个阶段有步骤失败时不再执行后续阶段；
+- 任务与每个步骤的状态、结果保存在 SQLite 的 job / job_step 表中（esxi_db 迁移 v6）；
+- 每个任务声明它占用的资源：整个区域 (region, None) 或区域内的某台 VM (region, vm)。
+  区域锁与该区域内的任何锁冲突，VM 锁只与同一台 VM 或所在区域的锁冲突；冲突的任务按提交顺序排队，
+  后提交的任务不会越过与它冲突的、更早提交的任务；
+- 排队中的任务可以直接取消；运行中的任务在当前步骤结束后停止，其余步骤标记为 cancelled；
+- 每个任务在内存中保留一份有上限的事件流（步骤状态变化、远程命令逐行输出），供
+  /api/jobs/<id>/stream 以 SSE 推送；事件带递增 ID，断线重连时从 Last-Event-ID 之后继续。
+
+用法:
+    spec = jobs.JobSpec('configure_sw', 's05', steps=[jobs.Step('s05-switchpc1', fn)],
+                        locks=[('s05', 's05-switchpc1')])
+    job_id = jobs.get_manager().submit(spec)
+    jobs.get_manager().get(job_id)
+"""
+import json
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import esxi_db
+
+# 同时运行的任务数上限
+JOB_MAX_WORKERS = 4
+# 单个任务内并发执行的步骤数上限
+STEP_MAX_WORKERS = 32
+# 单个步骤结果中 stdout / stderr 保存的最大字符数
+RESULT_TEXT_LIMIT = 256 * 1024
+# 每个任务在内存中保留的事件数上限（超出时丢弃最早的事件）
+EVENT_BUFFER_LIMIT = 5000
+# 单行输出事件的最大字符数
+EVENT_LINE_LIMIT = 4096
+# 已结束任务的事件流保留个数（更早的任务只能从 DB 读取最终结果）
+FINISHED_EVENT_LOGS = 32
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+PENDING = 'pending'
+SKIPPED = 'skipped'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class Step:
+    """任务中的一个步骤。fn(ctx) 返回可 JSON 序列化的结果字典（通常含 cmd / stdout / stderr）。
+
+    timeout: 步骤的最长执行时间（秒），通过 ctx.timeout 传给远程命令；None 表示不限制。
+    stage:   并发执行时所属的阶段，编号小的阶段先执行。
+    """
+
+    def __init__(self, name: str, fn: Callable[['StepContext'], dict], timeout: float = None, stage: int = 0):
+        self.name = name
+        self.fn = fn
+        self.timeout = timeout
+        self.stage = stage
+
+
+class JobSpec:
+    def __init__(self, kind: str, region: str, steps: List[Step], locks: List[Tuple[str, Optional[str]]] = None,
+                 payload: dict = None, parallel: int = 1):
+        self.kind = kind
+        self.region = region
+        self.steps = steps
+        # 默认锁住整个区域
+        self.locks = list(locks) if locks is not None else [(region, None)]
+        self.payload = payload
+        # 同时执行的步骤数；1 为顺序执行
+        self.parallel = max(1, min(int(parallel or 1), STEP_MAX_WORKERS))
+
+
+class JobEvents:
+    """一个任务的事件流：[(event_id, event, data), ...]，event_id 从 1 开始递增。"""
+
+    def __init__(self, limit: int = EVENT_BUFFER_LIMIT):
+        self.limit = limit
+        self._cond = threading.Condition()
+        self._events = []
+        self._next_id = 1
+        self.closed = False
+
+    def emit(self, event: str, data: dict) -> None:
+        with self._cond:
+            if self.closed:
+                return
+            self._events.append((self._next_id, event, data))
+            self._next_id += 1
+            if len(self._events) > self.limit:
+                del self._events[:len(self._events) - self.limit]
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def read(self, after: int = 0, timeout: float = None) -> Tuple[list, int, bool]:
+        """返回 (ID 大于 after 的事件, 因缓冲区上限被丢弃的事件数, 事件流是否已结束且全部读完)。
+
+        没有新事件且未结束时最多等待 timeout 秒。
+        """
+        with self._cond:
+            if not self.closed and (not self._events or self._events[-1][0] <= after):
+                self._cond.wait(timeout)
+            first_id = self._events[0][0] if self._events else self._next_id
+            dropped = max(0, first_id - after - 1)
+            batch = [e for e in self._events if e[0] > after]
+            return batch, dropped, self.closed
+
+
+class StepContext:
+    """传给步骤函数的上下文。"""
+
+    def __init__(self, job_id: str, seq: int, cancel_event: threading.Event, name: str = None,
+                 events: JobEvents = None, timeout: float = None):
+        self.job_id = job_id
+        self.seq = seq
+        self.cancel_event = cancel_event
+        self.name = name
+        self.events = events
+        self.timeout = timeout
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def emit_line(self, stream: str, line: str) -> None:
+        """推送一行远程命令输出（stream 为 'stdout' 或 'stderr'）。"""
+        if self.events is None:
+            return
+        if len(line) > EVENT_LINE_LIMIT:
+            line = line[:EVENT_LINE_LIMIT] + ' ...'
+        self.events.emit('line', {'seq': self.seq, 'name': self.name, 'stream': stream, 'text': line})
+
+
+def _conflicts(a: Tuple[str, Optional[str]], b: Tuple[str, Optional[str]]) -> bool:
+    if a[0] != b[0]:
+        return False
+    return a[1] is None or b[1] is None or a[1] == b[1]
+
+
+class LockManager:
+    """按 (region, vm) 前缀冲突规则管理资源锁（非阻塞，由 JobManager 在加锁状态下调用）。"""
+
+    def __init__(self):
+        self._held = {}     # job_id -> [resource, ...]
+
+    def conflicts(self, resources, others) -> bool:
+        return any(_conflicts(a, b) for a in resources for b in others)
+
+    def can_acquire(self, resources) -> bool:
+        return not any(self.conflicts(resources, held) for held in self._held.values())
+
+    def acquire(self, job_id: str, resources) -> None:
+        self._held[job_id] = list(resources)
+
+    def release(self, job_id: str) -> None:
+        self._held.pop(job_id, None)
+
+
+class _Job:
+    def __init__(self, job_id: str, spec: JobSpec):
+        self.id = job_id
+        self.spec = spec
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+        self.events = JobEvents()
+
+
+def _clip(result):
+    if isinstance(result, dict):
+        out = dict(result)
+        for key in ('stdout', 'stderr'):
+            text = out.get(key)
+            if isinstance(text, str) and len(text) > RESULT_TEXT_LIMIT:
+                out[key] = text[:RESULT_TEXT_LIMIT] + f'\n... ({len(text) - RESULT_TEXT_LIMIT} more characters truncated)'
+        return out
+    return result
+
+
+class JobManager:
+    def __init__(self, db_path: str = None, max_workers: int = JOB_MAX_WORKERS):
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._locks = LockManager()
+        self._pending = []      # 等待资源的任务，按提交顺序
+        self._jobs = {}         # job_id -> _Job（未结束的任务）
+        self._finished_events = OrderedDict()   # job_id -> JobEvents（最近结束的任务）
+        self._recover()
+
+    # ----------------- DB -----------------
+
+    def _conn(self):
+        return esxi_db.get_conn(self.db_path)
+
+    def _recover(self) -> None:
+        """上一个进程退出时仍未结束的任务无法继续执行，标记为失败。"""
+        conn = self._conn()
+        try:
+            now = time.time()
+            conn.execute("UPDATE job_step SET status = ? WHERE status IN (?, ?) AND job_id IN "
+                         "(SELECT id FROM job WHERE status IN (?, ?))",
+                         (SKIPPED, PENDING, RUNNING, QUEUED, RUNNING))
+            conn.execute("UPDATE job SET status = ?, finished_at = ?, error = ? WHERE status IN (?, ?)",
+                         (FAILED, now, 'interrupted by server restart', QUEUED, RUNNING))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _update_job(self, job_id: str, **fields) -> None:
+        conn = self._conn()
+        try:
+            cols = ', '.join(f'{k} = ?' for k in fields)
+            conn.execute(f'UPDATE job SET {cols} WHERE id = ?', list(fields.values()) + [job_id])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _update_step(self, job_id: str, seq: int, **fields) -> None:
+        if 'result' in fields:
+            fields['result'] = json.dumps(_clip(fields['result']), ensure_ascii=False)
+        conn = self._conn()
+        try:
+            cols = ', '.join(f'{k} = ?' for k in fields)
+            conn.execute(f'UPDATE job_step SET {cols} WHERE job_id = ? AND seq = ?',
+                         list(fields.values()) + [job_id, seq])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _finish_remaining_steps(self, job_id: str, status: str) -> None:
+        conn = self._conn()
+        try:
+            conn.execute('UPDATE job_step SET status = ? WHERE job_id = ? AND status = ?', (status, job_id, PENDING))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ----------------- 调度 -----------------
+
+    def submit(self, spec: JobSpec) -> str:
+        """保存任务并加入队列，返回任务 ID。"""
+        job_id = uuid.uuid4().hex[:16]
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN')
+            conn.execute('INSERT INTO job (id, kind, region, status, payload, locks, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (job_id, spec.kind, spec.region, QUEUED,
+                          json.dumps(spec.payload, ensure_ascii=False) if spec.payload is not None else None,
+                          json.dumps(spec.locks), time.time()))
+            conn.executemany('INSERT INTO job_step (job_id, seq, name, status) VALUES (?, ?, ?, ?)',
+                             [(job_id, i, step.name, PENDING) for i, step in enumerate(spec.steps)])
+            conn.commit()
+        finally:
+            conn.close()
+        job = _Job(job_id, spec)
+        with self._lock:
+            self._jobs[job_id] = job
+            self._pending.append(job)
+        self._dispatch()
+        return job_id
+
+    def _dispatch(self) -> None:
+        """按提交顺序启动资源可用的任务；与更早排队的任务冲突的任务继续等待。"""
+        with self._lock:
+            blocked = []
+            still_pending = []
+            for job in self._pending:
+                locks = job.spec.locks
+                if self._locks.can_acquire(locks) and not self._locks.conflicts(locks, blocked):
+                    self._locks.acquire(job.id, locks)
+                    self._executor.submit(self._run, job)
+                else:
+                    blocked.extend(locks)
+                    still_pending.append(job)
+            self._pending = still_pending
+
+    def _run_step(self, job: _Job, seq: int, step: Step) -> Optional[str]:
+        """执行一个步骤并保存结果，返回错误信息（成功时为 None）。"""
+        events = job.events
+        self._update_step(job.id, seq, status=RUNNING, started_at=time.time())
+        events.emit('step', {'seq': seq, 'name': step.name, 'status': RUNNING})
+        try:
+            result = step.fn(StepContext(job.id, seq, job.cancel_event, step.name, events, step.timeout))
+        except Exception as e:
+            # 失败的步骤也带 cmd / stdout / stderr，便于与其它步骤的结果一起展示
+            self._update_step(job.id, seq, status=FAILED, finished_at=time.time(),
+                              result={'cmd': step.name, 'stdout': '', 'stderr': str(e),
+                                      'error': str(e), 'trace': traceback.format_exc()})
+            events.emit('step', {'seq': seq, 'name': step.name, 'status': FAILED, 'error': str(e)})
+            return f'{step.name}: {e}'
+        self._update_step(job.id, seq, status=SUCCEEDED, finished_at=time.time(), result=result)
+        events.emit('step', {'seq': seq, 'name': step.name, 'status': SUCCEEDED})
+        return None
+
+    def _run_parallel(self, job: _Job) -> List[str]:
+        """按阶段并发执行步骤（最多 spec.parallel 个同时执行），返回失败步骤的错误信息（按步骤顺序）。"""
+        def run_one(seq, step):
+            # 取消后尚未开始的步骤保持 pending，结束时统一标记为 cancelled
+            if job.cancel_event.is_set():
+                return None
+            return self._run_step(job, seq, step)
+
+        for stage in sorted({step.stage for step in job.spec.steps}):
+            steps = [(seq, step) for seq, step in enumerate(job.spec.steps) if step.stage == stage]
+            workers = min(job.spec.parallel, len(steps))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'job-{job.id[:6]}') as ex:
+                futures = [ex.submit(run_one, seq, step) for seq, step in steps]
+                errors = [e for e in (f.result() for f in futures) if e]
+            # 后续阶段依赖本阶段的结果，出错后剩余步骤标记为 skipped
+            if errors or job.cancel_event.is_set():
+                return errors
+        return []
+
+    def _run(self, job: _Job) -> None:
+        status, error = SUCCEEDED, None
+        events = job.events
+        try:
+            self._update_job(job.id, status=RUNNING, started_at=time.time())
+            events.emit('job', {'status': RUNNING})
+            if job.spec.parallel > 1 and len(job.spec.steps) > 1:
+                errors = self._run_parallel(job)
+                if errors:
+                    status, error = FAILED, '; '.join(errors)
+                elif job.cancel_event.is_set():
+                    status = CANCELLED
+            else:
+                for seq, step in enumerate(job.spec.steps):
+                    if job.cancel_event.is_set():
+                        status = CANCELLED
+                        break
+                    step_error = self._run_step(job, seq, step)
+                    if step_error:
+                        status, error = FAILED, step_error
+                        break
+        except Exception as e:
+            status, error = FAILED, str(e)
+        finally:
+            try:
+                self._finish_remaining_steps(job.id, CANCELLED if job.cancel_event.is_set() else SKIPPED)
+                self._update_job(job.id, status=status, finished_at=time.time(), error=error)
+            except Exception as e:
+                print(f"[jobs] 保存任务 {job.id} 状态失败: {e}")
+            self._close_events(job, status, error)
+            with self._lock:
+                self._locks.release(job.id)
+                self._jobs.pop(job.id, None)
+            job.done.set()
+            self._dispatch()
+
+    def _close_events(self, job: _Job, status: str, error: str = None) -> None:
+        """发送结束事件并关闭事件流；保留最近 FINISHED_EVENT_LOGS 个任务的事件供晚到的订阅者读取。"""
+        job.events.emit('end', {'status': status, 'error': error})
+        job.events.close()
+        with self._lock:
+            self._finished_events[job.id] = job.events
+            while len(self._finished_events) > FINISHED_EVENT_LOGS:
+                self._finished_events.popitem(last=False)
+
+    # ----------------- 公共接口 -----------------
+
+    def cancel(self, job_id: str) -> bool:
+        """取消任务：排队中的任务立即取消；运行中的任务在当前步骤结束后停止。返回任务是否仍未结束。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancel_event.set()
+            queued = job in self._pending
+            if queued:
+                self._pending.remove(job)
+                self._jobs.pop(job_id, None)
+        if queued:
+            self._finish_remaining_steps(job_id, CANCELLED)
+            self._update_job(job_id, status=CANCELLED, finished_at=time.time())
+            self._close_events(job, CANCELLED)
+            job.done.set()
+            self._dispatch()
+        return True
+
+    def wait(self, job_id: str, timeout: float = None) -> bool:
+        """等待任务结束，返回是否已结束。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return True
+        return job.done.wait(timeout)
+
+    def events(self, job_id: str) -> Optional[JobEvents]:
+        """返回任务的事件流；任务不在本进程中或已结束较久时返回 None。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.events
+            return self._finished_events.get(job_id)
+
+    def get(self, job_id: str, with_steps: bool = True) -> Optional[dict]:
+        """返回任务状态；with_steps 时包含每个步骤及其结果。"""
+        conn = self._conn()
+        try:
+            row = conn.execute('SELECT * FROM job WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = self._job_dict(row)
+            steps = conn.execute('SELECT seq, name, status, started_at, finished_at, result FROM job_step '
+                                 'WHERE job_id = ? ORDER BY seq', (job_id,)).fetchall()
+        finally:
+            conn.close()
+        job['progress'] = {
+            'total': len(steps),
+            'done': sum(1 for s in steps if s['status'] in (SUCCEEDED, FAILED, SKIPPED, CANCELLED)),
+        }
+        if with_steps:
+            job['steps'] = [{
+                'seq': s['seq'], 'name': s['name'], 'status': s['status'],
+                'started_at': s['started_at'], 'finished_at': s['finished_at'],
+                'result': json.loads(s['result']) if s['result'] else None,
+            } for s in steps]
+            job['results'] = [st['result'] for st in job['steps']
+                              if st['status'] in (SUCCEEDED, FAILED) and st['result'] is not None]
+        return job
+
+    def list(self, region: str = None, status: str = None, limit: int = 50) -> list:
+        sql = 'SELECT * FROM job'
+        where, params = [], []
+        if region:
+            where.append('region = ?')
+            params.append(region)
+        if status:
+            where.append('status = ?')
+            params.append(status)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+        conn = self._conn()
+        try:
+            return [self._job_dict(r) for r in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _job_dict(row) -> dict:
+        return {
+            'id': row['id'], 'kind': row['kind'], 'region': row['region'], 'status': row['status'],
+            'created_at': row['created_at'], 'started_at': row['started_at'],
+            'finished_at': row['finished_at'], 'error': row['error'],
+            'locks': json.loads(row['locks']) if row['locks'] else [],
+        }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager(db_path: str = None) -> JobManager:
+    """返回进程内共享的任务管理器（首次调用时创建）。"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(db_path)
+        return _manager
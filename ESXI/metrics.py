@@ -0,0 +1,224 @@
+"""进程内运行指标，以 Prometheus 文本格式（0.0.4）从 /metrics 导出。
+
+与 perf_metrics.py（ESXi 宿主机 / VM 的性能计数器）不同，这里记录的是本服务自身的耗时：
+
+- esxi_http_request_duration_seconds{method, route}：每个 Flask 路由（按 URL 规则，而非实际路径）的延迟；
+- esxi_sqlite_query_duration_seconds{op, table}：execute / executemany / fetchall / commit 的耗时
+  （见 esxi_db._TimedConnection；逐行迭代游标的时间不计入）；
+- esxi_ssh_connect_duration_seconds{host}、esxi_ssh_exec_duration_seconds{host, mode}：ssh_pool 的连接与命令；
+- esxi_remote_phase_duration_seconds{bundle, phase}：配置脚本的部署（deploy）与执行（run）阶段；
+- esxi_vsphere_call_duration_seconds{host, method}：每次 vSphere SOAP 调用（_count 即调用次数）。
+
+不依赖 prometheus_client：每个指标一把锁，observe 只做一次 bisect 与几次加法，标签组合在首次出现时创建。
+服务只运行一个进程（见 wsgi.py），因此不需要多进程汇总。
+
+用法:
+    start = time.perf_counter()
+    ...
+    metrics.SSH_CONNECT.observe(time.perf_counter() - start, host)
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 秒；HTTP / SSH / vSphere 跨越毫秒到分钟级
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# SQLite 语句通常在微秒到毫秒级
+SQLITE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}       # 标签值元组 -> 计数
+
+    def inc(self, *labelvalues, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for labelvalues, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}       # 标签值元组 -> [每个桶的计数..., +Inf 桶计数, 总和]
+
+    def observe(self, value: float, *labelvalues) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def collect(self) -> list:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        bounds = self.buckets + (math.inf,)
+        for labelvalues, series in items:
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'duplicate metric {metric.name}')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'esxi_http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status')))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'esxi_http_request_duration_seconds', 'Time to build the HTTP response, by route.', ('method', 'route')))
+SQLITE_LATENCY = REGISTRY.register(Histogram(
+    'esxi_sqlite_query_duration_seconds', 'SQLite statement time by operation and table.', ('op', 'table'),
+    buckets=SQLITE_BUCKETS))
+SQLITE_ERRORS = REGISTRY.register(Counter(
+    'esxi_sqlite_query_errors_total', 'SQLite statements that raised.', ('op', 'table')))
+SSH_CONNECT = REGISTRY.register(Histogram(
+    'esxi_ssh_connect_duration_seconds', 'New SSH connections (TCP + auth) by target host.', ('host',)))
+SSH_CONNECT_ERRORS = REGISTRY.register(Counter(
+    'esxi_ssh_connect_errors_total', 'Failed SSH connections by target host.', ('host',)))
+SSH_EXEC = REGISTRY.register(Histogram(
+    'esxi_ssh_exec_duration_seconds', 'Remote command time by target host (mode: exec or stream).',
+    ('host', 'mode')))
+SSH_EXEC_ERRORS = REGISTRY.register(Counter(
+    'esxi_ssh_exec_errors_total', 'Remote commands that raised (timeouts, broken channels).', ('host', 'mode')))
+REMOTE_PHASE = REGISTRY.register(Histogram(
+    'esxi_remote_phase_duration_seconds', 'Configure script phases: deploy (bundle sync) and run.',
+    ('bundle', 'phase')))
+VSPHERE_CALLS = REGISTRY.register(Histogram(
+    'esxi_vsphere_call_duration_seconds', 'vSphere SOAP calls by ESXi host and method.', ('host', 'method')))
+VSPHERE_ERRORS = REGISTRY.register(Counter(
+    'esxi_vsphere_call_errors_total', 'vSphere SOAP calls that raised (faults included).', ('host', 'method')))
+
+
+# ----------------- vSphere -----------------
+
+def instrument_vsphere(service_instance, host: str):
+    """包装会话的 SOAP stub，为每次方法调用与属性读取计时。返回 service_instance。"""
+    stub = getattr(service_instance, '_stub', None)
+    if stub is None or getattr(stub, '_esxi_metrics', False):
+        return service_instance
+    invoke_method = stub.InvokeMethod
+    invoke_accessor = stub.InvokeAccessor
+
+    def timed(method, call, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        except Exception:
+            VSPHERE_ERRORS.inc(host, method)
+            raise
+        finally:
+            VSPHERE_CALLS.observe(time.perf_counter() - start, host, method)
+
+    def InvokeMethod(mo, info, args, *rest, **kwargs):
+        return timed(info.wsdlName, invoke_method, mo, info, args, *rest, **kwargs)
+
+    def InvokeAccessor(mo, info):
+        return timed(f'{type(mo).__name__}.{info.name}', invoke_accessor, mo, info)
+
+    stub.InvokeMethod = InvokeMethod
+    stub.InvokeAccessor = InvokeAccessor
+    stub._esxi_metrics = True
+    return service_instance
+
+
+# ----------------- Flask -----------------
+
+def init_app(app) -> None:
+    """注册 /metrics 以及按路由统计的请求计时。
+
+    应在 compression.init_app 之前调用：after_request 按注册的逆序执行，计时因此包含压缩。
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+            HTTP_LATENCY.observe(time.perf_counter() - start, request.method, route)
+            HTTP_REQUESTS.inc(request.method, route, str(response.status_code))
+        return response
+
+    def metrics_view():
+        return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
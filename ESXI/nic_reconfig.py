@@ -0,0 +1,242 @@
+"""用 pyVmomi 原生接口重建 VM 网卡（替代 script/rebuild_vm_nics_govc.sh）。
+
+govc 脚本对每台 VM 依次执行 vm.info、device.ls、逐个 device.remove、每个网络一次 ls 与
+vm.network.add，全部串行。这里对一个区域：
+
+- 一次 PropertyCollector 读取全部 VM 的设备列表与全部网络（端口组）名称；
+- 每台 VM 构造一个 VirtualMachineConfigSpec：删除除第一块网卡（ethernet-0）外的所有网卡，
+  并为每个端口组添加一块网卡，只调用一次 ReconfigVM_Task；
+- 所有 VM 的任务同时提交，再用一个 PropertyCollector（WaitForUpdatesEx）一起等待完成。
+
+不存在的端口组与 govc 脚本一样跳过并给出提示。
+
+用法:
+    results = nic_reconfig.reconfigure_region('s05', {'s05-switchpc7': ['sw4-h2', 'VM-Net1']})
+"""
+import threading
+import time
+from typing import Callable, Dict, List
+
+from pyVmomi import vim, vmodl
+
+from esxi_config import ESXI_IP
+import control
+
+# 与 govc 脚本一致的默认网卡类型
+DEFAULT_ADAPTER = 'e1000'
+ADAPTER_TYPES = {
+    'e1000': vim.vm.device.VirtualE1000,
+    'e1000e': vim.vm.device.VirtualE1000e,
+    'vmxnet3': vim.vm.device.VirtualVmxnet3,
+}
+# 等待一个区域全部重配置任务的最长时间（秒）
+TASK_TIMEOUT = 600
+# WaitForUpdatesEx 单次等待的最长时间（秒）
+WAIT_POLL_SECONDS = 30
+
+
+def _nic_device_changes(devices, port_groups: List[str], networks: Dict[str, object], adapter: str) -> tuple:
+    """返回 (deviceChange 列表, 日志行列表)。"""
+    card_type = ADAPTER_TYPES[adapter]
+    nics = [d for d in devices or [] if isinstance(d, vim.vm.device.VirtualEthernetCard)]
+    changes, log = [], []
+    # 与 govc 的 ethernet-0 相同：按设备列表顺序保留第一块网卡
+    for nic in nics[1:]:
+        changes.append(vim.vm.device.VirtualDeviceSpec(
+            operation=vim.vm.device.VirtualDeviceSpec.Operation.remove, device=nic))
+        log.append(f"删除设备 {nic.deviceInfo.label if nic.deviceInfo else nic.key}")
+    for i, pg in enumerate(port_groups):
+        network = networks.get(pg)
+        if network is None:
+            log.append(f"PortGroup '{pg}' 不存在，请先创建")
+            continue
+        card = card_type()
+        # 新设备使用负数临时 key
+        card.key = -(i + 1)
+        card.addressType = 'generated'
+        card.backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo(deviceName=pg, network=network)
+        card.connectable = vim.vm.device.VirtualDevice.ConnectInfo(
+            startConnected=True, connected=True, allowGuestControl=True)
+        changes.append(vim.vm.device.VirtualDeviceSpec(
+            operation=vim.vm.device.VirtualDeviceSpec.Operation.add, device=card))
+        log.append(f"添加网络 '{pg}' (类型: {adapter})")
+    return changes, log
+
+
+def wait_for_tasks(content, tasks: dict, timeout: float = TASK_TIMEOUT,
+                   on_done: Callable[[object, str, object], None] = None) -> list:
+    """用一个独立的 PropertyCollector 同时等待多个任务。
+
+    tasks:   { key: vim.Task }
+    on_done: 每个任务结束时调用 on_done(key, state, error)
+    返回超时仍未结束的 key 列表。
+    """
+    if not tasks:
+        return []
+    pc = content.propertyCollector.CreatePropertyCollector()
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks.values()],
+        propSet=[vmodl.query.PropertyCollector.PropertySpec(type=vim.Task, pathSet=['info.state', 'info.error'])])
+    pc.CreateFilter(filter_spec, True)
+    by_moid = {task._GetMoId(): key for key, task in tasks.items()}
+    pending = set(by_moid)
+    states, errors = {}, {}
+    finished = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+    deadline = time.monotonic() + timeout
+    version = ''
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=max(1, int(min(remaining, WAIT_POLL_SECONDS))))
+            update = pc.WaitForUpdatesEx(version, options)
+            if update is None:
+                continue
+            version = update.version
+            for filter_update in update.filterSet or []:
+                for obj_update in filter_update.objectSet or []:
+                    moid = obj_update.obj._GetMoId()
+                    for change in obj_update.changeSet or []:
+                        if change.name == 'info.state':
+                            states[moid] = change.val
+                        elif change.name == 'info.error':
+                            errors[moid] = change.val
+                    if moid in pending and states.get(moid) in finished:
+                        pending.discard(moid)
+                        if on_done:
+                            on_done(by_moid[moid], states[moid], errors.get(moid))
+    finally:
+        # 销毁 PropertyCollector 时其上的过滤器一并销毁
+        try:
+            pc.Destroy()
+        except Exception:
+            pass
+    return [by_moid[m] for m in pending]
+
+
+def reconfigure_vms(content, vm_ports: Dict[str, List[str]], adapter: str = DEFAULT_ADAPTER,
+                    timeout: float = TASK_TIMEOUT, on_line: Callable[[str, str], None] = None) -> Dict[str, dict]:
+    """在当前会话中重建多台 VM 的网卡。
+
+    vm_ports: { vm_name: [端口组名称, ...] }
+    on_line:  on_line(vm_name, 日志行)，用于实时输出进度
+    返回: { vm_name: {'ok': bool, 'log': [日志行, ...], 'error': str 或 None} }
+    """
+    if adapter not in ADAPTER_TYPES:
+        raise ValueError(f"不支持的网卡类型 '{adapter}'，可选: {', '.join(ADAPTER_TYPES)}")
+    results = {vm: {'ok': False, 'log': [], 'error': None} for vm in vm_ports}
+
+    def log(vm, line):
+        results[vm]['log'].append(line)
+        if on_line:
+            try:
+                on_line(vm, line)
+            except Exception as e:
+                print(f"[nic] 输出回调出错: {e}")
+
+    rows = control._retrieve_multi_properties(content, {
+        vim.VirtualMachine: ('name', 'config.hardware.device'),
+        vim.Network: ('name',),
+    })
+    vms = {}
+    networks = {}
+    for row in rows:
+        if isinstance(row['obj'], vim.VirtualMachine):
+            vms[row.get('name')] = row
+        elif row.get('name'):
+            networks[row['name']] = row['obj']
+
+    tasks = {}
+    for vm_name, port_groups in vm_ports.items():
+        row = vms.get(vm_name)
+        if row is None:
+            results[vm_name]['error'] = f"未找到虚拟机 '{vm_name}'"
+            log(vm_name, results[vm_name]['error'])
+            continue
+        changes, lines = _nic_device_changes(row.get('config.hardware.device'), port_groups, networks, adapter)
+        for line in lines:
+            log(vm_name, line)
+        if not changes:
+            results[vm_name]['ok'] = True
+            log(vm_name, '无需修改')
+            continue
+        try:
+            tasks[vm_name] = row['obj'].ReconfigVM_Task(spec=vim.vm.ConfigSpec(deviceChange=changes))
+            log(vm_name, f"已提交 ReconfigVM_Task（{len(changes)} 项设备变更）")
+        except Exception as e:
+            results[vm_name]['error'] = f"提交 ReconfigVM_Task 失败: {getattr(e, 'msg', None) or e}"
+            log(vm_name, results[vm_name]['error'])
+
+    def done(vm_name, state, error):
+        if state == vim.TaskInfo.State.success:
+            results[vm_name]['ok'] = True
+            log(vm_name, '操作完成')
+        else:
+            results[vm_name]['error'] = f"ReconfigVM_Task 失败: {getattr(error, 'msg', None) or error}"
+            log(vm_name, results[vm_name]['error'])
+
+    for vm_name in wait_for_tasks(content, tasks, timeout, done):
+        results[vm_name]['error'] = f"ReconfigVM_Task 超过 {timeout}s 未完成"
+        log(vm_name, results[vm_name]['error'])
+    return results
+
+
+def reconfigure_region(esxi_key: str, vm_ports: Dict[str, List[str]], adapter: str = DEFAULT_ADAPTER,
+                       timeout: float = TASK_TIMEOUT, on_line: Callable[[str, str], None] = None) -> Dict[str, dict]:
+    """连接区域的 ESXi 并重建 vm_ports 中全部 VM 的网卡（一个会话、每台 VM 一个任务）。"""
+    esxi_host = ESXI_IP.get(esxi_key)
+    if not esxi_host:
+        raise ValueError(f"未知区域 '{esxi_key}'")
+    service_instance = control._connect_esxi(esxi_host, control.ESXI_USER, control.ESXI_PASS)
+    try:
+        return reconfigure_vms(service_instance.RetrieveContent(), vm_ports, adapter, timeout, on_line)
+    finally:
+        control._disconnect_esxi(service_instance)
+
+
+class RegionBatch:
+    """供任务引擎使用：同一区域的多个 VM 步骤共享一次批量重配置。
+
+    第一个执行的步骤完成整个区域的操作，其它步骤等待并取回自己 VM 的结果；每台 VM 的日志行
+    实时转发给已开始的对应步骤。
+    """
+
+    def __init__(self, esxi_key: str, vm_ports: Dict[str, List[str]], adapter: str = DEFAULT_ADAPTER,
+                 timeout: float = TASK_TIMEOUT):
+        self.esxi_key = esxi_key
+        self.vm_ports = vm_ports
+        self.adapter = adapter
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._started = False
+        self._done = threading.Event()
+        self._listeners = {}    # vm_name -> on_line(line)
+        self._results = None
+        self._error = None
+
+    def _forward(self, vm_name: str, line: str) -> None:
+        listener = self._listeners.get(vm_name)
+        if listener:
+            listener(line)
+
+    def result(self, vm_name: str, on_line: Callable[[str], None] = None) -> dict:
+        """返回 vm_name 的结果；必要时执行整个区域的批量操作。"""
+        with self._lock:
+            if on_line:
+                self._listeners[vm_name] = on_line
+            run = not self._started
+            self._started = True
+        if run:
+            try:
+                self._results = reconfigure_region(self.esxi_key, self.vm_ports, self.adapter, self.timeout,
+                                                   self._forward)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._done.set()
+        else:
+            self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._results[vm_name]
@@ -0,0 +1,263 @@
+"""通过 PerfManager 批量采集宿主机与 VM 的性能计数器并写入 SQLite。
+
+每个区域一次会话：用一次 PropertyCollector 读取宿主机与已开机 VM，再把所有实体、所有计数器
+合并成少量 QueryPerf 请求（每个请求的 实体数 x 计数器数 不超过 MAX_QUERY_METRICS，realtime 20 秒间隔，
+CSV 格式以减小响应体积）。结果写入 `perf_sample` 表（esxi_db 迁移 v4）。
+
+增量采集：每个区域只请求 DB 中最新采样时间之后的数据；首次采集取最近 INITIAL_SAMPLES 个点
+（realtime 数据在 ESXi 上只保留约 1 小时）。
+
+用法:
+    python perf_metrics.py              # 采集 ESXI_IP 中的全部区域一次
+    python perf_metrics.py --loop s05   # 每 POLL_INTERVAL 秒持续采集指定区域
+"""
+import argparse
+import calendar
+import datetime
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from pyVmomi import vim
+
+from esxi_config import ESXI_IP
+import control
+
+# realtime 统计间隔（秒）
+REALTIME_INTERVAL = 20
+# 首次采集时每个实体取回的采样点数（15 x 20s = 5 分钟）
+INITIAL_SAMPLES = 15
+# 单个 QueryPerf 请求的指标数上限（实体数 x 计数器数；vCenter 的 config.vpxd.stats.maxQueryMetrics 默认 256）
+MAX_QUERY_METRICS = 256
+# 采样数据保留时长（秒）
+RETENTION_SECONDS = 24 * 3600
+# --loop 模式下的采集间隔（秒）
+POLL_INTERVAL = 60
+# 宿主机自身计数器在 perf_sample.entity 中使用的名称
+HOST_ENTITY = '@host'
+
+# 计数器名称 -> 实例（'' 为聚合值，'*' 为所有实例，例如每块网卡 / 每个数据存储）
+COUNTERS = {
+    'cpu.usage.average': '',           # 0.01%
+    'cpu.ready.summation': '',         # 毫秒 / 采样间隔
+    'cpu.costop.summation': '',
+    'mem.usage.average': '',           # 0.01%
+    'mem.active.average': '',          # KB
+    'mem.swapinRate.average': '',      # KBps
+    'net.received.average': '*',       # KBps
+    'net.transmitted.average': '*',
+    'net.droppedRx.summation': '*',
+    'net.droppedTx.summation': '*',
+    'datastore.read.average': '*',     # KBps
+    'datastore.write.average': '*',
+    'datastore.totalReadLatency.average': '*',   # 毫秒
+    'datastore.totalWriteLatency.average': '*',
+}
+
+
+def _counter_ids(perf_manager, names) -> Dict[str, int]:
+    """把 'group.name.rollup' 形式的计数器名称解析为本会话中的 counterId。"""
+    wanted = set(names)
+    ids = {}
+    for c in perf_manager.perfCounter or []:
+        full = f"{c.groupInfo.key}.{c.nameInfo.key}.{c.rollupType}"
+        if full in wanted:
+            ids[full] = c.key
+    return ids
+
+
+def _load_entities(content) -> list:
+    """一次批量读取宿主机与已开机的 VM，返回 [(托管对象, entity 名称), ...]。"""
+    rows = control._retrieve_multi_properties(content, {
+        vim.HostSystem: ('name',),
+        vim.VirtualMachine: ('name', 'runtime.powerState'),
+    })
+    entities = []
+    for row in rows:
+        if isinstance(row['obj'], vim.HostSystem):
+            entities.append((row['obj'], HOST_ENTITY))
+        elif row.get('name') and row.get('runtime.powerState') == vim.VirtualMachinePowerState.poweredOn:
+            entities.append((row['obj'], row['name']))
+    return entities
+
+
+def _parse_csv_metric(entity_name: str, metric, counter_names: Dict[int, str]) -> list:
+    """把一个 PerfEntityMetricCSV 展开为 [(entity, counter, instance, ts, value), ...]。"""
+    # sampleInfoCSV: "interval,timestamp,interval,timestamp,..."
+    info = (metric.sampleInfoCSV or '').split(',')
+    stamps = []
+    for raw in info[1::2]:
+        try:
+            # 时间戳为 UTC，例如 2024-05-01T08:00:20Z
+            stamps.append(calendar.timegm(time.strptime(raw[:19], '%Y-%m-%dT%H:%M:%S')))
+        except ValueError:
+            stamps.append(None)
+    out = []
+    for series in metric.value or []:
+        counter = counter_names.get(series.id.counterId)
+        if counter is None:
+            continue
+        for ts, raw in zip(stamps, (series.value or '').split(',')):
+            if ts is None or raw == '':
+                continue
+            try:
+                value = int(raw)
+            except ValueError:
+                continue
+            # -1 表示该采样点没有数据
+            if value < 0:
+                continue
+            out.append((entity_name, counter, series.id.instance or '', ts, value))
+    return out
+
+
+def collect_region_metrics(content, since: int = None) -> list:
+    """采集当前会话中所有宿主机与已开机 VM 的性能计数器。
+
+    since: 只返回该 Unix 时间之后的采样点；None 时取最近 INITIAL_SAMPLES 个点。
+    返回: [(entity, counter, instance, ts, value), ...]
+    """
+    perf_manager = content.perfManager
+    ids = _counter_ids(perf_manager, COUNTERS)
+    if not ids:
+        return []
+    counter_names = {cid: name for name, cid in ids.items()}
+    metric_ids = [vim.PerformanceManager.MetricId(counterId=cid, instance=COUNTERS[name])
+                  for name, cid in ids.items()]
+
+    entities = _load_entities(content)
+    names = {obj._GetMoId(): name for obj, name in entities}
+    start_time = None
+    if since:
+        start_time = datetime.datetime.fromtimestamp(since, tz=datetime.timezone.utc)
+
+    samples = []
+    # 每个请求的实体数由计数器数决定（'*' 实例按一个计数器计）
+    batch = max(1, MAX_QUERY_METRICS // len(metric_ids))
+    for i in range(0, len(entities), batch):
+        specs = []
+        for obj, _ in entities[i:i + batch]:
+            spec = vim.PerformanceManager.QuerySpec(entity=obj, metricId=metric_ids,
+                                                    intervalId=REALTIME_INTERVAL, format='csv')
+            if start_time:
+                spec.startTime = start_time
+            else:
+                spec.maxSample = INITIAL_SAMPLES
+            specs.append(spec)
+        try:
+            results = perf_manager.QueryPerf(querySpec=specs) or []
+        except Exception as e:
+            print(f"[perf] QueryPerf 失败（{len(specs)} 个实体）: {e}")
+            continue
+        for metric in results:
+            entity_name = names.get(metric.entity._GetMoId())
+            if entity_name is not None:
+                samples.extend(_parse_csv_metric(entity_name, metric, counter_names))
+    return samples
+
+
+# ----------------- DB -----------------
+
+def _latest_sample_ts(conn: sqlite3.Connection, esxi_key: str) -> int:
+    row = conn.execute("SELECT MAX(ts) FROM perf_sample WHERE esxi_key = ?", (esxi_key,)).fetchone()
+    return row[0] if row and row[0] else None
+
+
+def save_metrics_to_db(esxi_key: str, samples: list, retention: int = RETENTION_SECONDS) -> int:
+    """批量写入采样点（重复的采样点忽略），并删除超过 retention 秒的旧数据。返回写入的行数。"""
+    conn = control._get_db_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN")
+        before = conn.total_changes
+        cur.executemany(
+            "INSERT OR IGNORE INTO perf_sample (esxi_key, entity, counter, instance, ts, value) VALUES (?, ?, ?, ?, ?, ?)",
+            [(esxi_key,) + s for s in samples])
+        inserted = conn.total_changes - before
+        cur.execute("DELETE FROM perf_sample WHERE ts < ?", (int(time.time()) - retention,))
+        conn.commit()
+        return inserted
+    except Exception as e:
+        conn.rollback()
+        print(f"[perf] 保存 {esxi_key} 性能数据出错: {e}")
+        return 0
+    finally:
+        conn.close()
+
+
+def collect_and_store_region(esxi_key: str, esxi_host: str = None, timeout: float = None) -> dict:
+    """连接一个区域的 ESXi，增量采集性能计数器并写入 DB。"""
+    esxi_host = esxi_host or ESXI_IP.get(esxi_key)
+    started = time.monotonic()
+    conn = control._get_db_conn()
+    try:
+        since = _latest_sample_ts(conn, esxi_key)
+    finally:
+        conn.close()
+
+    service_instance = None
+    try:
+        service_instance = control._connect_esxi(esxi_host, control.ESXI_USER, control.ESXI_PASS, timeout=timeout)
+        samples = collect_region_metrics(service_instance.RetrieveContent(), since)
+    except Exception as e:
+        print(f"[perf] 采集区域 {esxi_key} 失败: {e}")
+        return {'region': esxi_key, 'ok': False, 'samples': 0, 'seconds': time.monotonic() - started}
+    finally:
+        control._disconnect_esxi(service_instance)
+
+    inserted = save_metrics_to_db(esxi_key, samples)
+    return {'region': esxi_key, 'ok': True, 'samples': inserted, 'seconds': time.monotonic() - started}
+
+
+def collect_all_regions(regions: list = None, max_workers: int = control.INIT_MAX_WORKERS) -> Dict[str, dict]:
+    """并发采集多个区域（默认 ESXI_IP 中的全部区域）。"""
+    regions = list(regions or ESXI_IP.keys())
+    if not regions:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(regions))), thread_name_prefix='perf') as ex:
+        results = list(ex.map(collect_and_store_region, regions))
+    return {r['region']: r for r in results}
+
+
+def query_recent_metrics(esxi_key: str, entity: str, counters: List[str] = None, window: int = 600,
+                         conn: sqlite3.Connection = None) -> dict:
+    """读取某个 VM（或 HOST_ENTITY）最近 window 秒的采样。
+
+    返回: { counter: { instance: [[ts, value], ...] } }，每个序列按时间升序。
+    """
+    own = conn is None
+    conn = conn or control._get_db_conn()
+    try:
+        sql = ("SELECT counter, instance, ts, value FROM perf_sample "
+               "WHERE esxi_key = ? AND entity = ? AND ts >= ?")
+        params = [esxi_key, entity, int(time.time()) - int(window)]
+        if counters:
+            sql += f" AND counter IN ({','.join('?' * len(counters))})"
+            params.extend(counters)
+        sql += " ORDER BY counter, instance, ts"
+        out = {}
+        for counter, instance, ts, value in conn.execute(sql, params):
+            out.setdefault(counter, {}).setdefault(instance, []).append([ts, value])
+        return out
+    finally:
+        if own:
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='采集 ESXi 宿主机与 VM 的性能计数器')
+    parser.add_argument('regions', nargs='*', help='区域（默认 ESXI_IP 中的全部区域）')
+    parser.add_argument('--loop', action='store_true', help=f'每 {POLL_INTERVAL} 秒持续采集')
+    args = parser.parse_args()
+    while True:
+        for r in collect_all_regions(args.regions).values():
+            status = 'ok' if r['ok'] else 'failed'
+            print(f"[perf] {r['region']}: {status}，写入 {r['samples']} 个采样点，耗时 {r['seconds']:.1f}s")
+        if not args.loop:
+            break
+        time.sleep(POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    main()
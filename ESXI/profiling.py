@@ -0,0 +1,302 @@
+"""按请求开启的性能分析（仅管理员）。
+
+请求带上 `?profile=1` 或请求头 `X-Profile: 1`，并携带与环境变量 ESXI_ADMIN_TOKEN 一致的
+`X-Admin-Token` 请求头时，本次请求会被分析；未设置 ESXI_ADMIN_TOKEN 时该功能关闭。
+
+- cprofile（默认，profile=1 / cprofile）：对处理请求的线程启用 cProfile，保存为 `<id>.pstats`；
+  同时按 SAMPLE_INTERVAL 对该线程采样调用栈，保存为 collapsed stack 格式的 `<id>.folded`
+  （可直接交给 flamegraph.pl / speedscope）；
+- sample（profile=sample）：只采样，但覆盖进程内所有线程。同步等待任务的接口（例如
+  /api/topology/install_ports）实际工作在任务线程中，需要用这个模式；每条栈以线程名（去掉编号）开头，
+  其它并发请求的线程也会出现在结果中。
+
+结果与元数据（`<id>.json`：路由、耗时、状态码等）写入 PROFILE_DIR，只保留最近 MAX_PROFILES 份。
+响应头 `X-Profile-Id` 返回本次结果的 id；同一时间只分析一个请求，其它请求返回 `X-Profile: busy`。
+
+查看：GET /api/profiles、GET /api/profiles/<id>（含耗时最多的函数）、GET /api/profiles/<id>/pstats|folded。
+"""
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Blueprint, abort, g, jsonify, request, send_file
+
+PROFILE_DIR = os.environ.get('ESXI_PROFILE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+MAX_PROFILES = 50
+# 调用栈采样间隔（秒）
+SAMPLE_INTERVAL = 0.005
+# /api/profiles/<id> 中列出的函数数量
+TOP_FUNCTIONS = 40
+MODES = ('cprofile', 'sample')
+
+_active = threading.Lock()
+_ID = re.compile(r'^[0-9a-f]{12}$')
+_THREAD_NO = re.compile(r'[-_]?\d+$')
+
+profiles = Blueprint('profiles', __name__)
+
+
+def admin_token():
+    return os.environ.get('ESXI_ADMIN_TOKEN') or None
+
+
+def is_admin() -> bool:
+    token = admin_token()
+    given = request.headers.get('X-Admin-Token') or ''
+    return token is not None and hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8'))
+
+
+def requested_mode():
+    """请求要求的分析模式（None 表示不分析）。"""
+    value = (request.args.get('profile') or request.headers.get('X-Profile') or '').strip().lower()
+    if value in ('', '0', 'false', 'off'):
+        return None
+    if value in ('1', 'true', 'on'):
+        return 'cprofile'
+    return value if value in MODES else None
+
+
+# ----------------- 采样 -----------------
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """后台线程每隔 interval 秒读取 sys._current_frames()，累计 collapsed stack。
+
+    thread_id 为 None 时采样所有线程（不含采样线程本身），栈以线程名开头。
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()} if self.thread_id is None else {}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (self.thread_id is not None and ident != self.thread_id):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if self.thread_id is None:
+                    stack.append(_THREAD_NO.sub('', names.get(ident, 'thread')) or 'thread')
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+# ----------------- 存储 -----------------
+
+def _path(profile_id: str, ext: str) -> str:
+    return os.path.join(PROFILE_DIR, f'{profile_id}.{ext}')
+
+
+def _prune() -> None:
+    metas = sorted((f for f in os.listdir(PROFILE_DIR) if f.endswith('.json')),
+                   key=lambda f: os.path.getmtime(os.path.join(PROFILE_DIR, f)), reverse=True)
+    for name in metas[MAX_PROFILES:]:
+        profile_id = name[:-len('.json')]
+        for ext in ('json', 'pstats', 'folded'):
+            try:
+                os.remove(_path(profile_id, ext))
+            except OSError:
+                pass
+
+
+def save(meta: dict, profiler=None, sampler: StackSampler = None) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    files = []
+    if profiler is not None:
+        profiler.dump_stats(_path(meta['id'], 'pstats'))
+        files.append('pstats')
+    if sampler is not None:
+        with open(_path(meta['id'], 'folded'), 'w', encoding='utf-8') as f:
+            f.write(sampler.folded())
+        files.append('folded')
+    meta['files'] = files
+    # 元数据最后写入，列表中只出现完整的结果
+    with open(_path(meta['id'], 'json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    _prune()
+
+
+def list_profiles(limit: int = MAX_PROFILES) -> list:
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    out = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name), encoding='utf-8') as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    out.sort(key=lambda m: m.get('started') or 0, reverse=True)
+    return out[:limit]
+
+
+def load_meta(profile_id: str):
+    if not _ID.match(profile_id or ''):
+        return None
+    try:
+        with open(_path(profile_id, 'json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def top_functions(profile_id: str, limit: int = TOP_FUNCTIONS, sort: str = 'cumulative') -> str:
+    buf = io.StringIO()
+    stats = pstats.Stats(_path(profile_id, 'pstats'), stream=buf)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return buf.getvalue()
+
+
+# ----------------- Flask -----------------
+
+def _start():
+    mode = requested_mode()
+    if mode is None or not is_admin():
+        return
+    if not _active.acquire(blocking=False):
+        g.profile_busy = True
+        return
+    profiler = None
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident() if mode == 'cprofile' else None)
+    g.profile = {
+        'id': uuid.uuid4().hex[:12], 'mode': mode, 'started': time.time(),
+        't0': time.perf_counter(), 'cpu0': time.thread_time(),
+        'profiler': profiler, 'sampler': sampler,
+    }
+    sampler.start()
+    if profiler is not None:
+        profiler.enable()
+
+
+def _finish(response):
+    if g.pop('profile_busy', False):
+        response.headers['X-Profile'] = 'busy'
+        return response
+    state = g.pop('profile', None)
+    if state is None:
+        return response
+    try:
+        profiler, sampler = state['profiler'], state['sampler']
+        if profiler is not None:
+            profiler.disable()
+        duration = time.perf_counter() - state['t0']
+        cpu = time.thread_time() - state['cpu0']
+        sampler.stop()
+        meta = {
+            'id': state['id'], 'mode': state['mode'], 'method': request.method, 'path': request.path,
+            'route': request.url_rule.rule if request.url_rule is not None else None,
+            'query': request.query_string.decode('utf-8', errors='ignore'),
+            'status': response.status_code, 'started': state['started'],
+            'duration': round(duration, 6), 'cpu_seconds': round(cpu, 6), 'samples': sampler.samples,
+        }
+        try:
+            save(meta, profiler, sampler)
+            response.headers['X-Profile-Id'] = state['id']
+        except Exception as e:
+            print(f"[profile] 保存分析结果失败: {e}")
+    finally:
+        _active.release()
+    return response
+
+
+def _teardown(exc):
+    # after_request 没有执行（例如响应处理中抛出异常）时停止分析并释放锁，不保存结果
+    state = g.pop('profile', None)
+    if state is None:
+        return
+    try:
+        if state['profiler'] is not None:
+            state['profiler'].disable()
+        state['sampler'].stop()
+    finally:
+        _active.release()
+
+
+def init_app(app) -> None:
+    """注册分析钩子与 /api/profiles。
+
+    应在 metrics / compression 之后调用：before_request 最后执行、after_request 最先执行，
+    分析范围尽量只包含路由本身。
+    """
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_teardown)
+    app.register_blueprint(profiles)
+
+
+@profiles.before_request
+def _require_admin():
+    if admin_token() is None:
+        return jsonify({'ok': False, 'error': 'profiling is disabled (ESXI_ADMIN_TOKEN not set)'}), 403
+    if not is_admin():
+        return jsonify({'ok': False, 'error': 'admin token required'}), 403
+
+
+@profiles.route('/api/profiles')
+def api_profiles():
+    try:
+        limit = max(1, min(MAX_PROFILES, int(request.args.get('limit') or MAX_PROFILES)))
+    except ValueError:
+        limit = MAX_PROFILES
+    return jsonify({'ok': True, 'profiles': list_profiles(limit)})
+
+
+@profiles.route('/api/profiles/<profile_id>')
+def api_profile(profile_id):
+    meta = load_meta(profile_id)
+    if meta is None:
+        return jsonify({'ok': False, 'error': 'profile not found'}), 404
+    out = dict(meta)
+    if 'pstats' in meta.get('files', []):
+        sort = request.args.get('sort') or 'cumulative'
+        try:
+            out['top'] = top_functions(profile_id, sort=sort)
+        except Exception as e:
+            out['top_error'] = str(e)
+    return jsonify({'ok': True, 'profile': out})
+
+
+@profiles.route('/api/profiles/<profile_id>/<kind>')
+def api_profile_file(profile_id, kind):
+    meta = load_meta(profile_id)
+    if meta is None or kind not in meta.get('files', []):
+        abort(404)
+    mimetype = 'text/plain' if kind == 'folded' else 'application/octet-stream'
+    return send_file(_path(profile_id, kind), mimetype=mimetype, as_attachment=True,
+                     download_name=f'{profile_id}.{kind}')
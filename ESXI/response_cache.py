@@ -0,0 +1,150 @@
+"""web_api 只读接口的响应缓存（ETag / If-None-Match + 预序列化、预压缩的响应体）。
+
+每个缓存的接口声明它依赖的数据范围（某个区域，或 esxi_db.ALL_SCOPE）。请求到来时只读取
+一次该范围的 data_version（一条主键查询）：
+
+- 客户端的 If-None-Match 与当前版本一致时直接返回 304，不查询、不序列化；
+- 缓存中有同一 URL、同一版本的响应体时直接返回（按 Accept-Encoding 返回 gzip 或原文）；
+- 否则执行视图函数，把 JSON 响应体与其 gzip 版本存入按字节数限制的 LRU。
+
+版本号由 control.py 的写入函数在同一事务中递增（见 esxi_db.bump_data_version）。
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, make_response
+
+import esxi_db
+
+# LRU 上限：条目数与响应体总字节数（原文 + gzip）
+MAX_ENTRIES = 256
+MAX_BYTES = 64 * 1024 * 1024
+# 小于该字节数的响应体不压缩
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (etag, body, gzipped_body or None, mimetype)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, etag, body: bytes, mimetype: str):
+        gz = gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_BYTES else None
+        entry = (etag, body, gz, mimetype)
+        size = len(body) + (len(gz) if gz else 0)
+        if size > self.max_bytes:
+            return entry
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self._entry_size(old)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._entry_size(evicted)
+        return entry
+
+    @staticmethod
+    def _entry_size(entry) -> int:
+        return len(entry[1]) + (len(entry[2]) if entry[2] else 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits,
+                    'misses': self.misses, 'not_modified': self.not_modified}
+
+
+_cache = ResponseCache()
+
+
+def get_cache() -> ResponseCache:
+    return _cache
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in [t.strip() for t in header.split(',')]
+
+
+def _respond(entry, status: int = 200):
+    etag, body, gz, mimetype = entry
+    use_gzip = gz is not None and 'gzip' in (request.headers.get('Accept-Encoding') or '')
+    resp = make_response(gz if use_gzip else body, status)
+    resp.mimetype = mimetype
+    if use_gzip:
+        resp.headers['Content-Encoding'] = 'gzip'
+    resp.headers['ETag'] = etag
+    resp.headers['Vary'] = 'Accept-Encoding'
+    # 每次都向服务器确认（条件请求很便宜），避免浏览器使用过期数据
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+def cached(get_conn, scope=None):
+    """缓存视图函数的 JSON 响应。
+
+    get_conn: 返回 sqlite3 连接的函数（用于读取 data_version）
+    scope:    依赖的数据范围；可以是视图参数名（例如 'esxi_key'），为 None 时使用 ALL_SCOPE
+    只缓存 200 响应；其它状态码原样返回。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            data_scope = kwargs.get(scope) if scope else esxi_db.ALL_SCOPE
+            conn = get_conn()
+            try:
+                version = esxi_db.get_data_version(conn, data_scope)
+            finally:
+                conn.close()
+            key = request.full_path
+            digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+            # 弱 ETag：gzip 与原文两种编码共用同一个标签
+            etag = f'W/"{version}-{digest}"'
+
+            if _etag_matches(request.headers.get('If-None-Match'), etag):
+                with _cache._lock:
+                    _cache.not_modified += 1
+                resp = make_response('', 304)
+                resp.headers['ETag'] = etag
+                resp.headers['Vary'] = 'Accept-Encoding'
+                resp.headers['Cache-Control'] = 'no-cache'
+                return resp
+
+            entry = _cache.get(key, etag)
+            if entry is None:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200 or resp.direct_passthrough:
+                    return resp
+                entry = _cache.put(key, etag, resp.get_data(), resp.mimetype)
+            return _respond(entry)
+        return wrapper
+    return decorator
@@ -0,0 +1,163 @@
+"""按内容哈希把 ESXI/script 中的脚本部署到交换机 / 主机 VM。
+
+过去 configure_sw / configure_host 只用 sftp.stat 检查脚本是否存在，旧版本永远不会被替换，
+reset_sw_config.sh 等辅助脚本则假定已经在 VM 上。这里：
+
+- 每组脚本（BUNDLES）有一份清单 { 文件名: sha256 }，清单整体的哈希作为版本号；
+- 一次 exec 执行 `sha256sum` 取得远程清单，只把内容不同或缺失的文件打成一个 tar 包，
+  通过同一个通道的 stdin 推送并解压，解压后在同一条命令中再次校验；
+- 每台 VM 校验通过的版本缓存在进程内，之后的运行在版本不变时完全跳过检查。
+  远程命令执行失败时调用 `invalidate` 清除缓存，下次重新检查。
+
+脚本位于远程用户的主目录（与过去 sftp.put 的位置相同）。
+
+用法:
+    script_deploy.ensure_bundle(vm_ip, user, password, 'sw')
+"""
+import hashlib
+import io
+import os
+import shlex
+import tarfile
+import threading
+from typing import Callable, Dict, List
+
+import ssh_pool
+
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script')
+
+# 每种 VM 需要的脚本（相对 SCRIPT_DIR）；清单中的文件本地缺失时 ensure_bundle 报错。
+# configure_sw_bea.sh 调用的 setup_dpdk.sh 不在本仓库中，由交换机 VM 自带
+BUNDLES = {
+    'sw': ['configure_sw_bea.sh', 'reset_sw_config.sh'],
+    'host': ['configure_host_bea.sh'],
+}
+# 远程检查 / 推送命令的超时（秒）
+DEPLOY_TIMEOUT = 60
+
+
+class _ManifestCache:
+    """本地文件哈希缓存，按 (mtime, size) 判断文件是否变化，避免每次都重新计算。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hashes = {}   # path -> (mtime, size, sha256)
+
+    def sha256(self, path: str) -> str:
+        st = os.stat(path)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._hashes[path] = (st.st_mtime, st.st_size, digest)
+        return digest
+
+
+_manifests = _ManifestCache()
+# (host, user, bundle) -> 已校验的版本号
+_verified = {}
+_verified_lock = threading.Lock()
+
+
+def build_manifest(bundle: str) -> Dict[str, str]:
+    """返回本地脚本清单 { 文件名: sha256 }；本地不存在的文件不在清单中。"""
+    manifest = {}
+    for name in BUNDLES[bundle]:
+        path = os.path.join(SCRIPT_DIR, name)
+        if os.path.isfile(path):
+            manifest[name] = _manifests.sha256(path)
+    return manifest
+
+
+def manifest_version(manifest: Dict[str, str]) -> str:
+    text = ''.join(f'{digest}  {name}\n' for name, digest in sorted(manifest.items()))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def missing_files(bundle: str) -> List[str]:
+    """BUNDLES 中声明、但本地 SCRIPT_DIR 中没有的文件。"""
+    return [name for name in BUNDLES[bundle] if not os.path.isfile(os.path.join(SCRIPT_DIR, name))]
+
+
+def parse_sha256sum(output: str) -> Dict[str, str]:
+    """解析 `sha256sum` 输出（"<hash>  <name>" 或二进制模式的 "<hash> *<name>"）。"""
+    remote = {}
+    for line in output.splitlines():
+        parts = line.strip().split(None, 1)
+        if len(parts) != 2 or len(parts[0]) != 64:
+            continue
+        remote[parts[1].lstrip('*')] = parts[0]
+    return remote
+
+
+def _sha256sum_cmd(names: List[str], strict: bool = False) -> str:
+    cmd = 'sha256sum -- ' + ' '.join(shlex.quote(n) for n in sorted(names))
+    if strict:
+        # 部署后的校验：任何文件缺失或不可读都应让命令以非 0 退出
+        return cmd
+    # 缺失的文件只会在 stderr 中报错，不影响其它文件的输出
+    return cmd + ' 2>/dev/null; true'
+
+
+def _tarball(names: List[str]) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for name in names:
+            info = tar.gettarinfo(os.path.join(SCRIPT_DIR, name), arcname=name)
+            info.mode = 0o755
+            info.uid = info.gid = 0
+            info.uname = info.gname = ''
+            with open(os.path.join(SCRIPT_DIR, name), 'rb') as f:
+                tar.addfile(info, f)
+    return buf.getvalue()
+
+
+def invalidate(host: str, user: str = None) -> None:
+    """清除某台 VM 的已校验缓存（user 为 None 时清除该主机的所有用户）。"""
+    with _verified_lock:
+        for key in [k for k in _verified if k[0] == host and (user is None or k[1] == user)]:
+            del _verified[key]
+
+
+def ensure_bundle(host: str, user: str, password: str, bundle: str, on_line: Callable[[str], None] = None,
+                  timeout: float = DEPLOY_TIMEOUT) -> dict:
+    """确保 VM 上的脚本与本地清单一致，返回 {'version', 'uploaded': [...], 'cached': bool}。"""
+    def log(line):
+        if on_line:
+            on_line(line)
+
+    missing = missing_files(bundle)
+    if missing:
+        raise RuntimeError(f"本地 {SCRIPT_DIR} 中缺少脚本 {' '.join(missing)}（bundle {bundle}）")
+    manifest = build_manifest(bundle)
+    version = manifest_version(manifest)
+    key = (host, user, bundle)
+    with _verified_lock:
+        if _verified.get(key) == version:
+            return {'version': version, 'uploaded': [], 'cached': True}
+
+    pool = ssh_pool.get_pool()
+    names = sorted(manifest)
+    _, out, _ = pool.exec(host, user, password, _sha256sum_cmd(names), timeout=timeout)
+    remote = parse_sha256sum(out)
+    changed = [name for name in names if remote.get(name) != manifest[name]]
+    if changed:
+        log(f"[deploy] 推送 {len(changed)} 个脚本到 {host}: {' '.join(changed)}")
+        # 解压与校验在同一条命令中完成
+        cmd = 'tar -xzf - && ' + _sha256sum_cmd(changed, strict=True)
+        code, out, err = pool.exec(host, user, password, cmd, timeout=timeout, stdin_data=_tarball(changed))
+        remote = parse_sha256sum(out)
+        bad = [name for name in changed if remote.get(name) != manifest[name]]
+        if code != 0 or bad:
+            raise RuntimeError(f"{host}: 脚本部署校验失败 {' '.join(bad) or ''} {err.strip()}".strip())
+    else:
+        log(f"[deploy] {host} 上的脚本已是最新版本 {version}")
+    with _verified_lock:
+        _verified[key] = version
+    return {'version': version, 'uploaded': changed, 'cached': False}
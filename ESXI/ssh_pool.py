@@ -0,0 +1,349 @@
+"""共享的 SSH 会话池（control.py / web_api.py / VM/vm_control.py 共用）。
+
+按 (host, port, user) 复用已认证的 paramiko Transport，避免每次操作都重新进行
+TCP 握手、密钥交换与密码认证：
+
+- 空闲超过 IDLE_TIMEOUT 秒的会话由后台线程关闭；
+- 每个会话开启 SSH keepalive，复用前检查 transport 是否存活，失效则重新连接；
+- 每台主机同时占用的通道数不超过 MAX_CHANNELS_PER_HOST（sshd 默认 MaxSessions=10）；
+- 每个会话缓存一个 SFTPClient，重复上传时不再重新打开 SFTP 子系统；
+- 新连接与命令的耗时按目标主机记录在 metrics 中（由 /metrics 导出）。
+
+用法:
+    pool = ssh_pool.get_pool()
+    with pool.client(ip, user, password) as client:
+        client.exec_command(...)
+    code, out, err = pool.exec(ip, user, password, 'uname -a')
+    code, out, err = pool.exec_stream(ip, user, password, './long.sh', on_line=lambda stream, line: print(line))
+"""
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+CONNECT_TIMEOUT = 10
+IDLE_TIMEOUT = 300
+KEEPALIVE_INTERVAL = 30
+MAX_CHANNELS_PER_HOST = 8
+# 后台清理线程的检查间隔（秒）
+REAP_INTERVAL = 30
+# exec_stream 每个输出流（stdout / stderr）保留的最大字节数，超出部分只逐行转发、不再保存
+STREAM_CAPTURE_LIMIT = 1024 * 1024
+# 没有换行符的输出超过该字节数时按一行转发，避免缓冲区无限增长
+STREAM_LINE_LIMIT = 64 * 1024
+STREAM_RECV_SIZE = 32 * 1024
+
+
+class _StreamReader:
+    """把通道输出切分成行并回调 on_line，同时保留前 limit 个字节作为最终结果。"""
+
+    def __init__(self, name: str, on_line=None, limit: int = STREAM_CAPTURE_LIMIT):
+        self.name = name
+        self.on_line = on_line
+        self.limit = limit
+        self._captured = []
+        self._captured_bytes = 0
+        self.dropped = 0
+        self._partial = b''
+
+    def feed(self, data: bytes) -> None:
+        if self.limit is None or self._captured_bytes < self.limit:
+            keep = data if self.limit is None else data[:self.limit - self._captured_bytes]
+            self._captured.append(keep)
+            self._captured_bytes += len(keep)
+            self.dropped += len(data) - len(keep)
+        else:
+            self.dropped += len(data)
+        if self.on_line is None:
+            return
+        buf = self._partial + data
+        lines = buf.split(b'\n')
+        self._partial = lines.pop()
+        if len(self._partial) > STREAM_LINE_LIMIT:
+            lines.append(self._partial)
+            self._partial = b''
+        for line in lines:
+            self._emit(line)
+
+    def _emit(self, line: bytes) -> None:
+        try:
+            self.on_line(self.name, line.rstrip(b'\r').decode('utf-8', errors='ignore'))
+        except Exception as e:
+            print(f"[ssh_pool] 输出回调出错: {e}")
+
+    def finish(self) -> str:
+        if self.on_line is not None and self._partial:
+            self._emit(self._partial)
+            self._partial = b''
+        text = b''.join(self._captured).decode('utf-8', errors='ignore')
+        if self.dropped:
+            text += f'\n... ({self.dropped} more bytes of {self.name} truncated)'
+        return text
+
+
+class _Session:
+    """一条已认证的 SSH 连接及其缓存的 SFTPClient。"""
+
+    def __init__(self, client):
+        self.client = client
+        self.sftp = None
+        self.sftp_lock = threading.Lock()
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+    def is_alive(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self) -> None:
+        try:
+            if self.sftp is not None:
+                self.sftp.close()
+        except Exception:
+            pass
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class SSHPool:
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT, keepalive: int = KEEPALIVE_INTERVAL,
+                 max_channels: int = MAX_CHANNELS_PER_HOST):
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.max_channels = max_channels
+        self._lock = threading.Lock()
+        self._sessions = {}     # key -> _Session
+        self._key_locks = {}    # key -> Lock，避免同一主机并发建立多条连接
+        self._slots = {}        # host -> BoundedSemaphore，限制每台主机的并发通道
+        self._reaper = None
+
+    # ----------------- 内部实现 -----------------
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _host_slots(self, host) -> threading.BoundedSemaphore:
+        with self._lock:
+            return self._slots.setdefault(host, threading.BoundedSemaphore(self.max_channels))
+
+    def _start_reaper(self) -> None:
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name='ssh-pool-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self) -> None:
+        while True:
+            time.sleep(REAP_INTERVAL)
+            self.reap()
+
+    def _connect(self, host, user, password, port, timeout):
+        import paramiko
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        start = time.perf_counter()
+        try:
+            client.connect(host, port=port, username=user, password=password, timeout=timeout,
+                           banner_timeout=timeout, auth_timeout=timeout)
+        except Exception:
+            metrics.SSH_CONNECT_ERRORS.inc(host)
+            raise
+        metrics.SSH_CONNECT.observe(time.perf_counter() - start, host)
+        transport = client.get_transport()
+        if transport is not None and self.keepalive:
+            transport.set_keepalive(self.keepalive)
+        return client
+
+    def _acquire_session(self, host, user, password, port, timeout) -> _Session:
+        key = (host, port, user)
+        with self._key_lock(key):
+            with self._lock:
+                session = self._sessions.get(key)
+            if session is not None and not session.is_alive():
+                self._drop(key, session)
+                session = None
+            if session is None:
+                session = _Session(self._connect(host, user, password, port, timeout))
+                with self._lock:
+                    self._sessions[key] = session
+                self._start_reaper()
+            with self._lock:
+                session.in_use += 1
+            return session
+
+    def _release_session(self, session: _Session) -> None:
+        with self._lock:
+            session.in_use -= 1
+            session.last_used = time.monotonic()
+
+    def _drop(self, key, session: _Session) -> None:
+        with self._lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+        session.close()
+
+    # ----------------- 公共接口 -----------------
+
+    @contextmanager
+    def client(self, host: str, user: str, password: str, port: int = 22, timeout: float = CONNECT_TIMEOUT):
+        """借出一个已连接的 paramiko.SSHClient；退出 with 时归还（不要调用 client.close()）。"""
+        slots = self._host_slots(host)
+        slots.acquire()
+        try:
+            session = self._acquire_session(host, user, password, port, timeout)
+            try:
+                yield session.client
+            finally:
+                self._release_session(session)
+        finally:
+            slots.release()
+
+    @contextmanager
+    def sftp(self, host: str, user: str, password: str, port: int = 22, timeout: float = CONNECT_TIMEOUT):
+        """借出该会话缓存的 SFTPClient（同一会话上的 SFTP 操作串行执行）。"""
+        slots = self._host_slots(host)
+        slots.acquire()
+        try:
+            session = self._acquire_session(host, user, password, port, timeout)
+            try:
+                with session.sftp_lock:
+                    if session.sftp is None or session.sftp.sock.closed:
+                        session.sftp = session.client.open_sftp()
+                    yield session.sftp
+            finally:
+                self._release_session(session)
+        finally:
+            slots.release()
+
+    def exec(self, host: str, user: str, password: str, cmd: str, timeout: float = None, port: int = 22,
+             get_pty: bool = False, stdin_data=None) -> tuple:
+        """执行一条命令并等待结束，返回 (exit_status, stdout, stderr)。
+
+        stdin_data（str 或 bytes）写入命令的标准输入后关闭输入端。
+
+        若复用的连接在打开通道时已失效，丢弃该连接并重试一次。
+        """
+        for attempt in (1, 2):
+            with self.client(host, user, password, port=port) as client:
+                # 计时不包括等待通道配额与建立连接（见 metrics.SSH_CONNECT）
+                start = time.perf_counter()
+                try:
+                    stdin, stdout, stderr = client.exec_command(cmd, timeout=timeout, get_pty=get_pty)
+                except Exception:
+                    if attempt == 2:
+                        metrics.SSH_EXEC_ERRORS.inc(host, 'exec')
+                        raise
+                    self.invalidate(host, user, port)
+                    continue
+                try:
+                    if stdin_data is not None:
+                        stdin.write(stdin_data)
+                        stdin.flush()
+                        # 发送 EOF，使从 stdin 读取的命令（例如 tar -x）能够结束
+                        stdin.channel.shutdown_write()
+                    out = stdout.read().decode('utf-8', errors='ignore')
+                    err = stderr.read().decode('utf-8', errors='ignore')
+                    return stdout.channel.recv_exit_status(), out, err
+                except Exception:
+                    metrics.SSH_EXEC_ERRORS.inc(host, 'exec')
+                    raise
+                finally:
+                    metrics.SSH_EXEC.observe(time.perf_counter() - start, host, 'exec')
+
+    def exec_stream(self, host: str, user: str, password: str, cmd: str, on_line=None, timeout: float = None,
+                    port: int = 22, max_bytes: int = STREAM_CAPTURE_LIMIT) -> tuple:
+        """执行一条命令，边执行边按行回调 on_line(stream, line)，返回 (exit_status, stdout, stderr)。
+
+        stdout / stderr 分别最多保留 max_bytes 字节（None 表示不限制），超出部分仍逐行回调。
+        timeout 为整条命令的最长执行时间（秒），超时后关闭通道并抛出 TimeoutError。
+        """
+        for attempt in (1, 2):
+            with self.client(host, user, password, port=port) as client:
+                start = time.perf_counter()
+                try:
+                    transport = client.get_transport()
+                    channel = transport.open_session()
+                    channel.exec_command(cmd)
+                except Exception:
+                    if attempt == 2:
+                        metrics.SSH_EXEC_ERRORS.inc(host, 'stream')
+                        raise
+                    self.invalidate(host, user, port)
+                    continue
+                out = _StreamReader('stdout', on_line, max_bytes)
+                err = _StreamReader('stderr', on_line, max_bytes)
+                deadline = time.monotonic() + timeout if timeout else None
+                try:
+                    while True:
+                        # 每一轮都检查超时：持续输出的命令（例如 tail -f）也必须在 timeout 后结束
+                        if deadline is not None and time.monotonic() > deadline:
+                            raise TimeoutError(f'{host}: command timed out after {timeout}s: {cmd}')
+                        got = False
+                        if channel.recv_ready():
+                            out.feed(channel.recv(STREAM_RECV_SIZE))
+                            got = True
+                        if channel.recv_stderr_ready():
+                            err.feed(channel.recv_stderr(STREAM_RECV_SIZE))
+                            got = True
+                        if got:
+                            continue
+                        if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                            break
+                        # 通道的 fileno 在 stdout 或 stderr 有数据时可读
+                        select.select([channel], [], [], 0.5)
+                    return channel.recv_exit_status(), out.finish(), err.finish()
+                except Exception:
+                    metrics.SSH_EXEC_ERRORS.inc(host, 'stream')
+                    raise
+                finally:
+                    channel.close()
+                    metrics.SSH_EXEC.observe(time.perf_counter() - start, host, 'stream')
+
+    def invalidate(self, host: str, user: str, port: int = 22) -> None:
+        """关闭并移除指定主机的会话（例如命令执行后发现连接异常）。"""
+        key = (host, port, user)
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is not None:
+            self._drop(key, session)
+
+    def reap(self) -> int:
+        """关闭空闲超时或已断开且未被借出的会话，返回关闭的数量。"""
+        now = time.monotonic()
+        victims = []
+        with self._lock:
+            for key, session in list(self._sessions.items()):
+                if session.in_use:
+                    continue
+                if now - session.last_used > self.idle_timeout or not session.is_alive():
+                    victims.append(session)
+                    del self._sessions[key]
+        for session in victims:
+            session.close()
+        return len(victims)
+
+    def close_all(self) -> None:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool() -> SSHPool:
+    """返回进程内共享的默认连接池。"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = SSHPool()
+        return _default_pool
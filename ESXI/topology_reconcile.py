@@ -0,0 +1,143 @@
+"""拓扑协调：比较提交的拓扑与当前状态，只对有变化的 VM 执行操作。
+
+“安装端口”会重建 VM 的全部网卡，“配置 sw / host”会重置每个节点的 OVS / 地址配置，即使只改了
+一条链路。这里把拓扑转换成每台 VM 的期望状态：
+
+- nics: VM 应连接的端口组（除管理网卡 ethernet-0 外），与 DB 中 nic 表的当前网卡比较；
+- sw / host: VM 内配置脚本的参数（网桥名、控制器、端口 / IPv6 地址），与 applied_vm_state 表中
+  最近一次成功应用的参数比较（esxi_db 迁移 v7）。
+
+某台 VM 的网卡需要重建时，其 sw / host 配置也需要重新执行。修改一条链路只影响链路两端的两台 VM。
+
+网卡在 DB 中与期望不一致、但上次成功应用的正是当前期望时（例如 VMware Tools 尚未上报新网卡），
+视为已应用；需要强制重新应用时使用 force。
+"""
+import hashlib
+import json
+import time
+from typing import Dict, List
+
+import esxi_db
+
+SW_CONTROLLER_PORT = '6633'
+
+
+def spec_hash(spec) -> str:
+    text = json.dumps(spec, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def node_links(nodes: list, links: list) -> Dict[str, List[str]]:
+    """nodeId -> [链路名称, ...]（链路名称即端口组名称）。"""
+    out = {n.get('id'): [] for n in nodes if n.get('id')}
+    for l in links:
+        a = l.get('a')
+        b = l.get('b')
+        label = l.get('label') or f"{a}-{b}"
+        if a in out:
+            out[a].append(label)
+        if b in out:
+            out[b].append(label)
+    return out
+
+
+def desired_state(nodes: list, links: list, controller_ip: str = None) -> Dict[str, dict]:
+    """把拓扑转换为 { vm_name: {'node', 'role', 'ports', 'specs': {kind: spec}} }。
+
+    role 为 'host' 或 'sw'；没有分配 VM 的节点忽略。同一台 VM 分配给多个节点时抛出 ValueError。
+    """
+    ports_by_node = node_links(nodes, links)
+    desired = {}
+    for n in nodes:
+        nid, vm = n.get('id'), n.get('vm')
+        if not nid or not vm:
+            continue
+        if vm in desired:
+            raise ValueError(f"vm {vm} is assigned to both {desired[vm]['node']} and {nid}")
+        ports = ports_by_node.get(nid, [])
+        role = 'host' if n.get('type') == 'host' else 'sw'
+        specs = {'nics': {'ports': sorted(ports)}}
+        if role == 'sw':
+            specs['sw'] = {'bridge': nid, 'controller': f'{controller_ip}:{SW_CONTROLLER_PORT}', 'ports': sorted(ports)}
+        elif n.get('ip'):
+            specs['host'] = {'ipv6': n.get('ip'), 'ports': sorted(ports)}
+        desired[vm] = {'node': nid, 'role': role, 'ports': ports, 'specs': specs}
+    return desired
+
+
+def load_current_ports(conn, esxi_key: str) -> Dict[str, List[str]]:
+    """从 nic 表读取区域内每台 VM 当前连接的端口组（去掉管理网卡：device_key 最小，未知时取最早的一行）。"""
+    rows = conn.execute('''
+        SELECT vm.name AS vm_name, nic.name AS nic_name, nic.device_key, nic.id AS nic_id
+        FROM vm LEFT JOIN nic ON nic.vm_id = vm.id
+        WHERE vm.esxi_key = ?
+    ''', (esxi_key,)).fetchall()
+    nics = {}
+    for r in rows:
+        entry = nics.setdefault(r['vm_name'], [])
+        if r['nic_id'] is not None:
+            key = r['device_key'] if r['device_key'] is not None else float('inf')
+            entry.append((key, r['nic_id'], r['nic_name']))
+    return {vm: [name for _, _, name in sorted(entries)[1:]] for vm, entries in nics.items()}
+
+
+def load_applied(conn, esxi_key: str) -> Dict[tuple, str]:
+    """{ (vm_name, kind): spec_hash }"""
+    rows = conn.execute('SELECT vm_name, kind, spec_hash FROM applied_vm_state WHERE esxi_key = ?', (esxi_key,))
+    return {(r['vm_name'], r['kind']): r['spec_hash'] for r in rows}
+
+
+def plan(conn, esxi_key: str, desired: Dict[str, dict], force: bool = False) -> List[dict]:
+    """为每台 VM 计算需要执行的操作，按拓扑中的顺序返回:
+
+    [{'vm', 'node', 'role', 'ports', 'current_ports', 'nics': bool, 'configure': bool, 'reasons': [...], 'specs'}]
+    """
+    current = load_current_ports(conn, esxi_key)
+    applied = load_applied(conn, esxi_key)
+    out = []
+    for vm, d in desired.items():
+        reasons = []
+        nic_spec = d['specs']['nics']
+        current_ports = current.get(vm)
+        nics = False
+        if force:
+            nics = True
+            reasons.append('forced')
+        elif current_ports is None:
+            nics = True
+            reasons.append('vm not found in inventory')
+        elif sorted(current_ports) != nic_spec['ports'] and applied.get((vm, 'nics')) != spec_hash(nic_spec):
+            nics = True
+            reasons.append(f"ports {sorted(current_ports)} -> {nic_spec['ports']}")
+
+        cfg_spec = d['specs'].get(d['role'])
+        configure = False
+        if cfg_spec is not None:
+            if nics:
+                configure = True
+                reasons.append('reconfigure after NIC change')
+            elif applied.get((vm, d['role'])) != spec_hash(cfg_spec):
+                configure = True
+                reasons.append(f"{d['role']} configuration differs from last applied")
+        out.append({
+            'vm': vm, 'node': d['node'], 'role': d['role'], 'ports': d['ports'],
+            'current_ports': current_ports, 'nics': nics, 'configure': configure,
+            'reasons': reasons, 'specs': d['specs'],
+        })
+    return out
+
+
+def record_applied(esxi_key: str, vm_name: str, kind: str, spec, job_id: str = None, db_path: str = None) -> None:
+    """记录某台 VM 的一项期望状态已成功应用。"""
+    conn = esxi_db.get_conn(db_path)
+    try:
+        conn.execute('''
+            INSERT INTO applied_vm_state (esxi_key, vm_name, kind, spec_hash, spec, job_id, applied_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(esxi_key, vm_name, kind) DO UPDATE SET
+                spec_hash = excluded.spec_hash, spec = excluded.spec,
+                job_id = excluded.job_id, applied_at = excluded.applied_at
+        ''', (esxi_key, vm_name, kind, spec_hash(spec), json.dumps(spec, ensure_ascii=False), job_id, time.time()))
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,14 @@
+# vCenter configuration used by control.initialize_db_from_config.
+# When enabled, all regions in ESXI_IP are collected through one vCenter session
+# instead of logging in to each ESXi host. Regions that vCenter does not manage
+# (or all regions, if vCenter is unreachable) fall back to per-host collection.
+VCENTER = {
+    'enabled': False,
+    # vCenter Server Appliance running on s09; fill in its address before enabling
+    'host': '',
+    'user': 'administrator@vsphere.local',
+    'password': '',
+    # Optional esxi_key -> HostSystem name in vCenter. Hosts not listed here are matched
+    # by their name or management (vmk) IP against ESXI_IP.
+    'hosts': {},
+}
@@ -0,0 +1,118 @@
+"""用 HostNetworkSystem 批量创建链路 vSwitch 与端口组（替代 script/Creat_Port_VSitch.sh）。
+
+与脚本相同：每个链路名称对应一个同名的标准 vSwitch 和其上的同名端口组，vSwitch 的安全策略
+（混杂模式、MAC 地址更改、伪传输）全部为 Accept，端口组继承 vSwitch 策略。
+
+脚本对每个链路都执行一次 `vswitch standard list | grep` 与 `portgroup list | grep`（链路越多越慢，
+且 grep 是子串匹配）。这里：
+
+- 一次读取 networkInfo.vswitch / networkInfo.portgroup，按名称精确比较；
+- 只为缺少的 vSwitch、端口组以及安全策略不符的 vSwitch 生成变更；
+- 所有变更合并为一次 UpdateNetworkConfig(changeMode='modify') 调用，安全策略在创建时一并设置。
+
+用法:
+    summary = vswitch_provision.provision_region('s05', ['h1-sw1', 'sw1-sw2'])
+"""
+from typing import Callable, Dict, List
+
+from pyVmomi import vim
+
+from esxi_config import ESXI_IP
+import control
+
+# 新建 vSwitch 的端口数（与 esxcli network vswitch standard add 的默认值一致）
+VSWITCH_NUM_PORTS = 128
+
+
+def _security_policy():
+    return vim.host.NetworkPolicy.SecurityPolicy(allowPromiscuous=True, macChanges=True, forgedTransmits=True)
+
+
+def _security_ok(vswitch) -> bool:
+    security = vswitch.spec.policy.security if vswitch.spec and vswitch.spec.policy else None
+    return bool(security and security.allowPromiscuous and security.macChanges and security.forgedTransmits)
+
+
+def plan_network_changes(names: List[str], vswitches: list, portgroups: list) -> tuple:
+    """根据当前的 vSwitch / 端口组计算需要的变更。
+
+    返回 (vim.host.NetworkConfig 或 None（无需变更）, 摘要字典)。
+    """
+    existing_vswitches = {vs.name: vs for vs in vswitches or []}
+    existing_portgroups = {pg.spec.name for pg in portgroups or []}
+    vswitch_configs, portgroup_configs = [], []
+    summary = {'created_vswitches': [], 'updated_policies': [], 'created_portgroups': [], 'unchanged': []}
+
+    for name in dict.fromkeys(names):
+        changed = False
+        vswitch = existing_vswitches.get(name)
+        if vswitch is None:
+            spec = vim.host.VirtualSwitch.Specification(
+                numPorts=VSWITCH_NUM_PORTS, policy=vim.host.NetworkPolicy(security=_security_policy()))
+            vswitch_configs.append(vim.host.VirtualSwitch.Config(changeOperation='add', name=name, spec=spec))
+            summary['created_vswitches'].append(name)
+            changed = True
+        elif not _security_ok(vswitch):
+            spec = vswitch.spec
+            if spec.policy is None:
+                spec.policy = vim.host.NetworkPolicy()
+            spec.policy.security = _security_policy()
+            vswitch_configs.append(vim.host.VirtualSwitch.Config(changeOperation='edit', name=name, spec=spec))
+            summary['updated_policies'].append(name)
+            changed = True
+        if name not in existing_portgroups:
+            # 空的 NetworkPolicy 表示全部继承 vSwitch 策略
+            spec = vim.host.PortGroup.Specification(name=name, vlanId=0, vswitchName=name,
+                                                    policy=vim.host.NetworkPolicy())
+            portgroup_configs.append(vim.host.PortGroup.Config(changeOperation='add', spec=spec))
+            summary['created_portgroups'].append(name)
+            changed = True
+        if not changed:
+            summary['unchanged'].append(name)
+
+    if not vswitch_configs and not portgroup_configs:
+        return None, summary
+    return vim.host.NetworkConfig(vswitch=vswitch_configs, portgroup=portgroup_configs), summary
+
+
+def provision_links(content, names: List[str], on_line: Callable[[str], None] = None) -> Dict[str, list]:
+    """在当前会话的宿主机上创建 names 对应的 vSwitch 与端口组，返回摘要。"""
+    def log(line):
+        if on_line:
+            on_line(line)
+
+    hosts = control._retrieve_properties(content, vim.HostSystem, ['name', 'configManager.networkSystem'])
+    if not hosts:
+        raise RuntimeError('未找到宿主机')
+    host = hosts[0]
+    network_system = host['configManager.networkSystem']
+    info = control._retrieve_object_properties(content, network_system,
+                                               ['networkInfo.vswitch', 'networkInfo.portgroup'])
+    config, summary = plan_network_changes(names, info.get('networkInfo.vswitch'), info.get('networkInfo.portgroup'))
+    for name in summary['created_vswitches']:
+        log(f"==> 创建 vSwitch {name}（安全策略 Accept）")
+    for name in summary['updated_policies']:
+        log(f"==> 设置 vSwitch {name} 的安全策略为 Accept")
+    for name in summary['created_portgroups']:
+        log(f"==> 创建端口组 {name}")
+    for name in summary['unchanged']:
+        log(f"==> vSwitch 和端口组 {name} 已存在")
+    if config is None:
+        log('无需修改')
+        return summary
+
+    network_system.UpdateNetworkConfig(config=config, changeMode='modify')
+    log(f"✅ {host.get('name')}: 已提交 {len(config.vswitch or [])} 项 vSwitch 与 {len(config.portgroup or [])} 项端口组变更")
+    return summary
+
+
+def provision_region(esxi_key: str, names: List[str], on_line: Callable[[str], None] = None) -> Dict[str, list]:
+    """连接区域的 ESXi 并创建链路 vSwitch 与端口组。"""
+    esxi_host = ESXI_IP.get(esxi_key)
+    if not esxi_host:
+        raise ValueError(f"未知区域 '{esxi_key}'")
+    service_instance = control._connect_esxi(esxi_host, control.ESXI_USER, control.ESXI_PASS)
+    try:
+        return provision_links(service_instance.RetrieveContent(), names, on_line)
+    finally:
+        control._disconnect_esxi(service_instance)
@@ -1,32 +1,36 @@
-from flask import Flask, jsonify, send_from_directory, request
+"""HTTP API for the inventory / topology UI.
+
+Routes live on the `api` blueprint; `create_app()` builds the Flask app (API, web_ui assets with
+content-hash caching, response compression, Prometheus metrics at /metrics and admin-only request
+profiling, see profiling.py). Production: `gunicorn -c gunicorn.conf.py wsgi:app` (see wsgi.py);
+`python web_api.py` starts the development server.
+
+paramiko / pyVmomi are imported only by the routes that need them, so startup stays light.
+"""
+from flask import Blueprint, Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import os
-import sqlite3
 import json
-import traceback
 
-try:
-    import paramiko
-except Exception:
-    paramiko = None
+import esxi_db
+import jobs
+import metrics
+import response_cache
+import script_deploy
+import ssh_pool
+import topology_reconcile
 
-app = Flask(__name__, static_folder='../web_ui', static_url_path='')
-CORS(app)
+api = Blueprint('api', __name__)
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'esxi_data.db')
+DB_PATH = esxi_db.DB_FILENAME
 
 
 def _get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    try:
-        conn.execute('PRAGMA foreign_keys = ON')
-    except Exception:
-        pass
-    return conn
+    return esxi_db.get_conn(DB_PATH)
 
 
-@app.route('/api/servers')
+@api.route('/api/servers')
+@response_cache.cached(_get_conn)
 def api_servers():
     # Return configured ESXI_IP from esxi_config.py plus whether in DB
     try:
@@ -54,7 +58,8 @@ def api_servers():
     return jsonify(out)
 
 
-@app.route('/api/regions')
+@api.route('/api/regions')
+@response_cache.cached(_get_conn)
 def api_regions():
     conn = _get_conn()
     cur = conn.cursor()
@@ -64,165 +69,640 @@ def api_regions():
     return jsonify(rows)
 
 
-@app.route('/api/inventory/<esxi_key>')
-def api_inventory(esxi_key):
-    conn = _get_conn()
+# Fields accepted by /api/inventory ?fields=; 'nics' alone selects every nic field
+VM_FIELDS = ('id', 'name', 'nics')
+NIC_FIELDS = ('id', 'name', 'mac', 'ips', 'inner_name')
+
+
+def _parse_fields(raw):
+    """Parse ?fields=name,nics.ips into (vm_fields, nic_fields); an empty value selects everything."""
+    if not raw:
+        return set(VM_FIELDS), set(NIC_FIELDS)
+    vm_fields, nic_fields = set(), set()
+    for item in raw.split(','):
+        item = item.strip()
+        if item.startswith('nics.'):
+            if item[5:] not in NIC_FIELDS:
+                raise ValueError(f'unknown field {item}')
+            vm_fields.add('nics')
+            nic_fields.add(item[5:])
+        elif item == 'nics':
+            vm_fields.add('nics')
+            nic_fields.update(NIC_FIELDS)
+        elif item in VM_FIELDS:
+            vm_fields.add(item)
+        elif item:
+            raise ValueError(f'unknown field {item}')
+    return vm_fields, nic_fields
+
+
+def _like_contains(text):
+    """LIKE pattern matching text anywhere, with %, _ and the escape character taken literally."""
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _query_inventory(conn, esxi_key, name=None, ip=None, limit=None, offset=0, fields=None):
+    """Build the inventory payload with at most four set-based queries.
+
+    All queries share one CTE selecting the requested page of VMs, so the cost does not
+    grow with the number of VMs / NICs: page count, VMs, NICs (+ first inner_nic name), IPs.
+    Returns (vms, total); total is only computed when a limit is given.
+    """
+    vm_fields, nic_fields = fields or (set(VM_FIELDS), set(NIC_FIELDS))
+    where = ['esxi_key = ?']
+    params = [esxi_key]
+    if name:
+        where.append("name LIKE ? ESCAPE '\\'")
+        params.append(_like_contains(name))
+    if ip:
+        where.append("id IN (SELECT n.vm_id FROM nic n JOIN nic_ip i ON i.nic_id = n.id WHERE i.ip LIKE ? ESCAPE '\\')")
+        params.append(_like_contains(ip))
+    filtered = f"SELECT id, name FROM vm WHERE {' AND '.join(where)}"
+    page_cte = f"WITH page AS ({filtered} ORDER BY name LIMIT ? OFFSET ?) "
+    page_params = params + [limit if limit is not None else -1, offset or 0]
+
     cur = conn.cursor()
-    cur.execute("SELECT id, name FROM vm WHERE esxi_key = ? ORDER BY name", (esxi_key,))
+    total = None
+    if limit is not None:
+        cur.execute(f"SELECT COUNT(*) FROM ({filtered})", params)
+        total = cur.fetchone()[0]
+
+    cur.execute(page_cte + "SELECT id, name FROM page ORDER BY name", page_params)
     vms = []
-    for vm in cur.fetchall():
-        vm_id = vm['id']
-        vm_name = vm['name']
-        cur.execute("SELECT id, name, mac FROM nic WHERE vm_id = ? ORDER BY name", (vm_id,))
-        nics = []
-        for nic in cur.fetchall():
-            nic_id = nic['id']
-            nic_name = nic['name']
-            mac = nic['mac']
-            cur.execute("SELECT ip FROM nic_ip WHERE nic_id = ? ORDER BY ip", (nic_id,))
-            ips = [r['ip'] for r in cur.fetchall()]
-            cur.execute("SELECT inner_name FROM inner_nic WHERE nic_id = ? LIMIT 1", (nic_id,))
-            row = cur.fetchone()
-            inner_name = row['inner_name'] if row else None
-            nics.append({'id': nic_id, 'name': nic_name, 'mac': mac, 'ips': ips, 'inner_name': inner_name})
-        vms.append({'id': vm_id, 'name': vm_name, 'nics': nics})
-    conn.close()
-    return jsonify({'esxi_key': esxi_key, 'vms': vms})
+    by_id = {}
+    for row in cur.fetchall():
+        vm = {k: row[k] for k in ('id', 'name') if k in vm_fields}
+        if 'nics' in vm_fields:
+            vm['nics'] = []
+        vms.append(vm)
+        by_id[row['id']] = vm
+    if 'nics' not in vm_fields or not vms:
+        return vms, total
+
+    inner_col = ''
+    if 'inner_name' in nic_fields:
+        inner_col = (", (SELECT inner_name FROM inner_nic WHERE nic_id = n.id ORDER BY id LIMIT 1)"
+                     " AS inner_name")
+    cur.execute(page_cte + f"SELECT n.id, n.vm_id, n.name, n.mac{inner_col} FROM nic n "
+                "WHERE n.vm_id IN (SELECT id FROM page) ORDER BY n.vm_id, n.name", page_params)
+    nics = {}
+    for row in cur.fetchall():
+        nic = {k: row[k] for k in ('id', 'name', 'mac', 'inner_name') if k in nic_fields}
+        if 'ips' in nic_fields:
+            nic['ips'] = []
+        by_id[row['vm_id']]['nics'].append(nic)
+        nics[row['id']] = nic
+
+    if 'ips' in nic_fields and nics:
+        cur.execute(page_cte + "SELECT i.nic_id, i.ip FROM nic_ip i JOIN nic n ON n.id = i.nic_id "
+                    "WHERE n.vm_id IN (SELECT id FROM page) ORDER BY i.nic_id, i.ip", page_params)
+        for row in cur.fetchall():
+            nics[row['nic_id']]['ips'].append(row['ip'])
+    return vms, total
+
+
+@api.route('/api/inventory/<esxi_key>')
+@response_cache.cached(_get_conn, scope='esxi_key')
+def api_inventory(esxi_key):
+    """Inventory of one region.
+
+    Optional query params:
+      limit / offset  page through VMs (ordered by name); adds 'total' to the response
+      name            case-insensitive substring match on the VM name
+      ip              substring match on any IP of the VM
+      fields          e.g. 'name,nics.ips' to return only those keys (default: all)
+    """
+    try:
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', default=0, type=int)
+        fields = _parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    if (limit is not None and limit < 0) or offset < 0:
+        return jsonify({'ok': False, 'error': 'limit/offset must be non-negative'}), 400
 
+    conn = _get_conn()
+    try:
+        vms, total = _query_inventory(conn, esxi_key, request.args.get('name'), request.args.get('ip'),
+                                      limit, offset, fields)
+    finally:
+        conn.close()
+    out = {'esxi_key': esxi_key, 'vms': vms}
+    if total is not None:
+        out.update(total=total, limit=limit, offset=offset)
+    return jsonify(out)
 
-# Serve the SPA
-@app.route('/')
-def index():
-    return send_from_directory(app.static_folder, 'index.html')
 
+@api.route('/api/metrics/<esxi_key>/<vm_name>')
+def api_metrics(esxi_key, vm_name):
+    """Recent PerfManager samples for one VM (use '@host' for the ESXi host itself).
 
-@app.route('/api/topology/create_ports', methods=['POST'])
-def api_create_ports():
-    """POST payload: { region: 's05', links: ['h1-sw1','sw1-sw2', ...] }
-    This will SSH to the ESXi host IP configured for the region (esxi_config.ESXI_IP)
-    using root/410@Bupt and execute the script `Creat_Port_VSitch.sh` with the link names
-    as arguments. Returns stdout/stderr.
+    Query params: window (seconds, default 600), counter (repeatable, default all).
+    Returns { counter: { instance: [[ts, value], ...] } } as collected by perf_metrics.py.
     """
-    data = request.get_json(force=True)
+    import perf_metrics
+    try:
+        window = int(request.args.get('window', 600))
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'invalid window'}), 400
+    counters = request.args.getlist('counter') or None
+    conn = _get_conn()
+    try:
+        series = perf_metrics.query_recent_metrics(esxi_key, vm_name, counters, window, conn=conn)
+    finally:
+        conn.close()
+    return jsonify({'esxi_key': esxi_key, 'vm': vm_name, 'window': window, 'metrics': series})
+
+
+# configure_sw / configure_host: VMs configured concurrently, and the default per-VM time limit in seconds
+# (override per request with "parallel" / "timeout" in the payload)
+CONFIGURE_PARALLEL = 16
+CONFIGURE_STEP_TIMEOUT = 900
+
+
+class _PlanError(Exception):
+    """Invalid topology request; carries the HTTP status for the error response."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _quote_args(args):
+    return ' '.join([f"'{str(x)}'" for x in args])
+
+
+def _node_links(nodes, links):
+    """nodeId -> [link label, ...] for every node in the payload."""
+    return topology_reconcile.node_links(nodes, links)
+
+
+def _controller_ip():
+    # controller IP read from controller_config.CONTROLLER.host
+    try:
+        from controller_config import CONTROLLER
+    except Exception:
+        raise _PlanError('controller configuration missing', 500)
+    controller_ip = CONTROLLER.get('host')
+    if not controller_ip:
+        raise _PlanError('controller host not configured', 500)
+    return controller_ip
+
+
+def _sw_port_args(region, vm, ports):
+    """[exter1, iner1, exter2, iner2, ...] for the VM's ports, from the nic / inner_nic tables."""
+    pairs = _get_vm_nic_external_internal_pairs(region, vm)
+    args = []
+    for p in ports:
+        for pr in pairs:
+            if pr.get('exter') == p and pr.get('iner'):
+                args.extend([pr.get('exter'), pr.get('iner')])
+                break
+    return args
+
+
+def _vm_ssh_credentials():
+    # SSH credentials for VM access: prefer explicit VM_SSH config, fall back to controller config (legacy)
+    try:
+        from vm_ssh_config import VM_SSH
+        return VM_SSH.get('user'), VM_SSH.get('password')
+    except Exception:
+        try:
+            from controller_config import CONTROLLER
+            return CONTROLLER.get('user'), CONTROLLER.get('password')
+        except Exception:
+            raise _PlanError('vm ssh configuration missing', 500)
+
+
+def _require_paramiko():
+    try:
+        import paramiko  # noqa: F401
+    except Exception:
+        raise _PlanError('paramiko not available on server; cannot SSH', 500)
+
+
+def _fan_out_options(data):
+    """(parallel, per-VM timeout) for the batch configure endpoints."""
+    try:
+        parallel = int(data.get('parallel') or CONFIGURE_PARALLEL)
+        timeout = float(data.get('timeout') or CONFIGURE_STEP_TIMEOUT)
+    except (TypeError, ValueError):
+        raise _PlanError('parallel and timeout must be numbers')
+    return max(1, parallel), max(1.0, timeout)
+
+
+def _skip_step(name, message):
+    return jobs.Step(name, lambda ctx: {'cmd': f'{name} (skip)', 'stdout': '', 'stderr': message})
+
+
+def _exec_streamed(ctx, host, user, password, cmd):
+    """Run cmd over the pooled session, forwarding each output line to the job's event stream."""
+    _, out, err = ssh_pool.get_pool().exec_stream(host, user, password, cmd, on_line=ctx.emit_line, timeout=ctx.timeout)
+    return out, err
+
+
+def _deploy_and_run(ctx, vm_ip, user, password, bundle, cmd):
+    """Bring the VM's copy of the script bundle up to date (see script_deploy), then run cmd.
+
+    A failed run drops the VM's verified-bundle cache so the next run checks the scripts again.
+    """
+    try:
+        with metrics.REMOTE_PHASE.time(bundle, 'deploy'):
+            script_deploy.ensure_bundle(vm_ip, user, password, bundle,
+                                        on_line=lambda line: ctx.emit_line('stdout', line))
+        with metrics.REMOTE_PHASE.time(bundle, 'run'):
+            return _exec_streamed(ctx, vm_ip, user, password, cmd)
+    except Exception:
+        script_deploy.invalidate(vm_ip, user)
+        raise
+
+
+def _plan_create_ports(data):
     region = data.get('region')
     links = data.get('links') or []
-
     if not region:
-        return jsonify({'ok': False, 'error': 'missing region'}), 400
+        raise _PlanError('missing region')
 
     try:
         from esxi_config import ESXI_IP
     except Exception:
         ESXI_IP = {}
-
     ip = ESXI_IP.get(region)
     if not ip:
-        return jsonify({'ok': False, 'error': f'no ESXi IP configured for region {region}'}), 400
+        raise _PlanError(f'no ESXi IP configured for region {region}')
 
-    if paramiko is None:
-        return jsonify({'ok': False, 'error': 'paramiko not available on server; cannot SSH'}), 500
+    # the script stays the default for existing API clients; "engine": "native" opts in to HostNetworkSystem
+    engine = data.get('engine') or 'script'
+    if engine == 'native':
+        return _plan_create_ports_native(region, links, data)
+    if engine != 'script':
+        raise _PlanError(f"unknown engine '{engine}' (expected 'native' or 'script')")
+    _require_paramiko()
 
     username = 'root'
     password = '410@Bupt'
-
     cmd = './Creat_Port_VSitch.sh '
     if links:
         # join arguments safely (they should be simple labels)
-        cmd += ' '.join([f"'{l}'" for l in links])
+        cmd += _quote_args(links)
+
+    def run(ctx):
+        # run the command in the user's home directory over a pooled session
+        out, err = _exec_streamed(ctx, ip, username, password, cmd)
+        return {'cmd': cmd, 'stdout': out, 'stderr': err}
 
-    logs = {'stdout': '', 'stderr': ''}
+    # port groups live on the region's vSwitch, so the whole region is locked
+    return jobs.JobSpec('create_ports', region, [jobs.Step(f'{region} vSwitch', run)], payload=data)
+
+
+def _plan_create_ports_native(region, links, data):
+    """All missing vSwitches / port groups in one HostNetworkSystem.UpdateNetworkConfig call."""
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(ip, username=username, password=password, timeout=10)
-        # run the command in the user's home directory; keeppty=False is fine
-        stdin, stdout, stderr = client.exec_command(cmd)
-        out = stdout.read().decode(errors='ignore')
-        err = stderr.read().decode(errors='ignore')
-        logs['stdout'] = out
-        logs['stderr'] = err
-        client.close()
-        return jsonify({'ok': True, 'logs': logs})
+        import vswitch_provision
     except Exception as e:
-        tb = traceback.format_exc()
-        return jsonify({'ok': False, 'error': str(e), 'trace': tb, 'logs': logs}), 500
+        raise _PlanError(f'native vSwitch provisioner unavailable: {e}', 500)
+    names = [str(l) for l in links]
+    cmd = 'UpdateNetworkConfig ' + ' '.join(names)
 
+    def run(ctx):
+        lines = []
 
-@app.route('/api/topology/install_ports', methods=['POST'])
-def api_install_ports():
-    """POST payload:
-    {
-      region: 's05',
-      nodes: [ {id:'h1', vm:'s05-switchpc2', ip:'10.1.2.3', ...}, ... ],
-      links: [ {id:'l1', a:'h1', b:'sw1', label:'h1-sw1'}, ... ]
-    }
-    The endpoint will compute per-VM required ports and SSH to the controller to run
-    rebuild_vm_nics_govc.sh commands. Returns logs per command.
-    """
-    data = request.get_json(force=True)
+        def on_line(line):
+            lines.append(line)
+            ctx.emit_line('stdout', line)
+        vswitch_provision.provision_region(region, names, on_line=on_line)
+        return {'cmd': cmd, 'stdout': '\n'.join(lines), 'stderr': ''}
+
+    return jobs.JobSpec('create_ports', region, [jobs.Step(f'{region} vSwitch', run)], payload=data)
+
+
+def _plan_install_ports(data):
     region = data.get('region')
     nodes = data.get('nodes') or []
     links = data.get('links') or []
-
     if not region:
-        return jsonify({'ok': False, 'error': 'missing region'}), 400
-
-    # build nodeId -> vmName map
-    node_to_vm = { n.get('id'): n.get('vm') for n in nodes if n.get('id') }
-
-    # build adjacency list to list link labels per node
-    node_links = { n.get('id'): [] for n in nodes if n.get('id') }
-    for l in links:
-        a = l.get('a'); b = l.get('b'); label = l.get('label') or f"{a}-{b}"
-        if a in node_links: node_links[a].append(label)
-        if b in node_links: node_links[b].append(label)
+        raise _PlanError('missing region')
 
     # build vm -> ports mapping
+    node_to_vm = { n.get('id'): n.get('vm') for n in nodes if n.get('id') }
+    node_links = _node_links(nodes, links)
     vm_ports = {}
     for nid, vm in node_to_vm.items():
         if not vm: continue
-        ports = node_links.get(nid, [])
-        vm_ports.setdefault(vm, []).extend(ports)
+        vm_ports.setdefault(vm, []).extend(node_links.get(nid, []))
+
+    # govc stays the default for existing API clients; "engine": "native" opts in to ReconfigVM_Task
+    engine = data.get('engine') or 'govc'
+    if engine == 'native':
+        return _plan_install_ports_native(region, vm_ports, data)
+    if engine != 'govc':
+        raise _PlanError(f"unknown engine '{engine}' (expected 'native' or 'govc')")
 
     # load controller config
     try:
         from controller_config import CONTROLLER
     except Exception:
-        return jsonify({'ok': False, 'error': 'controller configuration missing'}), 500
-
+        raise _PlanError('controller configuration missing', 500)
     host = CONTROLLER.get('host')
     user = CONTROLLER.get('user')
     password = CONTROLLER.get('password')
     if not host or not user:
-        return jsonify({'ok': False, 'error': 'incomplete controller configuration'}), 500
-
-    if paramiko is None:
-        return jsonify({'ok': False, 'error': 'paramiko not available on server; cannot SSH'}), 500
+        raise _PlanError('incomplete controller configuration', 500)
+    _require_paramiko()
 
-    commands = []
+    steps = []
     for vm, ports in vm_ports.items():
         if not ports: continue
         # build command: sudo ./rebuild_vm_nics_govc.sh <region> <vm> <port1> <port2> ...
-        cmd = ['./rebuild_vm_nics_govc.sh', region, vm] + ports
-        commands.append(cmd)
+        cmd_args = ['./rebuild_vm_nics_govc.sh', region, vm] + ports
 
-    results = []
+        def run(ctx, cmd_args=cmd_args):
+            out, err = _exec_streamed(ctx, host, user, password, 'sudo ' + _quote_args(cmd_args))
+            return {'cmd': 'sudo ' + ' '.join(cmd_args), 'stdout': out, 'stderr': err}
+        steps.append(jobs.Step(vm, run))
+    return jobs.JobSpec('install_ports', region, steps, locks=[(region, vm) for vm in vm_ports], payload=data)
+
+
+def _plan_install_ports_native(region, vm_ports, data):
+    """One ReconfigVM_Task per VM, all submitted together in one ESXi session (see nic_reconfig).
+
+    Each VM is still its own job step, so results and live output stay per VM; the first step to run
+    performs the whole region's batch and the others pick up their VM's outcome.
+    """
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(host, username=user, password=password, timeout=10)
-        for cmd_args in commands:
-            # join safely - we will run in a shell; join with quoted args
-            safe_cmd = ' '.join([f"'{str(x)}'" for x in cmd_args])
-            stdin, stdout, stderr = client.exec_command('sudo ' + safe_cmd)
-            out = stdout.read().decode(errors='ignore')
-            err = stderr.read().decode(errors='ignore')
-            results.append({'cmd': 'sudo ' + ' '.join(cmd_args), 'stdout': out, 'stderr': err})
-        client.close()
-        return jsonify({'ok': True, 'results': results})
+        import nic_reconfig
     except Exception as e:
-        tb = traceback.format_exc()
-        return jsonify({'ok': False, 'error': str(e), 'trace': tb, 'results': results}), 500
+        raise _PlanError(f'native NIC engine unavailable: {e}', 500)
+    adapter = data.get('adapter') or nic_reconfig.DEFAULT_ADAPTER
+    if adapter not in nic_reconfig.ADAPTER_TYPES:
+        raise _PlanError(f"unknown adapter '{adapter}'")
+    vm_ports = { vm: ports for vm, ports in vm_ports.items() if ports }
+    batch = nic_reconfig.RegionBatch(region, vm_ports, adapter)
+
+    steps = []
+    for vm, ports in vm_ports.items():
+        cmd = f'ReconfigVM_Task {vm} ' + ' '.join(ports)
+
+        def run(ctx, vm=vm, cmd=cmd):
+            res = batch.result(vm, on_line=lambda line: ctx.emit_line('stdout', line))
+            if not res['ok']:
+                raise RuntimeError(res['error'])
+            return {'cmd': cmd, 'stdout': '\n'.join(res['log']), 'stderr': ''}
+        steps.append(jobs.Step(vm, run))
+    return jobs.JobSpec('install_ports', region, steps, locks=[(region, vm) for vm in vm_ports], payload=data,
+                        parallel=len(steps))
+
+
+def _plan_configure_sw(data):
+    region = data.get('region')
+    nodes = data.get('nodes') or []
+    links = data.get('links') or []
+    if not region:
+        raise _PlanError('missing region')
+
+    node_to_vm = { n.get('id'): n.get('vm') for n in nodes if n.get('id') }
+    node_type = { n.get('id'): n.get('type') for n in nodes if n.get('id') }
+    node_links = _node_links(nodes, links)
+    parallel, step_timeout = _fan_out_options(data)
+    controller_ip = _controller_ip()
+    ssh_user, ssh_pass = _vm_ssh_credentials()
+    _require_paramiko()
+
+    steps = []
+    vms = []
+    for nid, vm in node_to_vm.items():
+        # consider only switch nodes (type != 'host')
+        if not vm or node_type.get(nid) == 'host':
+            continue
+        vms.append(vm)
+        ports = node_links.get(nid, [])
+        # build args: for each port label, the external nic with that name and its inner interface
+        args = _sw_port_args(region, vm, ports)
+        if not args:
+            steps.append(_skip_step(vm, f'no external->internal pair found for node {nid} ports {ports}'))
+            continue
+        vm_ip = _get_vm_primary_ip(region, vm)
+        if not vm_ip:
+            steps.append(_skip_step(vm, f'no reachable IP found for vm {vm}'))
+            continue
+
+        cmd_args = ['./configure_sw_bea.sh', nid, controller_ip, '6633'] + args
+
+        def run(ctx, vm_ip=vm_ip, cmd_args=cmd_args):
+            out, err = _deploy_and_run(ctx, vm_ip, ssh_user, ssh_pass, 'sw',
+                                       'sudo ./configure_sw_bea.sh ' + _quote_args(cmd_args[1:]))
+            return {'cmd': ' '.join(cmd_args), 'stdout': out, 'stderr': err}
+        steps.append(jobs.Step(vm, run, timeout=step_timeout))
+    # one step per switch VM, run concurrently; results stay in node order
+    return jobs.JobSpec('configure_sw', region, steps, locks=[(region, vm) for vm in vms], payload=data,
+                        parallel=parallel)
+
+
+def _plan_configure_host(data):
+    region = data.get('region')
+    nodes = data.get('nodes') or []
+    if not region:
+        raise _PlanError('missing region')
+
+    node_to_vm = { n.get('id'): n.get('vm') for n in nodes if n.get('id') }
+    node_ip_arg = { n.get('id'): n.get('ip') for n in nodes if n.get('id') }
+    node_type = { n.get('id'): n.get('type') for n in nodes if n.get('id') }
+    parallel, step_timeout = _fan_out_options(data)
+    ssh_user, ssh_pass = _vm_ssh_credentials()
+    _require_paramiko()
+
+    steps = []
+    vms = []
+    for nid, vm in node_to_vm.items():
+        if not vm or node_type.get(nid) != 'host':
+            continue
+        vms.append(vm)
+        ipv6 = node_ip_arg.get(nid) or ''
+        if not ipv6:
+            steps.append(_skip_step(vm, f'no ipv6 argument provided for host {nid}'))
+            continue
+        vm_ip = _get_vm_primary_ip(region, vm)
+        if not vm_ip:
+            steps.append(_skip_step(vm, f'no reachable IP found for vm {vm}'))
+            continue
+
+        def run(ctx, vm_ip=vm_ip, ipv6=ipv6):
+            out, err = _deploy_and_run(ctx, vm_ip, ssh_user, ssh_pass, 'host', './configure_host_bea.sh ' + f"'{ipv6}'")
+            return {'cmd': './configure_host_bea.sh ' + ipv6, 'stdout': out, 'stderr': err}
+        steps.append(jobs.Step(vm, run, timeout=step_timeout))
+    return jobs.JobSpec('configure_host', region, steps, locks=[(region, vm) for vm in vms], payload=data,
+                        parallel=parallel)
+
+
+def _reconcile_plan(data):
+    """(region, controller_ip, per-VM plan) for the plan / apply endpoints."""
+    region = data.get('region')
+    if not region:
+        raise _PlanError('missing region')
+    nodes = data.get('nodes') or []
+    has_sw = any(n.get('vm') and n.get('type') != 'host' for n in nodes)
+    controller_ip = _controller_ip() if has_sw else None
+    try:
+        desired = topology_reconcile.desired_state(nodes, data.get('links') or [], controller_ip)
+    except ValueError as e:
+        raise _PlanError(str(e))
+    conn = _get_conn()
+    try:
+        items = topology_reconcile.plan(conn, region, desired, force=bool(data.get('force')))
+    finally:
+        conn.close()
+    return region, controller_ip, items
+
+
+def _plan_apply(data):
+    """Job for /api/topology/apply: only the VMs whose plan has work, in three stages:
+
+    0. NIC rebuild for VMs whose ports changed (one ReconfigVM_Task each, see nic_reconfig);
+    1. if any NICs changed, refresh the region inventory and inner interface names;
+    2. configure_sw / configure_host for VMs whose configuration (or NICs) changed.
+    Each successful step records the applied state, so the next plan skips it.
+    """
+    region, controller_ip, items = _reconcile_plan(data)
+    parallel, step_timeout = _fan_out_options(data)
+    nic_items = [it for it in items if it['nics']]
+    cfg_items = [it for it in items if it['configure']]
+    if cfg_items:
+        ssh_user, ssh_pass = _vm_ssh_credentials()
+        _require_paramiko()
+    steps = []
+
+    if nic_items:
+        try:
+            import nic_reconfig
+            import control
+        except Exception as e:
+            raise _PlanError(f'native NIC engine unavailable: {e}', 500)
+        batch = nic_reconfig.RegionBatch(region, { it['vm']: it['ports'] for it in nic_items })
+        for it in nic_items:
+            def run_nics(ctx, it=it):
+                res = batch.result(it['vm'], on_line=lambda line: ctx.emit_line('stdout', line))
+                if not res['ok']:
+                    raise RuntimeError(res['error'])
+                topology_reconcile.record_applied(region, it['vm'], 'nics', it['specs']['nics'], ctx.job_id, DB_PATH)
+                return {'cmd': f"ReconfigVM_Task {it['vm']} " + ' '.join(it['ports']), 'stdout': '\n'.join(res['log']), 'stderr': ''}
+            steps.append(jobs.Step(f"{it['vm']} nics", run_nics, timeout=step_timeout, stage=0))
+
+        def run_refresh(ctx):
+            from esxi_config import ESXI_IP
+            control.refresh_esxi_region(ESXI_IP.get(region), control.ESXI_USER, control.ESXI_PASS, region)
+            user, password = _vm_ssh_credentials()
+            summary = control.collect_and_store_inner_ifaces_for_region(region, vm_user=user, vm_pwd=password)
+            return {'cmd': f'refresh inventory {region}', 'stdout': json.dumps(summary, ensure_ascii=False, default=str), 'stderr': ''}
+        steps.append(jobs.Step(f'{region} inventory', run_refresh, stage=1))
+
+    for it in cfg_items:
+        vm, role = it['vm'], it['role']
+        spec = it['specs'][role]
+
+        def run_configure(ctx, vm=vm, role=role, spec=spec, it=it):
+            # inner interface names may have changed in stage 1, so resolve arguments now
+            vm_ip = _get_vm_primary_ip(region, vm)
+            if not vm_ip:
+                raise RuntimeError(f'no reachable IP found for vm {vm}')
+            if role == 'sw':
+                args = _sw_port_args(region, vm, it['ports'])
+                if not args:
+                    raise RuntimeError(f"no external->internal pair found for node {it['node']} ports {it['ports']}")
+                cmd_args = ['./configure_sw_bea.sh', it['node'], controller_ip, topology_reconcile.SW_CONTROLLER_PORT] + args
+                out, err = _deploy_and_run(ctx, vm_ip, ssh_user, ssh_pass, 'sw',
+                                           'sudo ./configure_sw_bea.sh ' + _quote_args(cmd_args[1:]))
+                cmd = ' '.join(cmd_args)
+            else:
+                out, err = _deploy_and_run(ctx, vm_ip, ssh_user, ssh_pass, 'host',
+                                           './configure_host_bea.sh ' + f"'{spec['ipv6']}'")
+                cmd = './configure_host_bea.sh ' + spec['ipv6']
+            topology_reconcile.record_applied(region, vm, role, spec, ctx.job_id, DB_PATH)
+            return {'cmd': cmd, 'stdout': out, 'stderr': err}
+        steps.append(jobs.Step(f'{vm} {role}', run_configure, timeout=step_timeout, stage=2))
+
+    vms = list(dict.fromkeys([it['vm'] for it in nic_items + cfg_items]))
+    return jobs.JobSpec('apply', region, steps, locks=[(region, vm) for vm in vms], payload=data,
+                        parallel=parallel)
+
+
+def _flag(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def _wants_wait(data):
+    """Blocking is opt-in: ?wait=1 / {"wait": true}, or an explicit {"async": false} from older clients."""
+    if _flag(request.args.get('wait') or data.get('wait')):
+        return True
+    flag = request.args.get('async', data.get('async'))
+    return flag is not None and not _flag(flag)
+
+
+def _run_topology_job(planner, legacy_logs=False):
+    """Plan the request into a job and return 202 with its id, or wait and answer as before.
+
+    By default the response is 202 {"job_id", "status_url"} as soon as the job is queued; progress is
+    available from /api/jobs/<id> and /api/jobs/<id>/stream, so no server thread is held for the
+    duration of the job. Requests with ?wait=1 (or {"wait": true}) block until the job finishes and
+    return the original response shape; they still go through the job engine, so they are serialized
+    against concurrent jobs on the same region / VMs.
+    """
+    data = request.get_json(force=True)
+    try:
+        spec = planner(data)
+    except _PlanError as e:
+        return jsonify({'ok': False, 'error': str(e)}), e.status
+
+    manager = jobs.get_manager(DB_PATH)
+    job_id = manager.submit(spec)
+    if not _wants_wait(data):
+        return jsonify({'ok': True, 'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+    manager.wait(job_id)
+    job = manager.get(job_id)
+    results = job['results']
+    if legacy_logs:
+        first = results[0] if results else {}
+        body = {'logs': {'stdout': first.get('stdout', ''), 'stderr': first.get('stderr', '')}}
+    else:
+        body = {'results': results}
+    if job['status'] == jobs.SUCCEEDED:
+        return jsonify(dict(ok=True, job_id=job_id, **body))
+    failed = next((s for s in job['steps'] if s['status'] == jobs.FAILED), None)
+    trace = (failed or {}).get('result') or {}
+    return jsonify(dict(ok=False, job_id=job_id, error=job['error'] or job['status'],
+                        trace=trace.get('trace', ''), **body)), 500
+
+
+@api.route('/api/topology/create_ports', methods=['POST'])
+def api_create_ports():
+    """POST payload: { region: 's05', links: ['h1-sw1','sw1-sw2', ...] }
+    Creates one standard vSwitch (security policy Accept) and a same-named port group per link on the
+    region's ESXi host (esxi_config.ESXI_IP). By default ("engine": "script") this SSHes in as
+    root/410@Bupt and runs `Creat_Port_VSitch.sh` with the link names as arguments. "engine": "native"
+    (used by the web UI) instead computes the missing objects from one read of the host's networkInfo
+    and applies them in a single UpdateNetworkConfig call, logging in to vSphere with the ESXi
+    credentials (control.ESXI_USER). Returns stdout/stderr.
+    """
+    return _run_topology_job(_plan_create_ports, legacy_logs=True)
+
+
+@api.route('/api/topology/install_ports', methods=['POST'])
+def api_install_ports():
+    """POST payload:
+    {
+      region: 's05',
+      nodes: [ {id:'h1', vm:'s05-switchpc2', ip:'10.1.2.3', ...}, ... ],
+      links: [ {id:'l1', a:'h1', b:'sw1', label:'h1-sw1'}, ... ]
+    }
+    The endpoint computes per-VM required ports and rebuilds each VM's NICs (all but the first
+    are removed, one NIC per port is added). By default ("engine": "govc") this SSHes to the controller
+    and runs rebuild_vm_nics_govc.sh per VM. "engine": "native" (used by the web UI) instead submits one
+    ReconfigVM_Task per VM for all VMs together, talking to vSphere directly with the ESXi credentials
+    (control.ESXI_USER) rather than the controller's SSH login. Optional "adapter" for native:
+    e1000 (default), e1000e, vmxnet3.
+    Returns logs per VM.
+    """
+    return _run_topology_job(_plan_install_ports)
 
 
 def _get_vm_primary_ip(esxi_key, vm_name):
@@ -273,194 +753,155 @@ def _get_vm_nic_external_internal_pairs(esxi_key, vm_name):
     return out
 
 
-@app.route('/api/topology/configure_sw', methods=['POST'])
+@api.route('/api/topology/configure_sw', methods=['POST'])
 def api_configure_sw():
     """Batch configure switches: POST payload same shape as install_ports.
     For each switch node (type!='host') find its vm, query DB for external->internal nic pairs that match the node's adjacent link labels,
     SSH to the VM and run ./configure_sw_bea.sh <bridge> <controller_ip> 6633 <exter> <iner> ...
-    If the script is missing on the VM, upload local copy from ESXI/script and chmod +x.
-    Returns per-VM results array.
+    The VM's copy of the sw script bundle (configure_sw_bea.sh, reset_sw_config.sh) is checked
+    against the local ESXI/script files by sha256 and changed files are pushed first (see script_deploy).
+    VMs are configured concurrently (payload "parallel", default CONFIGURE_PARALLEL), each limited to
+    "timeout" seconds (default CONFIGURE_STEP_TIMEOUT); a failing VM does not stop the others.
+    Returns per-VM results array in node order.
     """
-    data = request.get_json(force=True)
-    region = data.get('region')
-    nodes = data.get('nodes') or []
-    links = data.get('links') or []
+    return _run_topology_job(_plan_configure_sw)
 
-    if not region:
-        return jsonify({'ok': False, 'error': 'missing region'}), 400
 
-    # build node maps
-    node_to_vm = { n.get('id'): n.get('vm') for n in nodes if n.get('id') }
-    node_type = { n.get('id'): n.get('type') for n in nodes if n.get('id') }
-
-    node_links = { n.get('id'): [] for n in nodes if n.get('id') }
-    for l in links:
-        a = l.get('a'); b = l.get('b'); label = l.get('label') or f"{a}-{b}"
-        if a in node_links: node_links[a].append(label)
-        if b in node_links: node_links[b].append(label)
+@api.route('/api/topology/configure_host', methods=['POST'])
+def api_configure_host():
+    """Batch configure hosts: for each host node (type==='host'), SSH to its VM and run ./configure_host_bea.sh <ipv6_address>
+    ipv6_address is taken from the node.ip field in payload.
+    Runs concurrently with per-VM timeouts, like configure_sw.
+    """
+    return _run_topology_job(_plan_configure_host)
 
-    # controller IP read from controller_config.CONTROLLER.host
-    try:
-        from controller_config import CONTROLLER
-    except Exception:
-        return jsonify({'ok': False, 'error': 'controller configuration missing'}), 500
-    controller_ip = CONTROLLER.get('host')
-    if not controller_ip:
-        return jsonify({'ok': False, 'error': 'controller host not configured'}), 500
 
-    # SSH credentials for VM access: prefer explicit VM_SSH config
+@api.route('/api/topology/plan', methods=['POST'])
+def api_topology_plan():
+    """Dry run of /api/topology/apply: POST the same payload as install_ports (nodes with vm/type/ip, links),
+    optionally "force": true. Returns per-VM { vm, node, role, ports, current_ports, nics, configure, reasons }
+    and the list of VMs that would be touched.
+    """
+    data = request.get_json(force=True)
     try:
-        from vm_ssh_config import VM_SSH
-        ssh_user = VM_SSH.get('user')
-        ssh_pass = VM_SSH.get('password')
-    except Exception:
-        # fallback to controller config (legacy)
-        ssh_user = CONTROLLER.get('user')
-        ssh_pass = CONTROLLER.get('password')
-
-    if paramiko is None:
-        return jsonify({'ok': False, 'error': 'paramiko not available on server; cannot SSH'}), 500
+        region, _, items = _reconcile_plan(data)
+    except _PlanError as e:
+        return jsonify({'ok': False, 'error': str(e)}), e.status
+    for it in items:
+        it.pop('specs', None)
+    changed = [it['vm'] for it in items if it['nics'] or it['configure']]
+    return jsonify({'ok': True, 'region': region, 'plan': items, 'changed': changed})
+
+
+@api.route('/api/topology/apply', methods=['POST'])
+def api_topology_apply():
+    """Apply the topology, touching only the VMs that /api/topology/plan reports as changed.
+    Accepts "wait", "parallel", "timeout" and "force" like the batch endpoints; returns per-step results.
+    """
+    return _run_topology_job(_plan_apply)
 
-    results = []
-    # local script path to upload if missing
-    local_sw_script = os.path.join(os.path.dirname(__file__), 'script', 'configure_sw_bea.sh')
 
-    # iterate switch nodes
-    try:
-        for nid, vm in node_to_vm.items():
-            if not vm: continue
-            # consider only switch nodes (type != 'host')
-            if node_type.get(nid) == 'host':
-                continue
-            ports = node_links.get(nid, [])
-            # fetch nic mappings from DB
-            pairs = _get_vm_nic_external_internal_pairs(region, vm)
-            # build args: for each port label in ports, find pair with exter==label and non-null iner
-            args = []
-            for p in ports:
-                for pr in pairs:
-                    if pr.get('exter') == p and pr.get('iner'):
-                        args.extend([pr.get('exter'), pr.get('iner')])
-                        break
-
-            # skip if no args
-            if not args:
-                results.append({'cmd': f'{vm} (skip)', 'stdout': '', 'stderr': f'no external->internal pair found for node {nid} ports {ports}'})
-                continue
-
-            # get VM primary IP to SSH
-            vm_ip = _get_vm_primary_ip(region, vm)
-            if not vm_ip:
-                results.append({'cmd': f'{vm} (skip)', 'stdout': '', 'stderr': f'no reachable IP found for vm {vm}'})
-                continue
-
-            # build remote command
-            cmd_args = ['./configure_sw_bea.sh', nid, controller_ip, '6633'] + args
-            safe_cmd = ' '.join([f"'{str(x)}'" for x in cmd_args])
-
-            # SSH and ensure script exists/upload
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            client.connect(vm_ip, username=ssh_user, password=ssh_pass, timeout=10)
-            sftp = client.open_sftp()
-            try:
-                try:
-                    sftp.stat('./configure_sw_bea.sh')
-                except IOError:
-                    # upload local script
-                    sftp.put(local_sw_script, 'configure_sw_bea.sh')
-                    client.exec_command('chmod +x ./configure_sw_bea.sh')
-            finally:
-                sftp.close()
-
-            stdin, stdout, stderr = client.exec_command('sudo ./configure_sw_bea.sh ' + ' '.join([f"'{x}'" for x in cmd_args[1:]]))
-            out = stdout.read().decode(errors='ignore')
-            err = stderr.read().decode(errors='ignore')
-            results.append({'cmd': ' '.join(cmd_args), 'stdout': out, 'stderr': err})
-            client.close()
-
-        return jsonify({'ok': True, 'results': results})
-    except Exception as e:
-        tb = traceback.format_exc()
-        return jsonify({'ok': False, 'error': str(e), 'trace': tb, 'results': results}), 500
+@api.route('/api/jobs')
+def api_jobs():
+    """Recent jobs, newest first. Query params: region, status, limit (default 50)."""
+    limit = request.args.get('limit', default=50, type=int)
+    return jsonify(jobs.get_manager(DB_PATH).list(request.args.get('region'), request.args.get('status'),
+                                                  max(1, min(limit, 500))))
 
 
-@app.route('/api/topology/configure_host', methods=['POST'])
-def api_configure_host():
-    """Batch configure hosts: for each host node (type==='host'), SSH to its VM and run ./configure_host_bea.sh <ipv6_address>
-    ipv6_address is taken from the node.ip field in payload.
-    """
-    data = request.get_json(force=True)
-    region = data.get('region')
-    nodes = data.get('nodes') or []
-    links = data.get('links') or []
+@api.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """Job status with per-step status and results."""
+    job = jobs.get_manager(DB_PATH).get(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'error': 'job not found'}), 404
+    return jsonify(job)
 
-    if not region:
-        return jsonify({'ok': False, 'error': 'missing region'}), 400
 
-    node_to_vm = { n.get('id'): n.get('vm') for n in nodes if n.get('id') }
-    node_ip_arg = { n.get('id'): n.get('ip') for n in nodes if n.get('id') }
-    node_type = { n.get('id'): n.get('type') for n in nodes if n.get('id') }
+# seconds between SSE keepalive comments while a job produces no output
+SSE_KEEPALIVE = 15
 
-    try:
-        from vm_ssh_config import VM_SSH
-        ssh_user = VM_SSH.get('user')
-        ssh_pass = VM_SSH.get('password')
-    except Exception:
-        try:
-            from controller_config import CONTROLLER
-            ssh_user = CONTROLLER.get('user')
-            ssh_pass = CONTROLLER.get('password')
-        except Exception:
-            return jsonify({'ok': False, 'error': 'vm ssh configuration missing'}), 500
 
-    if paramiko is None:
-        return jsonify({'ok': False, 'error': 'paramiko not available on server; cannot SSH'}), 500
+def _sse(event, data, event_id=None):
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
 
-    results = []
-    local_host_script = os.path.join(os.path.dirname(__file__), 'script', 'configure_host_bea.sh')
 
+@api.route('/api/jobs/<job_id>/stream')
+def api_job_stream(job_id):
+    """Server-Sent Events for a job: `step` status changes, `line` output lines ({seq, name, stream, text})
+    and a final `end` event. Reconnecting clients resume after the Last-Event-ID header (or ?after=N).
+    Jobs that finished long ago (or in a previous server process) replay their stored step results.
+    """
+    manager = jobs.get_manager(DB_PATH)
+    job = manager.get(job_id)
+    if job is None:
+        return jsonify({'ok': False, 'error': 'job not found'}), 404
     try:
-        for nid, vm in node_to_vm.items():
-            if not vm: continue
-            if node_type.get(nid) != 'host':
-                continue
-            ipv6 = node_ip_arg.get(nid) or ''
-            if not ipv6:
-                results.append({'cmd': f'{vm} (skip)', 'stdout': '', 'stderr': f'no ipv6 argument provided for host {nid}'})
-                continue
-
-            vm_ip = _get_vm_primary_ip(region, vm)
-            if not vm_ip:
-                results.append({'cmd': f'{vm} (skip)', 'stdout': '', 'stderr': f'no reachable IP found for vm {vm}'})
-                continue
-
-            cmd_args = ['./configure_host_bea.sh', ipv6]
-
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            client.connect(vm_ip, username=ssh_user, password=ssh_pass, timeout=10)
-            sftp = client.open_sftp()
-            try:
-                try:
-                    sftp.stat('./configure_host_bea.sh')
-                except IOError:
-                    sftp.put(local_host_script, 'configure_host_bea.sh')
-                    client.exec_command('chmod +x ./configure_host_bea.sh')
-            finally:
-                sftp.close()
-
-            stdin, stdout, stderr = client.exec_command('./configure_host_bea.sh ' + f"'{ipv6}'")
-            out = stdout.read().decode(errors='ignore')
-            err = stderr.read().decode(errors='ignore')
-            results.append({'cmd': './configure_host_bea.sh ' + ipv6, 'stdout': out, 'stderr': err})
-            client.close()
-
-        return jsonify({'ok': True, 'results': results})
-    except Exception as e:
-        tb = traceback.format_exc()
-        return jsonify({'ok': False, 'error': str(e), 'trace': tb, 'results': results}), 500
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after') or 0)
+    except ValueError:
+        after = 0
+    events = manager.events(job_id)
+
+    def replay():
+        for step in job['steps']:
+            result = step['result'] or {}
+            for stream in ('stdout', 'stderr'):
+                for line in (result.get(stream) or '').splitlines():
+                    yield _sse('line', {'seq': step['seq'], 'name': step['name'], 'stream': stream, 'text': line})
+            yield _sse('step', {'seq': step['seq'], 'name': step['name'], 'status': step['status']})
+        yield _sse('end', {'status': job['status'], 'error': job['error']})
+
+    def generate():
+        last = after
+        while True:
+            batch, dropped, closed = events.read(last, timeout=SSE_KEEPALIVE)
+            if dropped:
+                yield _sse('truncated', {'dropped': dropped})
+            for event_id, event, data in batch:
+                last = event_id
+                yield _sse(event, data, event_id)
+            if closed and not batch:
+                return
+            if not batch:
+                yield ': keepalive\n\n'
+
+    body = replay() if events is None else generate()
+    return Response(stream_with_context(body), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@api.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    """Cancel a queued job, or stop a running job after its current step."""
+    manager = jobs.get_manager(DB_PATH)
+    if manager.get(job_id, with_steps=False) is None:
+        return jsonify({'ok': False, 'error': 'job not found'}), 404
+    active = manager.cancel(job_id)
+    return jsonify({'ok': True, 'job_id': job_id, 'cancelled': active})
+
+
+def create_app():
+    """Build the Flask app: the API blueprint, the web_ui assets, /metrics, response compression and profiling."""
+    import compression
+    import profiling
+    import web_assets
+
+    flask_app = Flask(__name__, static_folder=None)
+    CORS(flask_app)
+    flask_app.register_blueprint(api)
+    flask_app.register_blueprint(web_assets.assets)
+    # registered before compression so the request timing includes it (after_request runs in reverse)
+    metrics.init_app(flask_app)
+    compression.init_app(flask_app)
+    # last, so the profiled span covers the route and not the metrics / compression hooks
+    profiling.init_app(flask_app)
+    return flask_app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # development server; set ESXI_DEBUG=1 for the reloader and debugger
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('ESXI_DEBUG') == '1', threaded=True)
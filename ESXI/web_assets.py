@@ -0,0 +1,136 @@
+"""web_ui 静态文件服务：内容哈希 URL、长期缓存与预压缩。
+
+- index.html 中引用的本地文件（例如 app.js、styles.css）在返回时改写为 `app.js?v=<内容哈希>`；
+  带有与当前内容一致的 `v` 参数的请求返回 `Cache-Control: public, max-age=一年, immutable`，
+  其它请求（包括 index.html 本身）返回 `no-cache` 与 ETag，由浏览器用条件请求确认；
+- 文件内容、哈希与压缩结果（gzip / br，按需生成一次、最高压缩级别）缓存在内存中，
+  文件的 mtime 或大小变化时重新加载，无需重启服务。
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import Blueprint, Response, abort, request
+from werkzeug.security import safe_join
+
+import compression
+
+WEB_UI_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web_ui'))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# 不依赖系统注册表（Windows 上 .js 可能被识别为 text/plain，导致 ES module 无法加载）
+MIMETYPES = {
+    '.html': 'text/html', '.js': 'text/javascript', '.css': 'text/css',
+    '.json': 'application/json', '.png': 'image/png', '.svg': 'image/svg+xml',
+}
+# index.html 中需要加上版本参数的本地引用
+_LOCAL_REF = re.compile(r'''(\b(?:src|href)=["'])(?!https?:|//|/|data:|#)([^"'?#]+)(["'])''')
+
+
+class _Asset:
+    def __init__(self, body: bytes, mimetype: str, stamp: tuple, deps: tuple = ()):
+        self.body = body
+        self.mimetype = mimetype
+        self.stamp = stamp      # (mtime, size)
+        self.deps = deps        # index.html: ((相对路径, 版本), ...)
+        self.version = hashlib.sha256(body).hexdigest()[:12]
+        self.encoded = {}       # encoding -> bytes
+
+
+class AssetStore:
+    def __init__(self, root: str = WEB_UI_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._assets = {}       # 相对路径 -> _Asset
+
+    def _path(self, rel: str):
+        path = safe_join(self.root, rel)
+        return path if path and os.path.isfile(path) else None
+
+    def get(self, rel: str):
+        """返回文件的缓存条目；文件不存在时返回 None。"""
+        path = self._path(rel)
+        if path is None:
+            return None
+        st = os.stat(path)
+        stamp = (st.st_mtime, st.st_size)
+        with self._lock:
+            asset = self._assets.get(rel)
+        if asset is not None and asset.stamp == stamp and all(self.version(d) == v for d, v in asset.deps):
+            return asset
+        with open(path, 'rb') as f:
+            body = f.read()
+        ext = os.path.splitext(rel)[1].lower()
+        mimetype = MIMETYPES.get(ext) or mimetypes.guess_type(rel)[0] or 'application/octet-stream'
+        deps = ()
+        if ext == '.html':
+            body, deps = self._rewrite_refs(body, os.path.dirname(rel))
+        asset = _Asset(body, mimetype, stamp, deps)
+        with self._lock:
+            self._assets[rel] = asset
+        return asset
+
+    def version(self, rel: str):
+        asset = self.get(rel)
+        return asset.version if asset else None
+
+    def _rewrite_refs(self, body: bytes, base: str) -> tuple:
+        deps = []
+        text = body.decode('utf-8')
+
+        def repl(m):
+            rel = os.path.normpath(os.path.join(base, m.group(2))).replace(os.sep, '/')
+            version = self.version(rel)
+            if version is None:
+                return m.group(0)
+            deps.append((rel, version))
+            return f'{m.group(1)}{m.group(2)}?v={version}{m.group(3)}'
+
+        text = _LOCAL_REF.sub(repl, text)
+        return text.encode('utf-8'), tuple(deps)
+
+    def encoded(self, asset: _Asset, encoding: str) -> bytes:
+        data = asset.encoded.get(encoding)
+        if data is None:
+            quality = 11 if encoding == 'br' else 9
+            data = compression.compress(asset.body, encoding, quality)
+            asset.encoded[encoding] = data
+        return data
+
+
+store = AssetStore()
+assets = Blueprint('assets', __name__)
+
+
+def _serve(rel: str):
+    asset = store.get(rel)
+    if asset is None:
+        abort(404)
+    etag = f'W/"{asset.version}"'
+    if request.args.get('v') == asset.version:
+        cache_control = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        cache_control = 'no-cache'
+    headers = {'ETag': etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if etag in [t.strip() for t in (request.headers.get('If-None-Match') or '').split(',')]:
+        return Response(status=304, headers=headers)
+
+    body = asset.body
+    encoding = None
+    if compression.is_compressible(asset.mimetype) and len(body) >= compression.MIN_BYTES:
+        encoding = compression.choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        body = store.encoded(asset, encoding)
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype=asset.mimetype, headers=headers)
+
+
+@assets.route('/')
+def index():
+    return _serve('index.html')
+
+
+@assets.route('/<path:filename>')
+def static_file(filename):
+    return _serve(filename)
@@ -0,0 +1,23 @@
+"""生产环境入口。
+
+Linux:   gunicorn -c gunicorn.conf.py wsgi:app
+Windows: python wsgi.py            （使用 waitress，gunicorn 不支持 Windows）
+
+只运行一个进程、用多线程处理并发请求：任务引擎（jobs.py）的队列、资源锁、SSE 事件流与
+SSH 会话池都在进程内存中，多个 worker 进程会各自调度任务并在启动时把其它进程的运行中任务
+标记为失败。SSH / vSphere 等待期间线程不占用 CPU，线程数决定可同时进行的长请求数量。
+"""
+import os
+
+from web_api import create_app
+
+app = create_app()
+
+# waitress / gunicorn 共用的线程数（gunicorn.conf.py 读取同一环境变量）
+THREADS = int(os.environ.get('ESXI_THREADS', '32'))
+
+
+if __name__ == '__main__':
+    from waitress import serve
+    serve(app, host=os.environ.get('ESXI_HOST', '0.0.0.0'), port=int(os.environ.get('ESXI_PORT', '5000')),
+          threads=THREADS, channel_timeout=3600)
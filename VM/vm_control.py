@@ -8,55 +8,53 @@ import re
 import sys
 from typing import Tuple, List
 
-import paramiko
 import os
-from vm_config import *
+
+# 与 ESXI/ 目录共用的模块（内部网卡探测等）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ESXI"))
+import config_store
+import inner_iface
+import ssh_pool
 
 # ---------------- 配置 ---------------- #
 
-# 全局维护写回 vm_config.py 时要保留的配置项顺序
-GLOBAL_CONFIG_KEYS = (
-    "ESXI_IP",
-    "VM_ID",
-    "VM_IP",
-    "VM_EXTERNAL_DEVICE",# h1-sw1
-    "ESXI_USER",
-    "ESXI_PWD",
-    "VM_USER",
-    "VM_PWD",
-    "BASIC_COMMAND",
-    "VM_INER_DEVICE",# ens36
-    "VM_MAC",
-    "VM_INFO", # 从 serverconfig.py 复制过来
-)
+# VM_ID / VM_IP / VM_INER_DEVICE 等按 (配置名, 区域) 保存在 vm_config.db 中，
+# vm_config.py 只作为首次导入的种子；各 Stage 只读写自己用到的区域
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vm_config.py")
+
+
+def _store() -> config_store.ConfigStore:
+    return config_store.open_store(CONFIG_PATH)
+
+
+# 各 Stage 共用的小配置项；VM_INFO 等大表按区域在需要时读取
+ESXI_IP = _store().get_all("ESXI_IP", {})
+ESXI_USER = _store().get_all("ESXI_USER")
+ESXI_PWD = _store().get_all("ESXI_PWD")
+VM_USER = _store().get_all("VM_USER")
+VM_PWD = _store().get_all("VM_PWD")
+BASIC_COMMAND = _store().get_all("BASIC_COMMAND", {})
 
 # ------------------------------------- #
 
 def run_cmds(ip: str, cmds: List[str], user: str, pwd: str) -> List[str]:
-    """顺序执行命令并返回输出列表"""
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    """在共享 SSH 会话上顺序执行命令并返回输出列表"""
     try:
-        ssh.connect(ip, username=user, password=pwd, timeout=10)
-        results = []
-        for cmd in cmds:
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-            out = stdout.read().decode().strip()
-            err = stderr.read().decode().strip()
-            print(f"[+] 正在执行{cmd}")
-            results.append(out if not err else f"STDERR:\n{err}")
-        return results
+        with ssh_pool.get_pool().client(ip, user, pwd, timeout=10) as ssh:
+            results = []
+            for cmd in cmds:
+                stdin, stdout, stderr = ssh.exec_command(cmd)
+                out = stdout.read().decode().strip()
+                err = stderr.read().decode().strip()
+                print(f"[+] 正在执行{cmd}")
+                results.append(out if not err else f"STDERR:\n{err}")
+            return results
     except Exception as e:
         return [f"SSH 失败: {e}"] * len(cmds)
-    finally:
-        ssh.close()
 
 def stage_one_get_ip_mac(ip: str,target_vm_id: str,target_port_name: str) -> Tuple[str, str]:
-    """一次 SSH 登录 ESXi，返回 (vm_ip, mac)"""
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    try:
-        ssh.connect(ip, username=ESXI_USER, password=ESXI_PWD, timeout=10)
+    """一次 SSH 登录 ESXi（复用共享会话），返回 (vm_ip, mac)"""
+    with ssh_pool.get_pool().client(ip, ESXI_USER, ESXI_PWD, timeout=10) as ssh:
         # 两条命令一次执行完
         cmd = (
             f"sh get_ip_sin.sh {target_vm_id} 2>/dev/null | grep 'ID: {target_vm_id}' ; "
@@ -77,25 +75,18 @@ def stage_one_get_ip_mac(ip: str,target_vm_id: str,target_port_name: str) -> Tup
         # 解析 MAC（假设第二行就是纯 MAC）
         mac = out_lines[1]
         return vm_ip, mac
-    finally:
-        ssh.close()
+
+
+def stage_one_get_devices(ip: str, macs: List[str]) -> dict:
+    """一次 SSH 登录目标 VM、执行一次 ip link，返回 { mac: [接口名, ...] }（未找到为空列表）"""
+    with ssh_pool.get_pool().client(ip, VM_USER, VM_PWD, timeout=10) as ssh:
+        table = inner_iface.probe_mac_table(ssh)  # 完整的 MAC -> 内部网卡名称 表 GET_INNER_IFACE_NAME
+    return {mac: table.get(mac.strip().lower(), []) for mac in macs}
 
 
 def stage_one_get_device(ip: str, mac: str) -> str:
-    """一次 SSH 登录目标 VM，根据 MAC 取接口名"""
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    try:
-        ssh.connect(ip, username=VM_USER, password=VM_PWD, timeout=10)
-        cmd = f"ip -o link | awk -v mac='{mac}' '$0~mac{{print substr($2,1,length($2)-1)}}'" #根据mac获取 内部网卡名称 GET_INNER_IFACE_NAME
-        stdin, stdout, stderr = ssh.exec_command(cmd)
-        out = stdout.read().decode().strip()
-        err = stderr.read().decode().strip()
-        if err:
-            raise RuntimeError(err)
-        return out
-    finally:
-        ssh.close()
+    """一次 SSH 登录目标 VM，根据 MAC 取接口名（多个接口时以换行分隔）"""
+    return "\n".join(stage_one_get_devices(ip, [mac])[mac])
 
 
 def stage_one_set_hostip(ip: str, iface: str, host_ipv6: str) -> List[str]:
@@ -137,7 +128,7 @@ def Stage_One(stage_ip: str,target_vm_id: str,target_port_name: str ,host_ipv6:s
 
 def Stage_Init_VMID(esxi_ip: str) -> dict:
     """登录 ESXi，运行 `vim-cmd vmsvc/getallvms`，解析 vm name 与 vmid。
-    将结果写入同目录下的 `vm_config.py` 中的 `VM_ID` 变量。
+    将结果写入配置存储（vm_config.db）中 `VM_ID` 的该主机条目。
 
     :param esxi_ip: ESXi 管理 IP（例如 ESXI_IP['s05']）
     :return: 解析出的 mapping 字典（name->vmid）
@@ -176,28 +167,11 @@ def Stage_Init_VMID(esxi_ip: str) -> dict:
         name = parts[1]
         mapping[name] = vmid
 
-    # 读取现有 vm_config.py（如果存在），只更新 VM_ID 对应主机的部分，避免清空其它主机的数据
-    cfg_path = os.path.join(os.path.dirname(__file__), "vm_config.py")
-    existing = {}
-    try:
-        with open(cfg_path, "r", encoding="utf-8") as f:
-            code = f.read()
-            exec(code, existing)
-    except Exception:
-        existing = {}
-
-    vm_id_table = existing.get("VM_ID", {k: {} for k in ESXI_IP.keys()})
-    vm_id_table[host_key] = mapping
-    existing["VM_ID"] = vm_id_table
-
-    # 写回文件，保留已有的其它配置项（使用 GLOBAL_CONFIG_KEYS 保持一致）
-    with open(cfg_path, "w", encoding="utf-8") as f:
-        f.write("# Auto-generated by CONTROL.py Stage_Init_VMID\n")
-        for key in GLOBAL_CONFIG_KEYS:
-            if key in existing:
-                f.write(key + " = " + repr(existing[key]) + "\n\n")
+    # 只更新 VM_ID 中该主机对应的一行，其它主机的数据不受影响
+    store = _store()
+    store.set("VM_ID", host_key, mapping)
 
-    print(f"[+] 写入 {cfg_path}，主机 {host_key} 共 {len(mapping)} 个 VM 条目")
+    print(f"[+] 写入 {store.db_path}，主机 {host_key} 共 {len(mapping)} 个 VM 条目")
     return mapping
     # 结束 Stage_Init_VMID
 
@@ -207,11 +181,11 @@ def stage_two_bind_pci():
 
 def Stage_Init_VMIP(esxi_ip: str) -> dict:
     """初始化 VM IP：
-    - 从 `config.VM_ID` 读取对应 ESXi 主机的 name->vmid 映射（info_name_id）
+    - 从配置存储的 `VM_ID` 读取对应 ESXi 主机的 name->vmid 映射（info_name_id）
     - 遍历 vmid 列表，在 ESXi 上执行 `sh get_ip_sin.sh {vmid} 2>/dev/null | grep 'ID: {vmid}'` 获取输出
     - 从输出中正则提取 IPv4（样例："VM: name (ID: 26) -> IP: 10.112.138.215"）
     - 构造 vmid->ip（若未找到则为空字符串），再根据 info_name_id 生成 name->ip
-    - 将结果写回 `vm_config.py` 的 `VM_IP[host_key]`
+    - 将结果写入配置存储的 `VM_IP[host_key]`
 
     返回 name->ip 字典
     """
@@ -224,7 +198,7 @@ def Stage_Init_VMIP(esxi_ip: str) -> dict:
     if host_key is None:
         raise ValueError(f"未能在 ESXI_IP 中找到 IP: {esxi_ip}")
 
-    info_name_id = VM_ID.get(host_key, {})
+    info_name_id = _store().get("VM_ID", host_key, {})
     if not info_name_id:
         print(f"[!] VM_ID 中没有找到主机 {host_key} 的条目，跳过")
         return {}
@@ -251,25 +225,10 @@ def Stage_Init_VMIP(esxi_ip: str) -> dict:
     # 构造 name->ip
     name_ip = {name: vmid_ip.get(vmid, "") for name, vmid in info_name_id.items()}
 
-    # 写回 vm_config.py 的 VM_IP（一次性写入，保留其它配置）
-    cfg_path = os.path.join(os.path.dirname(__file__), "vm_config.py")
-    existing = {}
-    try:
-        with open(cfg_path, "r", encoding="utf-8") as f:
-            code = f.read()
-            exec(code, existing)
-    except Exception:
-        existing = {}
-    vm_ip_table = existing.get("VM_IP", {k: {} for k in ESXI_IP.keys()})
-    vm_ip_table[host_key] = name_ip
-    existing["VM_IP"] = vm_ip_table
-    with open(cfg_path, "w", encoding="utf-8") as f:
-        f.write("# Auto-generated by CONTROL.py Stage_Init_VMIP\n")
-        for key in GLOBAL_CONFIG_KEYS:
-            if key in existing:
-                f.write(key + " = " + repr(existing[key]) + "\n\n")
-
-    print(f"[+] 写入 VM_IP 到 {cfg_path}，主机 {host_key} 共 {len(name_ip)} 个 IP 条目")
+    # 只写入 VM_IP 中该主机对应的一行
+    store = _store()
+    store.set("VM_IP", host_key, name_ip)
+    print(f"[+] 写入 VM_IP 到 {store.db_path}，主机 {host_key} 共 {len(name_ip)} 个 IP 条目")
     return name_ip
     # 结束 Stage_Init_VMIP
 
@@ -282,19 +241,20 @@ def Stage_Init_INNERDEVICE(region: str):
     - 在 `VM_INFO[region]` 中查找每个 vm_ip 所属的虚拟机及匹配该 ip 的外部网卡（控制网卡）
     - 对该虚拟机收集除控制网卡外的所有外部网卡名称与 MAC 列表
     - 得到三元组列表 (vm_ip, external_mac_list, external_name_list)
-    - 对每个三元组，使用 `stage_one_get_device(vm_ip, mac)` 获取内部网卡名，构造四元组
+    - 对每个三元组，使用 `stage_one_get_devices(vm_ip, macs)` 获取内部网卡名，构造四元组
       (vm_ip, external_mac_list, external_name_list, inner_iface_list)
     - 将四元组列表中的 vm_ip 替换为虚拟机 name（根据 VM_IP 的映射），并写入
-      `vm_config.py` 的 `VM_INER_DEVICE[region]`。
+      配置存储的 `VM_INER_DEVICE[region]`。
     """
     if region not in ESXI_IP:
         raise ValueError(f"未知区域: {region}")
 
     # 从 VM_IP 中取出该区域的 name->ip 映射，得到 ip 列表
-    name_ip_map = VM_IP.get(region, {})
+    store = _store()
+    name_ip_map = store.get("VM_IP", region, {})
     vm_ip_list = [ip for ip in name_ip_map.values() if ip]
 
-    info_region = VM_INFO.get(region, {})
+    info_region = store.get("VM_INFO", region, {})
 
     ip_mac_exname = []  # list of (vm_ip, [macs], [ext_names])
     for vm_ip in vm_ip_list:
@@ -325,20 +285,18 @@ def Stage_Init_INNERDEVICE(region: str):
         if not found:
             print(f"[!] 区域 {region} 中未在 VM_INFO 找到 IP {vm_ip} 对应的 VM 条目")
 
-    # 现在对每个三元组调用 stage_one_get_device 获取内部网卡名
+    # 现在对每个三元组调用 stage_one_get_devices，每台 VM 一次 SSH 解析全部 MAC
     quad_list = []  # list of (vm_ip, ext_macs, ext_names, inner_ifaces)
     for vm_ip, ext_macs, ext_names in ip_mac_exname:
         inner_ifaces = []
+        try:
+            devices = stage_one_get_devices(vm_ip, ext_macs)
+        except Exception as e:
+            print(f"[!] 在 {vm_ip} 上根据 MAC {ext_macs} 获取内部网卡失败: {e}")
+            devices = {}
         for mac in ext_macs:
-            try:
-                iface = stage_one_get_device(vm_ip, mac)
-            except Exception as e:
-                print(f"[!] 在 {vm_ip} 上根据 MAC {mac} 获取内部网卡失败: {e}")
-                iface = ""
-            if iface:
-                # stage_one_get_device 可能返回多行/多个接口，用逗号分割
-                parts = [p.strip() for p in iface.split() if p.strip()]
-                inner_ifaces.extend(parts)
+            # 同一 MAC 可能对应多个接口（如 OVS 网桥与其端口），全部保留
+            inner_ifaces.extend(devices.get(mac, []))
         quad_list.append((vm_ip, ext_macs, ext_names, inner_ifaces))
 
     # 将 vm_ip 替换为 vm name（根据 name_ip_map）
@@ -348,27 +306,9 @@ def Stage_Init_INNERDEVICE(region: str):
         vm_name = ip_to_name.get(vm_ip, vm_ip)
         quad_named.append((vm_name, ext_macs, ext_names, inner_ifaces))
 
-    # 写回 vm_config.py 的 VM_INER_DEVICE
-    cfg_path = os.path.join(os.path.dirname(__file__), "vm_config.py")
-    existing = {}
-    try:
-        with open(cfg_path, "r", encoding="utf-8") as f:
-            code = f.read()
-            exec(code, existing)
-    except Exception:
-        existing = {}
-
-    vm_iner_table = existing.get("VM_INER_DEVICE", {k: [] for k in ESXI_IP.keys()})
-    vm_iner_table[region] = quad_named
-    existing["VM_INER_DEVICE"] = vm_iner_table
-
-    with open(cfg_path, "w", encoding="utf-8") as f:
-        f.write("# Auto-generated by CONTROL.py Stage_Init_INNERDEVICE\n")
-        for key in GLOBAL_CONFIG_KEYS:
-            if key in existing:
-                f.write(key + " = " + repr(existing[key]) + "\n\n")
-
-    print(f"[+] 写入 VM_INER_DEVICE 到 {cfg_path}，区域 {region} 共 {len(quad_named)} 条记录")
+    # 只写入 VM_INER_DEVICE 中该区域对应的一行
+    store.set("VM_INER_DEVICE", region, quad_named)
+    print(f"[+] 写入 VM_INER_DEVICE 到 {store.db_path}，区域 {region} 共 {len(quad_named)} 条记录")
     return quad_named
     # 结束 Stage_Init_INNERDEVICE
 
@@ -379,7 +319,7 @@ def Stage_Two():
 def print_vm_iner_device(region: str) -> None:
     """Print VM_INER_DEVICE for a region as: pcname -> mac - external_name - internal_name"""
     try:
-        vm_iner = VM_INER_DEVICE.get(region, [])
+        vm_iner = _store().get("VM_INER_DEVICE", region, [])
     except Exception:
         print(f"[!] VM_INER_DEVICE not defined or missing region {region}")
         return
@@ -416,20 +356,20 @@ def main() -> None:
     # print(VM_EXTERNAL_DEVICE["s05"]["h2"])
     # Stage_One(ESXI_IP["s05"],"29","h2-sw2","2001:db8:2::1/64")
     # 第一阶段 设置s05的h2机器的拓扑中的网卡的IP地址为2001:db8:2::1/64
-    # 示例：先初始化并写入 vm_config.py，然后再使用 Stage_One
-    # Stage_Init_VMID(ESXI_IP['s05'])  # 运行后会在脚本目录生成/更新 vm_config.py 的 VM_ID
+    # 示例：先初始化并写入配置存储，然后再使用 Stage_One
+    # Stage_Init_VMID(ESXI_IP['s05'])  # 运行后会更新配置存储中该主机的 VM_ID
     # Stage_One(ESXI_IP["s05"],VM_ID["s05"]["s05-switchpc1"],VM_EXTERNAL_DEVICE["s05"]["s05-switchpc1"][0],"2001:db8:1::1/64")
 
-    # [+]获取某个区域所有的虚拟机ID，并写入 vm_config.py 的 VM_ID
+    # [+]获取某个区域所有的虚拟机ID，并写入配置存储的 VM_ID
     mapping = Stage_Init_VMID(ESXI_IP['s05'])
     print(mapping)
 
 
-    # [+]初始化某个区域所有虚拟机的IP，并写入 vm_config.py 的 VM_IP 控制的IP地址
+    # [+]初始化某个区域所有虚拟机的IP，并写入配置存储的 VM_IP 控制的IP地址
     ipmap = Stage_Init_VMIP(ESXI_IP['s05'])
     print(ipmap)
 
-    # [+]初始化某个区域所有虚拟机的内部网卡名称，保存到 vm_config.py 的 VM_INER_DEVICE 
+    # [+]初始化某个区域所有虚拟机的内部网卡名称，保存到配置存储的 VM_INER_DEVICE 
     Stage_Init_INNERDEVICE('s05')
     # 打印结果
     # print_vm_iner_device('s05')
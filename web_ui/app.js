@@ -99,6 +99,8 @@ const App = {
   const hostResults = ref([])
   const swCollapsed = ref(true)
   const hostCollapsed = ref(true)
+  // live progress of the running topology job: { kind, status, steps: [{ seq, name, status, lines: [] }] }
+  const liveJob = ref(null)
   const topologyConfirmed = ref(false)
   const nodeVmMap = reactive({}) // nodeId -> vmName
   const availableVms = ref([]) // list of vm names for current region (filtered)
@@ -229,6 +231,63 @@ const App = {
       const a = document.createElement('a'); a.href = url; a.download = (topology.region?topology.region+'-':'')+'topology.json'; document.body.appendChild(a); a.click(); a.remove(); URL.revokeObjectURL(url)
     }
 
+    // max output lines kept per step in the live progress panel
+    const LIVE_LINES_LIMIT = 500
+
+    function liveStep(seq, name){
+      const steps = liveJob.value.steps
+      let st = steps.find(x => x.seq === seq)
+      if(!st){ st = { seq, name, status: 'pending', lines: [] }; steps.push(st); steps.sort((a, b) => a.seq - b.seq) }
+      return st
+    }
+
+    // follow /api/jobs/<id>/stream (SSE) until the `end` event; resolves false if the stream is unavailable
+    function streamJob(jobId){
+      return new Promise(resolve => {
+        if(!window.EventSource){ resolve(false); return }
+        const es = new EventSource(`/api/jobs/${jobId}/stream`)
+        es.addEventListener('job', e => { liveJob.value.status = JSON.parse(e.data).status })
+        es.addEventListener('step', e => { const d = JSON.parse(e.data); liveStep(d.seq, d.name).status = d.status })
+        es.addEventListener('line', e => {
+          const d = JSON.parse(e.data)
+          const st = liveStep(d.seq, d.name)
+          st.lines.push((d.stream === 'stderr' ? '! ' : '') + d.text)
+          if(st.lines.length > LIVE_LINES_LIMIT) st.lines.splice(0, st.lines.length - LIVE_LINES_LIMIT)
+        })
+        es.addEventListener('end', e => { liveJob.value.status = JSON.parse(e.data).status; es.close(); resolve(true) })
+        // EventSource reconnects by itself (resuming from Last-Event-ID); give up only when it is closed for good
+        es.onerror = () => { if(es.readyState === EventSource.CLOSED) resolve(false) }
+      })
+    }
+
+    // submit a topology operation as a background job, show its output live and return the finished job.
+    // Falls back to polling /api/jobs/<id> when the event stream is not available;
+    // onUpdate(job) is called after every poll so partial per-VM results can be shown while it runs.
+    async function runJob(url, payload, onUpdate){
+      const r = await fetch(url, { method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(Object.assign({}, payload, { async: true })) })
+      const j = await r.json()
+      if(!j.ok || !j.job_id) return { status: 'failed', error: j.error || JSON.stringify(j), results: [] }
+      liveJob.value = { id: j.job_id, kind: url.split('/').pop(), status: 'queued', steps: [] }
+      const streamed = await streamJob(j.job_id)
+      while(true){
+        if(!streamed) await new Promise(res => setTimeout(res, 1000))
+        const jr = await fetch(`/api/jobs/${j.job_id}`)
+        const job = await jr.json()
+        if(onUpdate) onUpdate(job)
+        if(['succeeded', 'failed', 'cancelled'].includes(job.status)){ liveJob.value.status = job.status; return job }
+      }
+    }
+
+    async function cancelLiveJob(){
+      if(!liveJob.value) return
+      await fetch(`/api/jobs/${liveJob.value.id}/cancel`, { method:'POST' })
+    }
+
+    function jobError(job){
+      const failed = (job.steps || []).find(s => s.status === 'failed')
+      return (job.error || job.status) + (failed && failed.result && failed.result.trace ? '\n' + failed.result.trace : '')
+    }
+
     // create ports by calling backend API
     async function createPorts(){
       if(!topology.region){ showModal('请选择区域', 'error'); return }
@@ -237,11 +296,11 @@ const App = {
       creating.value = true
       createLogs.value = ''
       try{
-        const payload = { region: topology.region, links: linkNames }
-        const r = await fetch('/api/topology/create_ports', { method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(payload) })
-        const j = await r.json()
-        if(j.ok){ createLogs.value = (j.logs && (j.logs.stdout || '') ) + '\n' + (j.logs && (j.logs.stderr || '') ) }
-        else { createLogs.value = 'ERROR: ' + (j.error || JSON.stringify(j)) + '\n' + (j.trace || '') }
+        const payload = { region: topology.region, links: linkNames, engine: 'native' }
+        const job = await runJob('/api/topology/create_ports', payload)
+        const res = (job.results && job.results[0]) || {}
+        if(job.status === 'succeeded'){ createLogs.value = (res.stdout || '') + '\n' + (res.stderr || '') }
+        else { createLogs.value = 'ERROR: ' + jobError(job) }
       }catch(e){ createLogs.value = String(e) }
       creating.value = false
     }
@@ -264,7 +323,7 @@ const App = {
       window.__vmInfo = vmInfo
       if(!topology.region) return
       try{
-        const r = await fetch(`/api/inventory/${topology.region}`)
+        const r = await fetch(`/api/inventory/${topology.region}?fields=name,nics.ips`)
         const j = await r.json()
         const vms = Array.isArray(j.vms) ? j.vms : []
         // filter VMs that have nic info
@@ -369,15 +428,14 @@ const App = {
       installInProgress.value = true
       installResults.value = []
       try{
-        const payload = { region: topology.region, nodes, links }
-        const r = await fetch('/api/topology/install_ports', { method:'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify(payload) })
-        const j = await r.json()
-        if(j.ok){
-          installResults.value = j.results || []
+        const payload = { region: topology.region, nodes, links, engine: 'native' }
+        const job = await runJob('/api/topology/install_ports', payload, j => { installResults.value = j.results || [] })
+        installResults.value = job.results || []
+        if(job.status === 'succeeded'){
           installCollapsed.value = false
           showModal('安装任务已完成，查看下方结果', 'success')
         }else{
-          showModal('安装失败: ' + (j.error || JSON.stringify(j)), 'error', 6000)
+          showModal('安装失败: ' + jobError(job), 'error', 6000)
         }
       }catch(e){ showModal('安装出错: ' + String(e), 'error', 6000) }
       installInProgress.value = false
@@ -392,10 +450,10 @@ const App = {
       swResults.value = []
       try{
         const payload = { region: topology.region, nodes, links }
-        const r = await fetch('/api/topology/configure_sw', { method:'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify(payload) })
-        const j = await r.json()
-        if(j.ok){ swResults.value = j.results || []; swCollapsed.value = false; showModal('批量配置sw完成，查看下方结果', 'success') }
-        else { showModal('批量配置sw 失败: ' + (j.error || JSON.stringify(j)), 'error', 6000) }
+        const job = await runJob('/api/topology/configure_sw', payload, j => { swResults.value = j.results || [] })
+        swResults.value = job.results || []
+        if(job.status === 'succeeded'){ swCollapsed.value = false; showModal('批量配置sw完成，查看下方结果', 'success') }
+        else { showModal('批量配置sw 失败: ' + jobError(job), 'error', 6000) }
       }catch(e){ showModal('批量配置sw 出错: ' + String(e), 'error', 6000) }
       swInProgress.value = false
     }
@@ -409,10 +467,10 @@ const App = {
       hostResults.value = []
       try{
         const payload = { region: topology.region, nodes, links }
-        const r = await fetch('/api/topology/configure_host', { method:'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify(payload) })
-        const j = await r.json()
-        if(j.ok){ hostResults.value = j.results || []; hostCollapsed.value = false; showModal('批量配置host完成，查看下方结果', 'success') }
-        else { showModal('批量配置host 失败: ' + (j.error || JSON.stringify(j)), 'error', 6000) }
+        const job = await runJob('/api/topology/configure_host', payload, j => { hostResults.value = j.results || [] })
+        hostResults.value = job.results || []
+        if(job.status === 'succeeded'){ hostCollapsed.value = false; showModal('批量配置host完成，查看下方结果', 'success') }
+        else { showModal('批量配置host 失败: ' + jobError(job), 'error', 6000) }
       }catch(e){ showModal('批量配置host 出错: ' + String(e), 'error', 6000) }
       hostInProgress.value = false
     }
@@ -578,7 +636,8 @@ const App = {
   vmDisplayFor, handleVmSelect,
       installPorts, installInProgress, installResults, installCollapsed,
       batchConfigureSw, batchConfigureHost,
-      swInProgress, hostInProgress, swResults, hostResults, swCollapsed, hostCollapsed
+      swInProgress, hostInProgress, swResults, hostResults, swCollapsed, hostCollapsed,
+      liveJob, cancelLiveJob
     }
   },
   template: `
@@ -758,6 +817,18 @@ const App = {
                         <pre class="logs" v-if="createLogs">{{ createLogs }}</pre>
                       </div>
 
+                      <!-- live progress of the current job, one block per VM / step -->
+                      <div v-if="liveJob" style="margin-top:8px">
+                        <div style="display:flex;justify-content:space-between;align-items:center">
+                          <div style="font-weight:600">实时进度 {{ liveJob.kind }}: {{ liveJob.status }}</div>
+                          <button v-if="['queued', 'running'].includes(liveJob.status)" class="tool-btn" @click.prevent="cancelLiveJob">取消</button>
+                        </div>
+                        <div v-for="st in liveJob.steps" :key="st.seq" class="card" style="margin-top:6px;padding:8px">
+                          <div style="font-weight:700">{{ st.name }} <span class="small">{{ st.status }}</span></div>
+                          <pre class="logs" v-if="st.lines.length">{{ st.lines.join('\\n') }}</pre>
+                        </div>
+                      </div>
+
                       <!-- persistent batch buttons: always visible even if topologyConfirmed is false -->
                       <div style="display:flex;gap:8px;margin-top:8px">
                         <button class="tool-btn" @click.prevent="batchConfigureSw" :disabled="swInProgress">{{ swInProgress ? '批量配置中...' : '批量配置sw' }}</button>